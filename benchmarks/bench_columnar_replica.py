@@ -0,0 +1,247 @@
+"""筛选查询基准测试：MySQL 明细表 对比 本地列式副本（Parquet + DuckDB）
+
+需要可连接的MySQL和已导入的明细数据，以及 duckdb、pyarrow。
+先把明细表全量同步到临时目录的列式副本（输出同步速度 行/秒），再对同一组查询比较耗时并核对结果一致。
+其中一条查询故意把兑奖单位参数改成带尾部空格的写法，核对副本的字符串比较与 MySQL 排序规则一致。
+用法: python benchmarks/bench_columnar_replica.py [重复次数]
+      python benchmarks/bench_columnar_replica.py --sample [行数] [重复次数]
+连接配置与应用相同，可用环境变量 LOTTERY_DB_HOST / LOTTERY_DB_USER / LOTTERY_DB_PASSWORD / LOTTERY_DB_NAME 覆盖
+
+--sample 不连接 MySQL：用模拟数据（约 1% 的兑奖单位和售出站点带尾部空格或改为小写）建副本，
+只测副本的同步速度和查询耗时，并与按 utf8mb4_general_ci 规则（忽略大小写和尾部空格）计算的
+pandas 参考结果核对。MySQL 一侧的耗时和加速比只能用第一种用法在有数据的库上测。
+
+MySQL 一侧的耗时和加速比暂无参考结果。副本的查询改写另有 tests/test_columnar_replica.py 按 build_query 的各类条件核对排序规则下的结果。
+
+参考结果（--sample 1000000 3，pandas 3.0.6，duckdb 1.5.6，pyarrow 25.0.1）:
+    同步列式副本: 1000000 行，用时 30.14 秒，33,178 行/秒
+    查询                    副本(s)      与参考一致
+    总数                    0.035          是
+    按单位+日期计数              0.056          是
+    单位计数(尾部空格)            0.040          是
+    站点关系汇总                0.175          是
+    按玩法汇总                 0.068          是
+    单位明细                  0.412          是
+"""
+import os
+import sys
+import tempfile
+import time
+
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pymysql
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from lottery_app import ColumnarReplica, LotteryDatabase  # noqa: E402
+from sample_data import make_detail_frame  # noqa: E402
+
+TABLE = "各奖等中奖明细表"
+RESULT_COLUMNS = ("id, `序号`, `兑奖单位`, `方案名称`, `方案代码`, `生产批次`, `彩票流水号`, `售出站点`, "
+                  "`售出时间`, `兑奖站点`, NULLIF(`兑奖时间`, '1000-01-01 00:00:00') AS `兑奖时间`, "
+                  "`等级`, `兑奖金额`, created_at")
+SITE_RELATION = "CASE WHEN `售出站点` <=> `兑奖站点` THEN '一致' ELSE '不一致' END"
+
+
+def connect():
+    """与应用相同的连接配置（LotteryDatabase.db_config，同样可用环境变量覆盖）"""
+    return pymysql.connect(**LotteryDatabase().db_config)
+
+
+def build_queries(cursor):
+    """与 build_query 生成的语句形式相同的几类典型查询"""
+    cursor.execute(f"SELECT `兑奖单位` FROM {TABLE} GROUP BY `兑奖单位` ORDER BY COUNT(*) DESC LIMIT 1")
+    region = cursor.fetchone()[0]
+    cursor.execute(f"SELECT MIN(`兑奖时间`), MAX(`兑奖时间`) FROM {TABLE} WHERE `兑奖时间` > '1000-01-01 23:59:59'")
+    min_time, max_time = cursor.fetchone()
+    middle = min_time + (max_time - min_time) / 2
+    date_range = [f"{middle:%Y-%m-01} 00:00:00", f"{max_time:%Y-%m-%d} 23:59:59"]
+    return build_queries_for(region, date_range)
+
+
+def build_queries_for(region, date_range):
+    """按给定的兑奖单位和时间范围生成查询"""
+    return [
+        ("总数", f"SELECT COUNT(*) AS `记录数` FROM {TABLE} WHERE 1=1", []),
+        ("按单位+日期计数",
+         f"SELECT COUNT(*) AS `记录数` FROM {TABLE} WHERE 1=1 AND 兑奖单位 = %s AND 兑奖时间 >= %s AND 兑奖时间 < %s",
+         [region] + date_range),
+        ("单位计数(尾部空格)",
+         f"SELECT COUNT(*) AS `记录数` FROM {TABLE} WHERE 1=1 AND 兑奖单位 = %s",
+         [region + "  "]),
+        ("站点关系汇总",
+         f"SELECT `兑奖单位` AS `兑奖单位`, {SITE_RELATION} AS `站点关系`, COUNT(*) AS `记录数`, SUM(`兑奖金额`) AS `总金额` "
+         f"FROM {TABLE} WHERE 1=1 AND 兑奖时间 >= %s AND 兑奖时间 < %s "
+         f"GROUP BY `兑奖单位`, `站点关系` ORDER BY `兑奖单位`, `站点关系`",
+         date_range),
+        ("按玩法汇总",
+         f"SELECT `方案名称`, COUNT(*) AS `记录数`, SUM(`兑奖金额`) AS `总金额` FROM {TABLE} WHERE 1=1 "
+         f"GROUP BY `方案名称` ORDER BY `总金额` DESC",
+         []),
+        ("单位明细",
+         f"SELECT {RESULT_COLUMNS} FROM {TABLE} WHERE 1=1 AND 兑奖单位 = %s AND 兑奖时间 >= %s AND 兑奖时间 < %s "
+         f"ORDER BY id",
+         [region] + date_range),
+    ]
+
+
+def normalize(df):
+    """统一类型和行顺序后再比较（分组显示值按排序规则规范化：MySQL 显示组内任意一行的值）"""
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.is_string_dtype(df[col]) and not df[col].map(lambda v: isinstance(v, Decimal)).any():
+            df[col] = df[col].str.lower().str.rstrip(' ')
+        if df[col].dtype == object:
+            converted = pd.to_numeric(df[col], errors='coerce')
+            if converted.notna().sum() == df[col].notna().sum():
+                df[col] = converted
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = df[col].astype('datetime64[ns]')
+        elif pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = df[col].astype(float).round(2)
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+
+def timed(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def make_sample_frame(rows):
+    """模拟明细：约 1% 的兑奖单位带尾部空格、1% 的售出站点改为小写加尾部空格（MySQL 中与原值相等）"""
+    df = make_detail_frame(rows)
+    rng = np.random.default_rng(1)
+    padded = rng.random(rows) < 0.01
+    df.loc[padded, '兑奖单位'] = df.loc[padded, '兑奖单位'] + ' '
+    lowered = rng.random(rows) < 0.01
+    df.loc[lowered, '售出站点'] = df.loc[lowered, '售出站点'].str.replace('站点', '站点x', regex=False) + ' '
+    df.loc[~lowered, '售出站点'] = df.loc[~lowered, '售出站点'].str.replace('站点', '站点X', regex=False)
+    df['兑奖站点'] = df['兑奖站点'].str.replace('站点', '站点X', regex=False)
+    df['兑奖金额'] = [Decimal(int(value)) for value in df['兑奖金额']]
+    df['created_at'] = pd.Timestamp('2026-01-01')
+    return df
+
+
+def collate(series):
+    """utf8mb4_general_ci 的比较值：忽略大小写和尾部空格"""
+    return series.str.lower().str.rstrip(' ')
+
+
+def sample_queries(df):
+    """与 build_queries 相同形式的查询，以及按排序规则计算的参考结果"""
+    region = df['兑奖单位'].value_counts().index[0].rstrip(' ')
+    date_range = ["2025-07-01 00:00:00", "2025-12-31 23:59:59"]
+    redeem_time = df['兑奖时间']
+    in_range = (redeem_time >= date_range[0]) & (redeem_time < date_range[1])
+    region_key = collate(df['兑奖单位'])
+    same_site = collate(df['售出站点']) == collate(df['兑奖站点'])
+    amount = df['兑奖金额'].astype(float)
+
+    relation = pd.DataFrame({
+        '兑奖单位': region_key, '站点关系': np.where(same_site, '一致', '不一致'), '兑奖金额': amount,
+    })[in_range]
+    relation = relation.groupby(['兑奖单位', '站点关系']).agg(记录数=('兑奖金额', 'size'), 总金额=('兑奖金额', 'sum'))
+    methods = pd.DataFrame({'方案名称': collate(df['方案名称']), '兑奖金额': amount})
+    methods = methods.groupby('方案名称').agg(记录数=('兑奖金额', 'size'), 总金额=('兑奖金额', 'sum'))
+    region_rows = region_key == region.lower()
+
+    queries = build_queries_for(region, date_range)
+    expected = {
+        "总数": pd.DataFrame({'记录数': [len(df)]}),
+        "按单位+日期计数": pd.DataFrame({'记录数': [int((region_rows & in_range).sum())]}),
+        "单位计数(尾部空格)": pd.DataFrame({'记录数': [int(region_rows.sum())]}),
+        "站点关系汇总": relation.reset_index(),
+        "按玩法汇总": methods.reset_index(),
+        "单位明细": pd.DataFrame({'id': df.loc[region_rows & in_range, 'id'].to_numpy()}),
+    }
+    return [(name, query, params, expected[name]) for name, query, params in queries]
+
+
+def run_sample(rows, repeat):
+    """不连接 MySQL，只测列式副本：同步速度、查询耗时和与排序规则参考结果的一致性"""
+    df = make_sample_frame(rows)
+    columns = list(df.columns)
+
+    with tempfile.TemporaryDirectory() as root_dir:
+        replica = ColumnarReplica(root_dir, TABLE)
+
+        def read_rows_between(after_id, upper_id):
+            for start in range(0, len(df), 100000):
+                chunk = df.iloc[start:start + 100000]
+                yield columns, list(chunk.itertuples(index=False, name=None))
+
+        start = time.perf_counter()
+        synced = replica.refresh(read_rows_between, int(df['id'].iloc[-1]))
+        elapsed = time.perf_counter() - start
+        print(f"同步列式副本: {synced} 行，用时 {elapsed:.2f} 秒，{synced / elapsed:,.0f} 行/秒")
+
+        print(f"{'查询':<16} {'副本(s)':>10} {'与参考一致':>10}")
+        for name, query, params, expected in sample_queries(df):
+            result, replica_time = timed(lambda: replica.query_frame(query, params), repeat)
+            if name == "单位明细":
+                same = result['id'].tolist() == expected['id'].tolist()
+            else:
+                same = normalize(result).equals(normalize(expected[list(result.columns)]))
+            print(f"{name:<16} {replica_time:>10.3f} {'是' if same else '否':>10}")
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--sample':
+        rows = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+        repeat = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+        run_sample(rows, repeat)
+        return
+
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    connection = connect()
+    cursor = connection.cursor()
+
+    with tempfile.TemporaryDirectory() as root_dir:
+        replica = ColumnarReplica(root_dir, TABLE)
+
+        def read_rows_between(after_id, upper_id):
+            stream = connection.cursor(pymysql.cursors.SSCursor)
+            try:
+                stream.execute(
+                    f"SELECT {RESULT_COLUMNS} FROM {TABLE} WHERE id > %s AND id <= %s ORDER BY id",
+                    (after_id, upper_id)
+                )
+                columns = [column[0] for column in stream.description]
+                while True:
+                    rows = stream.fetchmany(100000)
+                    if not rows:
+                        break
+                    yield columns, rows
+            finally:
+                stream.close()
+
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {TABLE}")
+        upper_id = cursor.fetchone()[0]
+        start = time.perf_counter()
+        rows = replica.refresh(read_rows_between, upper_id)
+        elapsed = time.perf_counter() - start
+        print(f"同步列式副本: {rows} 行，用时 {elapsed:.2f} 秒，{rows / elapsed:,.0f} 行/秒")
+
+        print(f"{'查询':<16} {'MySQL(s)':>10} {'副本(s)':>10} {'加速比':>8} {'结果一致':>8}")
+        try:
+            for name, query, params in build_queries(cursor):
+                mysql_result, mysql_time = timed(lambda: pd.read_sql(query, connection, params=params), repeat)
+                replica_result, replica_time = timed(lambda: replica.query_frame(query, params), repeat)
+                same = normalize(mysql_result).equals(normalize(replica_result))
+                print(f"{name:<16} {mysql_time:>10.3f} {replica_time:>10.3f} "
+                      f"{mysql_time / replica_time:>7.1f}x {'是' if same else '否':>8}")
+        finally:
+            connection.close()
+
+
+if __name__ == "__main__":
+    main()
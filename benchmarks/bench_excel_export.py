@@ -0,0 +1,56 @@
+"""Excel导出基准测试：pd.ExcelWriter(openpyxl) 对比 只写模式分块写入
+
+用法: python benchmarks/bench_excel_export.py [行数 ...]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from lottery_app import dataframe_row_chunks, write_rows_to_excel  # noqa: E402
+from sample_data import make_detail_frame  # noqa: E402
+
+
+def measure(func):
+    """返回 (耗时秒, Python峰值内存MB)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def excel_writer_export(df, path):
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='彩票数据')
+
+
+def write_only_export(df, path):
+    write_rows_to_excel(path, list(df.columns), dataframe_row_chunks(df), '彩票数据')
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [50000, 200000]
+    print(f"{'行数':>10} {'方式':<16} {'耗时(s)':>10} {'峰值内存(MB)':>14}")
+    for rows in sizes:
+        df = make_detail_frame(rows)
+        for name, func in [("ExcelWriter", excel_writer_export), ("只写模式分块", write_only_export)]:
+            fd, path = tempfile.mkstemp(suffix=".xlsx")
+            os.close(fd)
+            try:
+                elapsed, peak = measure(lambda: func(df, path))
+            finally:
+                os.remove(path)
+            print(f"{rows:>10} {name:<16} {elapsed:>10.2f} {peak:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
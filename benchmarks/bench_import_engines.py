@@ -0,0 +1,99 @@
+"""导入吞吐量基准测试：executemany INSERT IGNORE 对比 LOAD DATA LOCAL INFILE
+
+需要可连接的MySQL（服务器开启 local_infile），在临时表上测试，结束后删除。
+两种方式都按应用的写入方式带上去重哈希 ticket_hash（executemany 在客户端计算，LOAD DATA 由服务端计算），
+并核对写入的行数和哈希一致。模拟的兑奖时间带毫秒，和应用一样先用 round_to_seconds 舍入到秒再交给两种方式。
+用法: python benchmarks/bench_import_engines.py [行数 ...]
+连接配置与应用相同，可用环境变量 LOTTERY_DB_HOST / LOTTERY_DB_USER / LOTTERY_DB_PASSWORD / LOTTERY_DB_NAME 覆盖
+输出每种方式的 行/秒，以及写入结果（行数和哈希校验和）是否与 executemany 一致。
+
+参考结果: 暂无。测得前应用的默认导入方式仍为 executemany 批量插入。
+客户端与服务端去重哈希的一致性另有 tests/test_ticket_hash.py 覆盖。
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pymysql
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from lottery_app import (  # noqa: E402
+    LotteryDatabase, build_load_data_sql, compute_ticket_hashes, round_to_seconds, ticket_hash_sql,
+    write_load_data_file,
+)
+from sample_data import make_detail_frame  # noqa: E402
+
+SOURCE_TABLE = "各奖等中奖明细表"
+BENCH_TABLE = "bench_import_engines"
+DB_COLUMNS = ['序号', '兑奖单位', '方案名称', '方案代码', '生产批次', '彩票流水号',
+              '售出站点', '售出时间', '兑奖站点', '兑奖时间', '等级', '兑奖金额']
+
+
+def connect():
+    """与应用相同的连接配置（LotteryDatabase.db_config，已开启 local_infile，同样可用环境变量覆盖）"""
+    return pymysql.connect(**LotteryDatabase().db_config)
+
+
+def executemany_insert(cursor, df):
+    columns = DB_COLUMNS + ['ticket_hash']
+    placeholders = ', '.join(['%s'] * len(columns))
+    column_list = ', '.join(f"`{column}`" for column in columns)
+    insert_sql = f"INSERT IGNORE INTO {BENCH_TABLE} ({column_list}) VALUES ({placeholders})"
+    df = df.assign(ticket_hash=compute_ticket_hashes(df))
+    data_tuples = [tuple(row) for row in df[columns].itertuples(index=False)]
+    cursor.executemany(insert_sql, data_tuples)
+
+
+def load_data_insert(cursor, df):
+    fd, path = tempfile.mkstemp(suffix=".tsv")
+    os.close(fd)
+    try:
+        write_load_data_file(df, path)
+        cursor.execute(build_load_data_sql(
+            BENCH_TABLE, DB_COLUMNS, path, set_clause=f"ticket_hash = {ticket_hash_sql()}"
+        ))
+    finally:
+        os.remove(path)
+
+
+def table_digest(cursor):
+    """写入结果摘要：行数和全部去重哈希的校验和"""
+    cursor.execute(f"SELECT COUNT(*), SUM(CRC32(ticket_hash)) FROM {BENCH_TABLE}")
+    return cursor.fetchone()
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100000, 500000]
+    connection = connect()
+    cursor = connection.cursor()
+    print(f"{'行数':>10} {'方式':<12} {'耗时(s)':>10} {'行/秒':>12} {'结果一致':>8}")
+    try:
+        for rows in sizes:
+            df = make_detail_frame(rows)[DB_COLUMNS]
+            # 带毫秒的时间按应用的清洗规则舍入到秒，两种方式存入相同的值
+            millis = pd.to_timedelta(np.random.default_rng(2).integers(0, 1000, rows), unit='ms')
+            for col in ['兑奖时间', '售出时间']:
+                df[col] = round_to_seconds(df[col] + millis)
+            digests = []
+            for name, func in [("executemany", executemany_insert), ("LOAD DATA", load_data_insert)]:
+                cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+                cursor.execute(f"CREATE TABLE {BENCH_TABLE} LIKE {SOURCE_TABLE}")
+                start = time.perf_counter()
+                func(cursor, df)
+                connection.commit()
+                elapsed = time.perf_counter() - start
+                digests.append(table_digest(cursor))
+                same = '是' if digests[-1] == digests[0] else '否'
+                print(f"{rows:>10} {name:<12} {elapsed:>10.2f} {rows / elapsed:>12,.0f} {same:>8}")
+    finally:
+        cursor.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""基准测试用的模拟兑奖明细数据"""
+import numpy as np
+import pandas as pd
+
+
+def make_detail_frame(rows, seed=0):
+    """生成与各奖等中奖明细表结构相同的模拟数据"""
+    rng = np.random.default_rng(seed)
+    regions = np.array([f"{name}市" for name in "甲乙丙丁戊己庚辛壬癸"])
+    methods = np.array([f"玩法{i:02d}" for i in range(40)])
+    levels = np.array(["一等奖", "二等奖", "三等奖", "四等奖", "五等奖"])
+    sites = np.array([f"站点{i:05d}" for i in range(3000)])
+    
+    sale_site = rng.integers(0, len(sites), rows)
+    # 大约七成在售出站点兑奖
+    redeem_site = np.where(rng.random(rows) < 0.7, sale_site, rng.integers(0, len(sites), rows))
+    redeem_time = pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365 * 86400, rows), unit="s")
+    sale_time = redeem_time - pd.to_timedelta(rng.integers(0, 30 * 86400, rows), unit="s")
+    method_index = rng.integers(0, len(methods), rows)
+    
+    return pd.DataFrame({
+        'id': np.arange(1, rows + 1),
+        '序号': np.arange(1, rows + 1).astype(str),
+        '兑奖单位': regions[rng.integers(0, len(regions), rows)],
+        '方案名称': methods[method_index],
+        '方案代码': np.char.add("F", method_index.astype(str)),
+        '生产批次': rng.integers(1, 50, rows).astype(str),
+        '彩票流水号': np.char.add("T", np.arange(rows).astype(str)),
+        '售出站点': sites[sale_site],
+        '售出时间': sale_time,
+        '兑奖站点': sites[redeem_site],
+        '兑奖时间': redeem_time,
+        '等级': levels[rng.integers(0, len(levels), rows)],
+        '兑奖金额': rng.choice([5, 10, 20, 50, 100, 500, 1000], rows).astype(float),
+    })
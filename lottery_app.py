@@ -1,33 +1,1293 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import pymysql
+from openpyxl import Workbook, load_workbook
 from datetime import datetime, timedelta
 import logging
 import io
 import time
 import hashlib
 import os
+import sys
+import csv
+import json
+import tempfile
+import threading
+import shutil
+import re
+import uuid
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal, ROUND_HALF_UP
 
-# 设置页面配置
-st.set_page_config(
-    page_title="即开票数据查询",
-    page_icon="🎫",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 可选依赖，未安装时不提供 Parquet 导出和快照
+    pa = None
+    pq = None
 
-class LotteryDataExporterStreamlit:
+try:
+    import duckdb
+except ImportError:  # 可选依赖，未安装时不启用本地列式副本
+    duckdb = None
+
+class MySQLConnectionPool:
+    """进程级MySQL连接池 - 所有Streamlit会话共享，借出时ping检查，空闲过久自动回收"""
+
+    def __init__(self, db_config, pool_size=10, pool_recycle=1800, pool_timeout=30):
+        self.db_config = dict(db_config)
+        self.pool_size = pool_size
+        self.pool_recycle = pool_recycle
+        self.pool_timeout = pool_timeout
+
+        # 空闲连接栈: (connection, 最后归还时间)，后进先出，栈底为最久未用的连接
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._in_use = 0
+        self._stats = {
+            'created': 0,
+            'checkouts': 0,
+            'reused': 0,
+            'recycled': 0,
+            'ping_failures': 0,
+            'timeouts': 0,
+        }
+
+    def _create_connection(self):
+        """新建物理连接"""
+        connection = pymysql.connect(**self.db_config)
+        with self._lock:
+            self._stats['created'] += 1
+        return connection
+
+    def _close_connection(self, connection):
+        """关闭物理连接，忽略关闭时的错误"""
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _take_idle_connection(self):
+        """取出一个健康的空闲连接，过期或ping失败的连接直接丢弃"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                connection, last_used = self._idle.pop()
+
+            if time.time() - last_used > self.pool_recycle:
+                with self._lock:
+                    self._stats['recycled'] += 1
+                self._close_connection(connection)
+                continue
+
+            try:
+                connection.ping(reconnect=False)
+            except Exception:
+                with self._lock:
+                    self._stats['ping_failures'] += 1
+                self._close_connection(connection)
+                continue
+
+            with self._lock:
+                self._stats['reused'] += 1
+            return connection
+
+    def _prune_idle(self):
+        """回收栈底空闲时间超过 pool_recycle 的连接"""
+        expired = []
+        now = time.time()
+        with self._lock:
+            while self._idle and now - self._idle[0][1] > self.pool_recycle:
+                expired.append(self._idle.popleft()[0])
+                self._stats['recycled'] += 1
+        for connection in expired:
+            self._close_connection(connection)
+
+    def acquire(self):
+        """借出连接，连接数已满时最多等待 pool_timeout 秒"""
+        if not self._slots.acquire(timeout=self.pool_timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise TimeoutError(f"等待数据库连接超时（{self.pool_timeout}秒），连接池已满")
+
+        try:
+            connection = self._take_idle_connection()
+            if connection is None:
+                connection = self._create_connection()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._stats['checkouts'] += 1
+        return connection
+
+    def release(self, connection):
+        """归还连接 - 先回滚未提交的事务，避免下一个使用者看到旧快照"""
+        try:
+            connection.rollback()
+            healthy = connection.open
+        except Exception:
+            healthy = False
+
+        with self._lock:
+            self._in_use -= 1
+            if healthy:
+                self._idle.append((connection, time.time()))
+
+        if not healthy:
+            self._close_connection(connection)
+        self._slots.release()
+        self._prune_idle()
+
+    @contextmanager
+    def connection(self):
+        """with 语句借出连接，退出时自动归还"""
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def stats(self):
+        """连接池统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pool_size'] = self.pool_size
+            stats['in_use'] = self._in_use
+            stats['idle'] = len(self._idle)
+        return stats
+
+
+class QueryResultCache:
+    """进程级查询结果缓存 - LRU淘汰且总内存有上限，数据导入后按数据版本号整体失效。
+    只有本进程内的导入、清理会使缓存失效：其他进程或直接在数据库中写入的数据，
+    要等对应条目按 ttl 过期后才能查到（兑奖单位、玩法列表可在界面上点刷新跳过缓存）"""
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, ttl=600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.data_version = 0
+
+        # key -> (结果, 估算字节数, 过期时间)，按最近使用排序
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        """读取缓存，未命中或已过期返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+
+            value, _, expires_at = entry
+            if time.time() > expires_at:
+                self._remove(key)
+                self._stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def put(self, key, value, data_version, ttl=None):
+        """写入缓存；查询开始后数据版本已变化（期间有导入）的结果直接丢弃"""
+        size = estimate_result_size(value)
+        with self._lock:
+            if data_version != self.data_version or size > self.max_bytes:
+                return False
+
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.time() + (ttl or self.ttl))
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self._stats['evictions'] += 1
+        return True
+
+    def invalidate(self):
+        """数据有变化时调用：版本号加一并清空全部缓存"""
+        with self._lock:
+            self.data_version += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        """缓存统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+            stats['max_bytes'] = self.max_bytes
+            stats['data_version'] = self.data_version
+        return stats
+
+
+def make_cache_key(kind, conditions, *extra):
+    """把筛选条件规范化后生成缓存键（玩法列表顺序、字典键顺序不影响结果）"""
+    normalized = {}
+    for key, value in conditions.items():
+        if isinstance(value, list):
+            value = sorted(value)
+        elif isinstance(value, dict):
+            value = sorted(value.items())
+        normalized[key] = value
+    payload = json.dumps([kind, normalized, list(extra)], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def estimate_result_size(value):
+    """估算缓存结果占用的内存字节数"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, tuple):
+        return sum(estimate_result_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+# Excel单个工作表的最大行数（含表头）
+EXCEL_MAX_ROWS = 1048576
+
+
+def write_rows_to_excel(target, columns, row_chunks, sheet_name, max_rows_per_sheet=EXCEL_MAX_ROWS, progress_callback=None):
+    """用openpyxl只写模式逐块写入Excel（target为路径或BytesIO），返回写入的数据行数"""
+    # 超过单表行数上限时自动新建工作表：彩票数据_1、彩票数据_2…，只有一个表时不加序号
+    workbook = Workbook(write_only=True)
+    sheets = []
+    worksheet = None
+    sheet_rows = 0
+    row_count = 0
+    
+    def add_sheet():
+        if len(sheets) == 1:
+            sheets[0].title = f"{sheet_name}_1"
+        title = f"{sheet_name}_{len(sheets) + 1}" if sheets else sheet_name
+        new_sheet = workbook.create_sheet(title)
+        new_sheet.append(columns)
+        sheets.append(new_sheet)
+        return new_sheet
+    
+    for rows in row_chunks:
+        for row in rows:
+            if worksheet is None or sheet_rows >= max_rows_per_sheet:
+                worksheet = add_sheet()
+                sheet_rows = 1
+            worksheet.append(row)
+            sheet_rows += 1
+        row_count += len(rows)
+        if progress_callback:
+            progress_callback(row_count)
+    
+    # 没有数据时也输出表头
+    if worksheet is None:
+        add_sheet()
+    
+    workbook.save(target)
+    return row_count
+
+
+# Parquet 列类型：金额保持 DECIMAL 精度，时间列为时间戳，其余为字符串
+PARQUET_TIMESTAMP_COLUMNS = ['售出时间', '兑奖时间', 'created_at']
+
+
+def parquet_schema(columns):
+    """按列名构建 Parquet 导出的 Arrow schema"""
+    fields = []
+    for column in columns:
+        if column == 'id':
+            field_type = pa.int64()
+        elif column in PARQUET_TIMESTAMP_COLUMNS:
+            field_type = pa.timestamp('s')
+        elif column == '兑奖金额':
+            field_type = pa.decimal128(10, 2)
+        else:
+            field_type = pa.string()
+        fields.append(pa.field(column, field_type))
+    return pa.schema(fields)
+
+
+def write_rows_to_parquet(target, columns, row_chunks, progress_callback=None):
+    """把分块的行元组逐块写成 Parquet 行组，返回写入的行数"""
+    schema = parquet_schema(columns)
+    row_count = 0
+    with pq.ParquetWriter(target, schema) as writer:
+        for rows in row_chunks:
+            column_values = list(zip(*rows))
+            arrays = [pa.array(values, type=field.type) for values, field in zip(column_values, schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            row_count += len(rows)
+            if progress_callback:
+                progress_callback(row_count)
+    return row_count
+
+
+def write_parquet_snapshot(df, path):
+    """把DataFrame保存为不压缩的 Parquet 快照（分类等类型随 pandas 元数据保留，金额按 DECIMAL 保存）"""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if '兑奖金额' in table.column_names and pa.types.is_floating(table.schema.field('兑奖金额').type):
+        index = table.schema.get_field_index('兑奖金额')
+        table = table.set_column(index, '兑奖金额', table.column(index).cast(pa.decimal128(10, 2)))
+    pq.write_table(table, path, compression='none')
+
+
+def read_parquet_snapshot(path):
+    """以内存映射方式读回 Parquet 快照，金额与查询结果一样转为 float64"""
+    df = pq.read_table(path, memory_map=True).to_pandas()
+    if '兑奖金额' in df.columns:
+        df['兑奖金额'] = pd.to_numeric(df['兑奖金额'], errors='coerce').astype('float64')
+    return df
+
+
+def is_text_column(column):
+    """Parquet 副本中按字符串保存的列（与 parquet_schema 一致）"""
+    return column not in ('id', '兑奖金额') and column not in PARQUET_TIMESTAMP_COLUMNS
+
+
+# 比较运算左右两边的列名（带引号或不带）或占位符
+_SQL_OPERAND = r'"[^"]+"|[^\W\d]\w*|\?'
+
+
+def _is_text_operand(operand):
+    return operand != '?' and is_text_column(operand.strip('"'))
+
+
+def _collate(operand):
+    """转小写并去掉尾部空格，模拟 MySQL utf8mb4_general_ci 的比较规则"""
+    return f"lower(rtrim({operand}))"
+
+
+def _collate_comparison(match):
+    """字符串列参与的比较两边都规范化，数值和时间列保持原样"""
+    left, operator, right = match.group(1), match.group(2), match.group(3)
+    if not (_is_text_operand(left) or _is_text_operand(right)):
+        return match.group(0)
+    return f"{_collate(left)}{operator}{_collate(right)}"
+
+
+def _collate_in_list(match):
+    column, placeholders = match.group(1), match.group(2)
+    if not _is_text_operand(column):
+        return match.group(0)
+    values = ', '.join(_collate('?') for _ in range(placeholders.count('?')))
+    return f"{_collate(column)} IN ({values})"
+
+
+def _split_top_level(text):
+    """按不在括号或引号内的逗号拆分 SELECT / GROUP BY 列表"""
+    items, depth, quote, start = [], 0, None, 0
+    for index, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            items.append(text[start:index].strip())
+            start = index + 1
+    items.append(text[start:].strip())
+    return items
+
+
+def _collate_group_by(query):
+    """GROUP BY 中直接查询的字符串列按规范化后的值分组，与 MySQL 一样把大小写或尾部空格不同的值归为一组；
+    SELECT 中该列改为取组内最小值显示（MySQL 显示组内任意一行的值）"""
+    match = re.match(r'(\s*SELECT\s+)(.+?)(\s+FROM\s.+?\sGROUP BY\s+)(.+?)(\s+ORDER BY\s.*|\s+LIMIT\s.*)?$', query, re.S)
+    if not match:
+        return query
+    select_prefix, select_list, middle, group_list, tail = match.groups()
+    
+    # SELECT 中直接查询的字符串列：别名 -> 列名
+    bare_columns = {}
+    for item in _split_top_level(select_list):
+        column_match = re.fullmatch(r'("[^"]+")(?:\s+AS\s+("[^"]+"))?', item, re.S)
+        if column_match and is_text_column(column_match.group(1).strip('"')):
+            bare_columns[column_match.group(2) or column_match.group(1)] = column_match.group(1)
+    
+    collated = set()
+    group_items = []
+    for item in _split_top_level(group_list):
+        if item in bare_columns:
+            collated.add(item)
+            item = _collate(bare_columns[item])
+        group_items.append(item)
+    if not collated:
+        return query
+    
+    select_items = []
+    for item in _split_top_level(select_list):
+        column_match = re.fullmatch(r'("[^"]+")(?:\s+AS\s+("[^"]+"))?', item, re.S)
+        alias = column_match and (column_match.group(2) or column_match.group(1))
+        if alias in collated:
+            item = f"min({column_match.group(1)}) AS {alias}"
+        select_items.append(item)
+    return select_prefix + ', '.join(select_items) + middle + ', '.join(group_items) + (tail or '')
+
+
+def mysql_to_duckdb_sql(query):
+    """把 build_query 生成的 MySQL 语句改写为 DuckDB 方言（反引号、占位符、<=>）。
+    字符串列的 =、<=>、IN 比较和 GROUP BY 改为不区分大小写、忽略尾部空格，与 MySQL 默认排序规则一致"""
+    query = query.replace('`', '"').replace('%s', '?')
+    query = re.sub(r'\s*<=>\s*', ' IS NOT DISTINCT FROM ', query)
+    query = re.sub(
+        rf'({_SQL_OPERAND})(\s*=\s*|\s+IS NOT DISTINCT FROM\s+)({_SQL_OPERAND})',
+        _collate_comparison, query
+    )
+    query = re.sub(rf'({_SQL_OPERAND})\s+IN\s*\(([?,\s]+)\)', _collate_in_list, query)
+    return _collate_group_by(query)
+
+
+class ColumnarReplica:
+    """明细表的本地列式副本 - 按兑奖月份分区的 Parquet 文件，按 id 水位增量追加，用 DuckDB 查询。
+    只追加到调用方给出的安全水位（不大于它的明细都已提交），并定期与 MySQL 核对行数，不一致时重建"""
+
+    def __init__(self, root_dir, table_name):
+        self.root_dir = root_dir
+        self.table_name = table_name
+        self._lock = threading.Lock()
+        # 统计计数由并发会话更新；_lock 在刷新期间一直持有，计数单独加锁，查询不必等待刷新
+        self._stats_lock = threading.Lock()
+        self._watermark_path = os.path.join(root_dir, '_watermark.json')
+        self._stats = {
+            'queries': 0,
+            'fallbacks': 0,
+            'refreshed_rows': 0,
+            'last_refresh': None,
+            'rebuilds': 0,
+            'last_check': None,
+        }
+
+    def watermark(self):
+        """副本已包含的最大明细 id"""
+        if not os.path.exists(self._watermark_path):
+            return 0
+        with open(self._watermark_path, encoding='utf-8') as f:
+            return json.load(f)['max_id']
+
+    def _save_watermark(self, max_id):
+        tmp_path = self._watermark_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'max_id': max_id}, f)
+        os.replace(tmp_path, self._watermark_path)
+
+    def _has_files(self):
+        return any(
+            name.endswith('.parquet')
+            for _, _, files in os.walk(self.root_dir)
+            for name in files
+        )
+
+    def available(self):
+        """副本中已有数据文件时才能查询"""
+        return self.watermark() > 0 and self._has_files()
+
+    def _write_chunk(self, columns, rows):
+        """把一块行数据按兑奖月份写入各分区目录，文件以块首 id 命名（重复写入同一块时覆盖）"""
+        df = pd.DataFrame(rows, columns=columns)
+        schema = parquet_schema(columns)
+        redeem_time = pd.to_datetime(df['兑奖时间'], errors='coerce')
+        months = (redeem_time.dt.year * 100 + redeem_time.dt.month).fillna(0).astype('int64')
+        for col in PARQUET_TIMESTAMP_COLUMNS:
+            if col in df.columns:
+                df[col] = pd.to_datetime(df[col], errors='coerce')
+        
+        first_id = int(df['id'].iloc[0])
+        for month, group in df.groupby(months.to_numpy()):
+            month_dir = os.path.join(self.root_dir, f"month={month}")
+            os.makedirs(month_dir, exist_ok=True)
+            path = os.path.join(month_dir, f"part-{first_id:012d}.parquet")
+            table = pa.Table.from_pandas(group, schema=schema, preserve_index=False, safe=False)
+            pq.write_table(table, path + '.tmp')
+            os.replace(path + '.tmp', path)
+        return int(df['id'].iloc[-1])
+
+    def refresh(self, read_rows_between, upper_id):
+        """追加水位到 upper_id 之间的明细；read_rows_between(after_id, upper_id) 逐块返回
+        (列名, 行元组列表)，按 id 升序。upper_id 必须是安全水位：不大于它的明细都已提交"""
+        with self._lock:
+            # MySQL 的最大 id 比水位还小（表被清空或重建），副本整体作废
+            if upper_id < self.watermark():
+                self._rebuild_locked()
+            
+            watermark = self.watermark()
+            if upper_id <= watermark:
+                return 0
+            os.makedirs(self.root_dir, exist_ok=True)
+            appended = 0
+            for columns, rows in read_rows_between(watermark, upper_id):
+                self._save_watermark(self._write_chunk(columns, rows))
+                appended += len(rows)
+            # 区间末尾可能是回滚留下的空号，水位直接推进到 upper_id
+            self._save_watermark(upper_id)
+            with self._stats_lock:
+                self._stats['refreshed_rows'] += appended
+                self._stats['last_refresh'] = datetime.now()
+            return appended
+
+    def verify(self, upper_id, mysql_count):
+        """核对副本行数与 MySQL 中 id 不大于 upper_id 的行数，不一致时清空副本并返回 False"""
+        with self._lock:
+            if self.watermark() != upper_id:
+                return True
+            with self._stats_lock:
+                self._stats['last_check'] = datetime.now()
+            replica_count = self._row_count() if self._has_files() else 0
+            if replica_count == mysql_count:
+                return True
+            self._rebuild_locked()
+            return False
+
+    def _row_count(self):
+        connection = self._connect()
+        try:
+            return connection.execute(f'SELECT COUNT(*) FROM "{self.table_name}"').fetchone()[0]
+        finally:
+            connection.close()
+
+    def _rebuild_locked(self):
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+        self._count('rebuilds')
+
+    def check_due(self, interval):
+        """距上次核对超过 interval 秒时返回 True"""
+        with self._stats_lock:
+            last_check = self._stats['last_check']
+        return last_check is None or (datetime.now() - last_check).total_seconds() >= interval
+
+    def reset(self):
+        """明细有删除或修改时清空副本，下次刷新从头重建"""
+        with self._lock:
+            shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def _connect(self):
+        connection = duckdb.connect()
+        pattern = os.path.join(self.root_dir, 'month=*', '*.parquet').replace("'", "''")
+        connection.execute(
+            f'CREATE VIEW "{self.table_name}" AS '
+            f"SELECT * FROM read_parquet('{pattern}', hive_partitioning = true)"
+        )
+        return connection
+
+    def query_frame(self, query, params=None):
+        """在副本上执行 MySQL 方言的查询，返回DataFrame"""
+        connection = self._connect()
+        try:
+            result = connection.execute(mysql_to_duckdb_sql(query), params or []).df()
+        finally:
+            connection.close()
+        self._count('queries')
+        return result
+
+    def query_scalar(self, query, params=None):
+        """在副本上执行只返回一个值的查询"""
+        connection = self._connect()
+        try:
+            value = connection.execute(mysql_to_duckdb_sql(query), params or []).fetchone()[0]
+        finally:
+            connection.close()
+        self._count('queries')
+        return value
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def record_fallback(self):
+        self._count('fallbacks')
+
+    def stats(self):
+        """副本统计信息"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['watermark'] = self.watermark()
+        return stats
+
+
+def amount_to_decimal(series):
+    """float64 金额还原为两位小数的 Decimal，导出时与数据库的 DECIMAL(10,2) 一致"""
+    return series.map(lambda value: None if pd.isna(value) else Decimal(f"{value:.2f}"))
+
+
+def dataframe_row_chunks(df, include_index=False, chunk_size=10000):
+    """把DataFrame按块转换为行元组，空值转为None以便写入Excel（float64 金额还原为 Decimal）"""
+    restore_amount = '兑奖金额' in df.columns and pd.api.types.is_float_dtype(df['兑奖金额'])
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        if restore_amount:
+            chunk['兑奖金额'] = amount_to_decimal(df['兑奖金额'].iloc[start:start + chunk_size])
+        yield list(chunk.itertuples(index=include_index, name=None))
+
+
+def build_site_analysis_frame(data):
+    """向量化计算站点关系，只取分析需要的列，不复制整个预览数据"""
+    sale_site = data['售出站点']
+    redeem_site = data['兑奖站点']
+    # 与逐行 str() 比较保持一致：两边都为空也算一致
+    same_site = sale_site.eq(redeem_site) | (sale_site.isna() & redeem_site.isna())
+    
+    columns = {
+        '兑奖单位': data['兑奖单位'],
+        '售出站点': sale_site,
+        '兑奖站点': redeem_site,
+        '站点关系': np.where(same_site.to_numpy(), '一致', '不一致'),
+        '兑奖金额': data['兑奖金额'],
+    }
+    for col in ['方案名称', '兑奖时间', '售出时间']:
+        if col in data.columns:
+            columns[col] = data[col]
+    
+    return pd.DataFrame(columns, index=data.index)
+
+
+def merge_blank_labels(totals, label_columns):
+    """汇总结果中为空的分组标签统一显示为 NULL：按天汇总表的主键列不能存 NULL，空的兑奖单位、玩法在表里存为 ''，
+    而明细查询中 NULL 和 '' 是两组。两条路径的结果都经过这里，'' 改为 NULL 后合并同组的记录数和金额，分组顺序不变"""
+    labels = totals[label_columns].astype(object)
+    if not labels.eq('').any().any():
+        return totals
+    totals = totals.copy()
+    totals[label_columns] = labels.where(labels.notna() & labels.ne(''), None)
+    merged = totals.groupby(label_columns, sort=False, dropna=False, as_index=False)[['记录数', '总金额']].sum()
+    merged[label_columns] = merged[label_columns].astype(object).where(merged[label_columns].notna(), None)
+    merged['总金额'] = merged['总金额'].round(2)
+    return merged
+
+
+# 查询结果中取值较少、适合转为分类类型的列
+PREVIEW_CATEGORY_COLUMNS = ['兑奖单位', '方案名称', '方案代码', '生产批次', '等级']
+
+# 售出站点和兑奖站点要互相比较，转为分类时共用同一组类别
+PREVIEW_SITE_COLUMNS = ['售出站点', '兑奖站点']
+
+# 不同取值数低于行数的这个比例时才转为分类类型
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+
+def _should_categorize(series):
+    """取值重复较多的字符串列转为分类类型才划算"""
+    # pandas 3 默认把字符串读为 str（StringDtype），不再是 object
+    is_text = pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)
+    return is_text and series.nunique(dropna=True) < len(series) * CATEGORY_MAX_UNIQUE_RATIO
+
+
+def compact_preview_frame(df):
+    """压缩查询结果：低基数列转分类、金额转数值、时间列一次性解析，返回 (新DataFrame, 每列内存报告)"""
+    before = df.memory_usage(index=False, deep=True)
+    before_dtypes = df.dtypes.astype(str)
+    compact = df.copy()
+    
+    for col in PREVIEW_CATEGORY_COLUMNS:
+        if col in compact.columns and _should_categorize(compact[col]):
+            compact[col] = compact[col].astype('category')
+    
+    site_columns = [col for col in PREVIEW_SITE_COLUMNS if col in compact.columns]
+    if site_columns and all(_should_categorize(compact[col]) for col in site_columns):
+        categories = pd.unique(pd.concat([compact[col] for col in site_columns]).dropna())
+        site_dtype = pd.CategoricalDtype(categories)
+        for col in site_columns:
+            compact[col] = compact[col].astype(site_dtype)
+    
+    if '兑奖金额' in compact.columns:
+        compact['兑奖金额'] = pd.to_numeric(compact['兑奖金额'], errors='coerce').astype('float64')
+    
+    for col in ['兑奖时间', '售出时间', 'created_at']:
+        if col in compact.columns and not pd.api.types.is_datetime64_any_dtype(compact[col]):
+            compact[col] = pd.to_datetime(compact[col], errors='coerce')
+    
+    after = compact.memory_usage(index=False, deep=True)
+    report = pd.DataFrame({
+        '列名': df.columns,
+        '原类型': before_dtypes.values,
+        '原字节': before.values,
+        '压缩后类型': compact.dtypes.astype(str).values,
+        '压缩后字节': after.values,
+    })
+    return compact, report
+
+
+# 服务端或客户端禁用 LOCAL INFILE 时的错误码
+LOCAL_INFILE_DISABLED_ERRORS = (1148, 2068, 3948)
+
+
+def write_load_data_file(df, path):
+    """把清洗后的数据写成 LOAD DATA 可读取的TSV文件（空值写为 NULL）"""
+    df.to_csv(
+        path,
+        sep='\t',
+        header=False,
+        index=False,
+        na_rep='NULL',
+        date_format='%Y-%m-%d %H:%M:%S',
+        quoting=csv.QUOTE_MINIMAL,
+        lineterminator='\n',
+        encoding='utf-8',
+    )
+
+
+def build_load_data_sql(table_name, columns, path, set_clause=""):
+    """构建 LOAD DATA LOCAL INFILE 语句，IGNORE 跳过唯一键重复的记录"""
+    column_list = ', '.join(f"`{column}`" for column in columns)
+    escaped_path = path.replace('\\', '\\\\').replace("'", "\\'")
+    sql = (
+        f"LOAD DATA LOCAL INFILE '{escaped_path}' IGNORE INTO TABLE {table_name} "
+        f"CHARACTER SET utf8mb4 "
+        f"FIELDS TERMINATED BY '\\t' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+        f"LINES TERMINATED BY '\\n' ({column_list})"
+    )
+    if set_clause:
+        sql += f" SET {set_clause}"
+    return sql
+
+
+# 判断重复记录的关键字段，去重哈希按此顺序拼接
+TICKET_KEY_COLUMNS = ['彩票流水号', '方案代码', '兑奖时间', '兑奖金额']
+
+# 去重哈希各字段之间的分隔符（单元分隔符，不会出现在正常数据中）
+TICKET_HASH_SEPARATOR = '\x1f'
+
+# 按月分区的表中兑奖时间为空时保存的哨兵值
+REDEEM_TIME_SENTINEL = '1000-01-01 00:00:00'
+
+_CENT = Decimal('0.01')
+
+
+def ticket_hash_sql(alias=""):
+    """去重哈希的SQL表达式（16字节MD5），拼接规则必须与 compute_ticket_hashes 一致。
+    语义与原四列唯一键相同：文本按 utf8mb4_general_ci 忽略大小写和尾部空格；
+    任一列为空（包括分区表中的哨兵兑奖时间）时哈希为 NULL，不参与去重"""
+    prefix = f"{alias}." if alias else ""
+    serial, scheme_code, redeem_time, amount = (f"{prefix}`{column}`" for column in TICKET_KEY_COLUMNS)
+    separator = "CHAR(31 USING utf8mb4)"
+    return (
+        f"UNHEX(MD5(CONCAT(LOWER(RTRIM({serial})), {separator}, LOWER(RTRIM({scheme_code})), {separator}, "
+        f"CAST(NULLIF({redeem_time}, '{REDEEM_TIME_SENTINEL}') AS CHAR), {separator}, CAST({amount} AS CHAR))))"
+    )
+
+
+def _format_hash_text(value):
+    """文本按 LOWER(RTRIM()) 规范化，空值返回 None"""
+    if value is None or pd.isna(value):
+        return None
+    return str(value).rstrip(' ').lower()
+
+
+def _format_hash_amount(value):
+    """金额按 DECIMAL(10,2) 入库后的文本形式格式化，空值返回 None"""
+    if value is None or value == '' or pd.isna(value):
+        return None
+    return str(Decimal(repr(float(value))).quantize(_CENT, rounding=ROUND_HALF_UP))
+
+
+def _format_hash_time(value):
+    """时间按 DATETIME 转字符的形式格式化（兼容超出 pandas 范围的哨兵日期），空值和哨兵日期返回 None"""
+    if value is None or value == '' or pd.isna(value):
+        return None
+    if not isinstance(value, datetime):
+        value = pd.to_datetime(value, errors='coerce')
+        if pd.isna(value):
+            return None
+    # DATETIME 入库时小数秒四舍五入到整秒，哈希按入库后的值计算
+    if value.microsecond >= 500000:
+        value += timedelta(seconds=1)
+    text = value.strftime('%Y-%m-%d %H:%M:%S')
+    return None if text == REDEEM_TIME_SENTINEL else text
+
+
+def round_to_seconds(series):
+    """与 MySQL 存入 DATETIME 时一样把小数秒四舍五入（dt.round 是四舍六入五成双，不能直接用）"""
+    return (series + pd.Timedelta(milliseconds=500)).dt.floor('s')
+
+
+def compute_ticket_hashes(df):
+    """在客户端按与 ticket_hash_sql 相同的规则计算每行的去重哈希"""
+    serial, scheme_code, redeem_time, amount = TICKET_KEY_COLUMNS
+    if pd.api.types.is_datetime64_any_dtype(df[redeem_time]):
+        redeem_text = round_to_seconds(df[redeem_time]).dt.strftime('%Y-%m-%d %H:%M:%S')
+        redeem_text = redeem_text.where(redeem_text != REDEEM_TIME_SENTINEL)
+    else:
+        redeem_text = df[redeem_time].map(_format_hash_time)
+    parts = [
+        df[serial].map(_format_hash_text), df[scheme_code].map(_format_hash_text),
+        redeem_text, df[amount].map(_format_hash_amount),
+    ]
+    # map 的结果在 pandas 3 中可能被推断为字符串类型，空值统一还原为 None
+    parts = zip(*(part.astype(object).where(part.notna(), None) for part in parts))
+    # 与 SQL 的 CONCAT 一样，任一部分为空时整体为空
+    return [
+        None if None in values else hashlib.md5(TICKET_HASH_SEPARATOR.join(values).encode('utf-8')).digest()
+        for values in parts
+    ]
+
+
+def month_start(value):
+    """日期所在月份的第一天"""
+    return datetime(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    """月份加减（month 为某月第一天）"""
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def month_partition_clauses(first_month, last_month):
+    """生成 first_month 到 last_month 每月一个 RANGE COLUMNS 分区的定义"""
+    clauses = []
+    month = first_month
+    while month <= last_month:
+        clauses.append(f"PARTITION p{month:%Y%m} VALUES LESS THAN ('{add_months(month, 1):%Y-%m-%d}')")
+        month = add_months(month, 1)
+    return clauses
+
+
+def build_partition_by_sql(first_month, last_month):
+    """按兑奖时间按月分区的 PARTITION BY 子句：更早的数据进 p_history，超出范围的进 pmax"""
+    clauses = (
+        [f"PARTITION p_history VALUES LESS THAN ('{first_month:%Y-%m-%d}')"]
+        + month_partition_clauses(first_month, last_month)
+        + ["PARTITION pmax VALUES LESS THAN (MAXVALUE)"]
+    )
+    return "PARTITION BY RANGE COLUMNS(`兑奖时间`) (\n    " + ",\n    ".join(clauses) + "\n)"
+
+
+# 流式导出各格式的扩展名和 MIME 类型
+EXPORT_FILE_TYPES = {
+    "CSV": ("csv", "text/csv"),
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+
+def deferred_file_data(path):
+    """download_button 的 data：点击下载时才读取文件；直接传文件对象会在每次页面重新运行时把整个文件读入内存"""
+    def read():
+        with open(path, 'rb') as f:
+            return f.read()
+    return read
+
+# 后台任务状态
+JOB_STATUS_LABELS = {
+    'queued': '⏳ 排队中',
+    'running': '🔄 运行中',
+    'succeeded': '✅ 已完成',
+    'failed': '❌ 失败',
+    'cancelled': '⛔ 已取消',
+}
+JOB_FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+
+# 预览查询进行中时进度区域（st.fragment）重新运行的间隔（秒）
+PREVIEW_POLL_SECONDS = 0.5
+
+# 明细表的结构升级步骤（需要扫描或改写整表，由「数据导入」页提交的后台任务执行，登录时只检查）
+SCHEMA_UPGRADE_STEPS = {
+    'ticket_hash': "回填去重哈希并建立哈希唯一键 uk_ticket_hash",
+    'drop_unique_ticket': "删除旧的四列唯一键 unique_ticket",
+    'secondary_indexes': "创建或重建查询用的二级索引",
+    'daily_rollup': "从明细表生成按天汇总表",
+}
+# 这些步骤完成前不能导入：去重依赖哈希唯一键，导入时要累加按天汇总表
+IMPORT_REQUIRED_UPGRADES = ('ticket_hash', 'daily_rollup')
+
+# 改写明细表的任务（导入、分区迁移和结构升级、重复数据清理）在单线程池中逐个执行，不会两个同时运行
+SERIAL_JOB_KINDS = ('import', 'migrate', 'dedup')
+
+# MySQL 错误码：超过 MAX_EXECUTION_TIME 被终止、被 KILL QUERY 中断
+MYSQL_ERROR_EXECUTION_TIMEOUT = 3024
+MYSQL_ERROR_QUERY_INTERRUPTED = 1317
+
+
+def with_max_execution_time(query, timeout_ms):
+    """给 SELECT 语句加上 MAX_EXECUTION_TIME 优化器提示（只对这一条语句生效，不改变池中连接的会话设置）"""
+    query = query.lstrip()
+    if not timeout_ms or query[:6].upper() != 'SELECT':
+        return query
+    return f"SELECT /*+ MAX_EXECUTION_TIME({int(timeout_ms)}) */{query[6:]}"
+
+
+class QueryCancelled(Exception):
+    """查询或后台任务已被用户取消"""
+
+
+class DuplicateCleanupError(Exception):
+    """清理重复数据中途失败，deleted 为失败前已提交删除的行数"""
+
+    def __init__(self, message, deleted):
+        super().__init__(message)
+        self.deleted = deleted
+
+
+class CancelToken:
+    """任务取消标记 - 记录任务当前借出的数据库连接，取消时对这些连接执行 KILL QUERY 终止正在执行的语句"""
+
+    def __init__(self, kill_query=None):
+        self.kill_query = kill_query
+        self.cancelled = False
+        self._thread_ids = set()
+        self._lock = threading.Lock()
+
+    def register(self, connection):
+        """连接借出给任务时登记；任务已取消时不再开始新的查询"""
+        with self._lock:
+            self._thread_ids.add(connection.thread_id())
+        self.check()
+
+    def unregister(self, connection):
+        with self._lock:
+            self._thread_ids.discard(connection.thread_id())
+
+    def cancel(self):
+        """标记取消并终止正在执行的语句（在锁内执行，避免连接归还连接池后误杀其他会话的查询）"""
+        with self._lock:
+            self.cancelled = True
+            if self.kill_query is None:
+                return
+            for thread_id in self._thread_ids:
+                try:
+                    self.kill_query(thread_id)
+                except Exception as e:
+                    logger.warning(f"终止查询失败（连接 {thread_id}）: {e}")
+
+    def check(self):
+        """已取消时抛出 QueryCancelled，供分块处理的循环在块之间检查"""
+        if self.cancelled:
+            raise QueryCancelled("任务已取消")
+
+
+class JobManager:
+    """进程级后台任务管理 - 有界线程池执行导入导出，状态持久化到任务目录，页面刷新或关闭后任务继续运行。
+    交互查询（预览）只保存在内存中，结束后 result_ttl 秒内未被取走就连同结果一起丢弃"""
+
+    def __init__(self, job_dir, max_workers=2, max_pending=20, keep_finished=200, query_workers=4, result_ttl=300):
+        self.job_dir = job_dir
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self.result_ttl = result_ttl
+        os.makedirs(job_dir, exist_ok=True)
+
+        self._state_path = os.path.join(job_dir, 'jobs.json')
+        # 任务用的临时文件（如上传文件副本）；上次进程留下的都已没有任务使用，启动时清空
+        self._tmp_dir = os.path.join(job_dir, 'tmp')
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        os.makedirs(self._tmp_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._last_save = 0
+        self._jobs = self._load()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lottery-job')
+        # 交互查询（预览）使用单独的线程池，不排在长时间的导入导出任务后面
+        self._query_executor = ThreadPoolExecutor(max_workers=query_workers, thread_name_prefix='lottery-query')
+        # 导入类任务单独排队、同一时间只运行一个，导出不用等导入
+        self._import_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='lottery-import')
+        self._cancel_tokens = {}
+        # 交互查询的结果（DataFrame）只保存在内存中，由提交的会话取走
+        self._results = {}
+        # 已结束的交互查询 id -> 过期时间
+        self._interactive_expiry = {}
+
+    def _load(self):
+        """读取持久化的任务状态，上次进程退出时未结束的任务标记为中断"""
+        jobs = OrderedDict()
+        if not os.path.exists(self._state_path):
+            return jobs
+        try:
+            with open(self._state_path, encoding='utf-8') as f:
+                saved_jobs = json.load(f)
+        except (OSError, ValueError):
+            return jobs
+        for job in saved_jobs:
+            if job['status'] not in JOB_FINISHED_STATUSES:
+                job['status'] = 'failed'
+                job['message'] = "服务重启，任务已中断"
+                job['finished_at'] = job['finished_at'] or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            jobs[job['id']] = job
+        return jobs
+
+    def _save(self):
+        """整体写入临时文件后替换（在锁内调用），交互查询不落盘"""
+        tmp_path = self._state_path + '.tmp'
+        jobs = [job for job in self._jobs.values() if not job.get('interactive')]
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(jobs, f, ensure_ascii=False, default=str)
+        os.replace(tmp_path, self._state_path)
+        self._last_save = time.time()
+
+    def _trim(self):
+        """只保留最近的已结束任务，删除更早任务的产物文件；过期未取走的交互查询连同结果丢弃（在锁内调用）"""
+        finished = [
+            job for job in self._jobs.values()
+            if job['status'] in JOB_FINISHED_STATUSES and not job.get('interactive')
+        ]
+        for job in finished[:max(len(finished) - self.keep_finished, 0)]:
+            artifact = job.get('artifact')
+            if artifact and os.path.exists(artifact['path']):
+                try:
+                    os.remove(artifact['path'])
+                except OSError:
+                    pass
+            del self._jobs[job['id']]
+        
+        now = time.time()
+        for job_id, expires_at in list(self._interactive_expiry.items()):
+            if now > expires_at:
+                del self._interactive_expiry[job_id]
+                self._results.pop(job_id, None)
+                self._jobs.pop(job_id, None)
+
+    def _update(self, job_id, persist=True, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            if job.get('interactive'):
+                if job['status'] in JOB_FINISHED_STATUSES:
+                    self._interactive_expiry[job_id] = time.time() + self.result_ttl
+                return
+            # 进度更新频繁，最多每2秒落盘一次；状态变化立即落盘
+            if persist or time.time() - self._last_save > 2:
+                self._save()
+
+    def submit(self, kind, title, owner, func, cancel_token=None, interactive=False, cleanup=None, unique=False):
+        """提交任务，func(job_id, report) 返回 {'message': ..., 'artifact': {...}, 'value': ...}；排队任务过多时抛出 RuntimeError。
+        cleanup() 在任务结束后调用（排队期间被取消、没有运行 func 时也调用），提交失败时不调用。
+        unique=True 时同类任务还没结束就不再提交，直接返回那个任务的 id"""
+        with self._lock:
+            if unique:
+                active = self._active_job_locked(kind)
+                if active is not None:
+                    return active['id']
+            # 交互查询每个会话同时只有一个，不计入排队上限
+            pending = sum(
+                1 for job in self._jobs.values()
+                if job['status'] not in JOB_FINISHED_STATUSES and not job.get('interactive')
+            )
+            if not interactive and pending >= self.max_pending:
+                raise RuntimeError(f"后台任务已达上限（{self.max_pending} 个未完成），请稍后再提交")
+            job_id = uuid.uuid4().hex[:12]
+            self._jobs[job_id] = {
+                'id': job_id,
+                'kind': kind,
+                'interactive': interactive,
+                'title': title,
+                'owner': owner,
+                'status': 'queued',
+                'progress': 0.0,
+                'message': "排队中",
+                'artifact': None,
+                'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'started_at': None,
+                'finished_at': None,
+            }
+            self._cancel_tokens[job_id] = cancel_token or CancelToken()
+            self._trim()
+            if not interactive:
+                self._save()
+        if interactive:
+            executor = self._query_executor
+        elif kind in SERIAL_JOB_KINDS:
+            executor = self._import_executor
+        else:
+            executor = self._executor
+        executor.submit(self._run, job_id, func, cleanup)
+        return job_id
+
+    def _run(self, job_id, func, cleanup=None):
+        try:
+            self._run_job(job_id, func)
+        finally:
+            if cleanup is not None:
+                try:
+                    cleanup()
+                except Exception as e:
+                    logger.warning(f"任务 {job_id} 的清理失败: {e}")
+
+    def _run_job(self, job_id, func):
+        with self._lock:
+            token = self._cancel_tokens.get(job_id)
+            if token is None or token.cancelled:
+                # 排队期间已取消
+                self._cancel_tokens.pop(job_id, None)
+                return
+        self._update(job_id, status='running', message="运行中", started_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+
+        def report(progress=None, message=None):
+            fields = {}
+            if progress is not None:
+                fields['progress'] = min(max(float(progress), 0.0), 1.0)
+            if message:
+                fields['message'] = message
+            self._update(job_id, persist=False, **fields)
+
+        try:
+            result = func(job_id, report) or {}
+            token.check()
+        except Exception as e:
+            # 取消后出现的错误（被 KILL 的查询、块之间检查到取消）都按取消处理
+            if token.cancelled:
+                self._update(job_id, status='cancelled', message="已取消", finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            else:
+                self._update(job_id, status='failed', message=str(e), finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            return
+        finally:
+            with self._lock:
+                self._cancel_tokens.pop(job_id, None)
+        if 'value' in result:
+            with self._lock:
+                self._results[job_id] = result['value']
+        self._update(
+            job_id, status='succeeded', progress=1.0,
+            message=result.get('message', "已完成"), artifact=result.get('artifact'),
+            finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        )
+
+    def cancel(self, job_id):
+        """取消排队中或运行中的任务，返回是否已发出取消"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            token = self._cancel_tokens.get(job_id)
+            if job is None or token is None or job['status'] in JOB_FINISHED_STATUSES:
+                return False
+            if job['status'] == 'queued':
+                job.update(status='cancelled', message="已取消", finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                if job.get('interactive'):
+                    self._interactive_expiry[job_id] = time.time() + self.result_ttl
+                else:
+                    self._save()
+        # KILL QUERY 需要新建连接，放在任务管理器的锁外执行
+        token.cancel()
+        return True
+
+    def _active_job_locked(self, kind):
+        for job in self._jobs.values():
+            if job['kind'] == kind and job['status'] not in JOB_FINISHED_STATUSES:
+                return job
+        return None
+
+    def active_job(self, kind):
+        """该类型还没结束的任务（排队中或运行中），没有时返回 None"""
+        with self._lock:
+            job = self._active_job_locked(kind)
+            return dict(job) if job else None
+
+    def get_job(self, job_id):
+        """单个任务的状态，不存在时返回 None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def pop_result(self, job_id):
+        """取走交互查询的结果"""
+        with self._lock:
+            return self._results.pop(job_id, None)
+
+    def create_temp_file(self, suffix=''):
+        """在任务目录的 tmp 子目录中新建临时文件，返回 (文件描述符, 路径)"""
+        return tempfile.mkstemp(suffix=suffix, dir=self._tmp_dir)
+
+    def artifact_path(self, job_id, suffix):
+        """任务产物文件路径（保存在任务目录中，进程重启后仍可下载）"""
+        return os.path.join(self.job_dir, f"{job_id}{suffix}")
+
+    def list_jobs(self, owner=None):
+        """任务列表（新的在前），指定 owner 时只返回该用户的任务"""
+        with self._lock:
+            jobs = [dict(job) for job in self._jobs.values() if owner is None or job['owner'] == owner]
+        return list(reversed(jobs))
+
+    def stats(self):
+        """任务统计信息"""
+        with self._lock:
+            statuses = [job['status'] for job in self._jobs.values()]
+        return {
+            'workers': self.max_workers,
+            'running': statuses.count('running'),
+            'queued': statuses.count('queued'),
+            'finished': sum(1 for status in statuses if status in JOB_FINISHED_STATUSES),
+        }
+
+
+@st.cache_resource
+def get_connection_pool(db_config, pool_size, pool_recycle, pool_timeout):
+    """获取进程级共享连接池（相同配置只创建一次）"""
+    return MySQLConnectionPool(db_config, pool_size, pool_recycle, pool_timeout)
+
+
+@st.cache_resource
+def get_result_cache(max_bytes, ttl):
+    """获取进程级共享查询结果缓存"""
+    return QueryResultCache(max_bytes, ttl)
+
+
+@st.cache_resource
+def get_columnar_replica(root_dir, table_name):
+    """获取进程级共享的本地列式副本"""
+    return ColumnarReplica(root_dir, table_name)
+
+
+@st.cache_resource
+def get_job_manager(job_dir, max_workers, max_pending, query_workers):
+    """获取进程级共享的后台任务管理器"""
+    return JobManager(job_dir, max_workers, max_pending, query_workers=query_workers)
+
+
+logger = logging.getLogger(__name__)
+
+
+class LotteryDatabase:
+    """数据库访问层 - 表结构、连接池、查询构建和流式导出，不依赖 Streamlit，命令行也可直接使用"""
+    
     def __init__(self):
         # 改进的数据库配置
         self.db_config = {
-            'host': 'localhost',
-            'user': 'zf',
-            'password': '117225982',
-            'database': 'lottery',
+            'host': os.environ.get('LOTTERY_DB_HOST', 'localhost'),
+            'user': os.environ.get('LOTTERY_DB_USER', 'zf'),
+            'password': os.environ.get('LOTTERY_DB_PASSWORD', '117225982'),
+            'database': os.environ.get('LOTTERY_DB_NAME', 'lottery'),
             'charset': 'utf8mb4',
             'port': 3306,
             'connect_timeout': 10,
+            'local_infile': True,  # 允许 LOAD DATA LOCAL INFILE 导入
+        }
+        
+        # 连接池配置，可通过环境变量调整
+        self.pool_config = {
+            'pool_size': int(os.environ.get('LOTTERY_DB_POOL_SIZE', 10)),
+            'pool_recycle': int(os.environ.get('LOTTERY_DB_POOL_RECYCLE', 1800)),
+            'pool_timeout': int(os.environ.get('LOTTERY_DB_POOL_TIMEOUT', 30)),
         }
+        self.pool = self.create_pool()
+        
+        # 单条查询的服务端执行时间上限（毫秒，0 表示不限制）：预览、汇总等交互查询默认 60 秒；
+        # 流式导出要把结果全部传完才算执行结束，默认不限制，可单独设置
+        self.query_timeout_ms = int(os.environ.get('LOTTERY_QUERY_TIMEOUT_MS', 60000))
+        self.export_timeout_ms = int(os.environ.get('LOTTERY_EXPORT_TIMEOUT_MS', 0))
+        
+        # 后台任务的取消标记，设置后借出的连接都会登记，取消时可以 KILL QUERY
+        self.cancel_token = None
         
         # 完整的列名映射 - 包含所有Excel列
         self.column_mapping = {
@@ -55,9 +1315,282 @@ class LotteryDataExporterStreamlit:
         # 数据库表应该包含的所有列
         self.db_columns = list(self.column_mapping.values())
         
+        # 判断重复记录的关键字段（去重哈希 ticket_hash 由这些字段计算）
+        self.unique_key_columns = list(TICKET_KEY_COLUMNS)
+        
+        # 实际写入的列：业务列加上客户端计算的去重哈希
+        self.insert_columns = self.db_columns + ['ticket_hash']
+        
+        # 流式导出时每次从服务端游标读取的行数
+        self.export_chunk_size = 10000
+        
         self.table_name = "各奖等中奖明细表"
         self.user_table = "users"
         
+        # 按天预汇总的统计表（兑奖时间为空的记录归入哨兵日期）
+        self.rollup_table = "各奖等中奖日汇总表"
+        self._rollup_available = False
+        self.rollup_null_date = REDEEM_TIME_SENTINEL[:10]
+        
+        # 导入断点续传检查点（按上传文件指纹记录已提交的行数）
+        self.checkpoint_table = "导入检查点表"
+    
+    def create_pool(self):
+        """创建连接池"""
+        return MySQLConnectionPool(self.db_config, **self.pool_config)
+    
+    @contextmanager
+    def get_connection(self):
+        """从连接池借出连接（借出时已ping检查），有取消标记时登记连接以便取消"""
+        connection = self.pool.acquire()
+        token = self.cancel_token
+        try:
+            if token is not None:
+                token.register(connection)
+            yield connection
+        finally:
+            if token is not None:
+                token.unregister(connection)
+            self.pool.release(connection)
+    
+    def kill_query(self, thread_id):
+        """新建一个连接（不占用连接池）终止指定连接上正在执行的语句"""
+        connection = pymysql.connect(**self.db_config)
+        try:
+            connection.cursor().execute("KILL QUERY %s", (int(thread_id),))
+        finally:
+            connection.close()
+    
+    def query_error_message(self, error, default="请重试"):
+        """把查询超时、取消等错误转换为给用户看的说明，其他错误返回 default"""
+        if isinstance(error, QueryCancelled):
+            return "查询已取消"
+        code = error.args[0] if isinstance(error, pymysql.err.MySQLError) and error.args else None
+        if code == MYSQL_ERROR_EXECUTION_TIMEOUT:
+            return "查询超过执行时间上限，已被数据库终止。请缩小日期范围或增加兑奖单位等筛选条件后重试"
+        if code == MYSQL_ERROR_QUERY_INTERRUPTED:
+            return "查询已被终止"
+        return default
+    
+    def log_message(self, message):
+        """记录日志消息"""
+        logger.info(message)
+    
+    def build_query(self, conditions, select_columns=None):
+        """构建SQL查询语句（默认查询除去重哈希外的所有列）"""
+        if select_columns is None:
+            select_columns = self.result_columns_sql()
+        base_query = f"SELECT {select_columns} FROM {self.table_name} WHERE 1=1"
+        query_params = []
+    
+        # 使用正确的列名映射
+        region_col = self.column_mapping['region']
+        sale_site_col = self.column_mapping['sale_site']
+        redeem_site_col = self.column_mapping['redeem_site']
+        play_method_col = self.column_mapping['play_method']
+        prize_level_col = self.column_mapping['prize_amount']  # 注意这里改为 prize_amount
+        redeem_time_col = self.column_mapping['redeem_time']
+        sale_time_col = self.column_mapping['sale_time']
+    
+        # 兑奖单位条件
+        if conditions.get('region'):
+            base_query += f" AND {region_col} = %s"
+            query_params.append(conditions['region'])
+    
+        # 兑奖站点条件
+        if conditions.get('redeem_site'):
+            base_query += f" AND {redeem_site_col} = %s"
+            query_params.append(conditions['redeem_site'])
+    
+        # 玩法条件（多选）
+        if conditions.get('play_methods'):
+            placeholders = ', '.join(['%s'] * len(conditions['play_methods']))
+            base_query += f" AND {play_method_col} IN ({placeholders})"
+            query_params.extend(conditions['play_methods'])
+    
+        # 兑奖金额条件（按票种设置）
+        if conditions.get('prize_conditions'):
+            prize_conditions = conditions['prize_conditions']
+            if prize_conditions:
+                prize_conditions_parts = []
+                for method, amount in prize_conditions.items():
+                    prize_conditions_parts.append(f"({play_method_col} = %s AND {prize_level_col} = %s)")
+                    query_params.extend([method, amount])
+    
+                base_query += " AND (" + " OR ".join(prize_conditions_parts) + ")"
+    
+        # 兑奖时间条件（半开区间，直接比较原始列以便使用索引）
+        if conditions.get('redeem_start_time') and conditions.get('redeem_end_time'):
+            base_query += f" AND {redeem_time_col} >= %s AND {redeem_time_col} < %s"
+            query_params.extend(self.date_range_bounds(conditions['redeem_start_time'], conditions['redeem_end_time']))
+    
+        # 销售时间条件
+        if conditions.get('sale_start_time') and conditions.get('sale_end_time'):
+            base_query += f" AND {sale_time_col} >= %s AND {sale_time_col} < %s"
+            query_params.extend(self.date_range_bounds(conditions['sale_start_time'], conditions['sale_end_time']))
+    
+        return base_query, query_params
+    
+    def date_range_bounds(self, start_date, end_date):
+        """把 'YYYY/MM/DD' 格式的闭区间日期转换为 [开始, 结束次日) 的半开区间"""
+        start = datetime.strptime(start_date, '%Y/%m/%d')
+        end = datetime.strptime(end_date, '%Y/%m/%d') + timedelta(days=1)
+        return [start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S')]
+    
+    def result_columns_sql(self):
+        """查询结果的列：去重哈希是二进制内部列，不返回给预览和导出；分区表中的哨兵兑奖时间还原为空值"""
+        columns = ['id'] + [f"`{column}`" for column in self.db_columns] + ['created_at']
+        redeem_time_col = self.column_mapping['redeem_time']
+        columns[columns.index(f"`{redeem_time_col}`")] = self.redeem_time_sql()
+        return ', '.join(columns)
+    
+    def redeem_time_sql(self):
+        """兑奖时间输出表达式：按月分区时空值以哨兵日期保存，查询结果中还原为空"""
+        redeem_time_col = self.column_mapping['redeem_time']
+        return f"NULLIF(`{redeem_time_col}`, '{self.rollup_null_date} 00:00:00') AS `{redeem_time_col}`"
+    
+    @contextmanager
+    def open_stream_cursor(self, conditions):
+        """以无缓冲服务端游标(SSCursor)执行查询，结果留在服务端按需分块读取"""
+        query, params = self.build_query(conditions)
+        with self.get_connection() as connection:
+            cursor = connection.cursor(pymysql.cursors.SSCursor)
+            try:
+                cursor.execute(with_max_execution_time(query, self.export_timeout_ms), params)
+                yield cursor
+            finally:
+                cursor.close()
+    
+    def iter_cursor_chunks(self, cursor, chunk_size=None):
+        """按块读取游标结果（任务已取消时在块之间停止）"""
+        chunk_size = chunk_size or self.export_chunk_size
+        while True:
+            if self.cancel_token is not None:
+                self.cancel_token.check()
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    
+    def write_query_csv(self, conditions, path, encoding="utf-8", progress_callback=None):
+        """把查询结果分块写入CSV文件，返回写入的记录数；有字符无法用所选编码表示时报错，不静默替换"""
+        row_count = 0
+        with self.open_stream_cursor(conditions) as cursor:
+            try:
+                with open(path, 'w', encoding=encoding, newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow([column[0] for column in cursor.description])
+                    for rows in self.iter_cursor_chunks(cursor):
+                        writer.writerows(rows)
+                        row_count += len(rows)
+                        if progress_callback:
+                            progress_callback(row_count)
+            except UnicodeEncodeError as e:
+                raise ValueError(
+                    f"第 {row_count + 1} 条记录起的数据中有字符 {e.object[e.start:e.end]!r} 无法用 {encoding} 编码，"
+                    f"请改用 UTF-8 导出"
+                ) from e
+        return row_count
+    
+    def write_query_excel(self, conditions, path, progress_callback=None):
+        """把查询结果分块写入Excel文件（只写模式，自动拆分工作表），返回写入的记录数"""
+        with self.open_stream_cursor(conditions) as cursor:
+            columns = [column[0] for column in cursor.description]
+            return write_rows_to_excel(
+                path, columns, self.iter_cursor_chunks(cursor), '彩票数据',
+                progress_callback=progress_callback
+            )
+    
+    def write_query_parquet(self, conditions, path, progress_callback=None):
+        """把查询结果按块写成 Parquet 行组（金额、时间为带类型的列），返回写入的记录数"""
+        with self.open_stream_cursor(conditions) as cursor:
+            columns = [column[0] for column in cursor.description]
+            return write_rows_to_parquet(
+                path, columns, self.iter_cursor_chunks(cursor), progress_callback=progress_callback
+            )
+    
+    def query_regions(self):
+        """查询所有兑奖单位"""
+        with self.get_connection() as connection:
+            cursor = connection.cursor()
+            region_col = self.column_mapping['region']
+            cursor.execute(f"SELECT DISTINCT {region_col} FROM {self.table_name} WHERE {region_col} IS NOT NULL AND {region_col} != '' ORDER BY {region_col}")
+            return [result[0] for result in cursor.fetchall()]
+    
+    def write_query_file(self, conditions, path, export_format="CSV", encoding="utf-8", progress_callback=None):
+        """按格式把查询结果流式写入文件，返回写入的记录数"""
+        if export_format == "Excel":
+            return self.write_query_excel(conditions, path, progress_callback)
+        if export_format == "Parquet":
+            return self.write_query_parquet(conditions, path, progress_callback)
+        return self.write_query_csv(conditions, path, encoding, progress_callback)
+
+
+class LotteryDataExporterStreamlit(LotteryDatabase):
+    def __init__(self):
+        super().__init__()
+        
+        # 查询结果缓存配置（所有会话共享，缓存的DataFrame只读）
+        self.cache_config = {
+            'max_bytes': int(os.environ.get('LOTTERY_CACHE_MAX_MB', 512)) * 1024 * 1024,
+            'ttl': int(os.environ.get('LOTTERY_CACHE_TTL', 600)),
+        }
+        self.result_cache = get_result_cache(**self.cache_config)
+        
+        # 按兑奖时间按月分区（默认关闭），提前创建未来几个月的分区
+        self.partition_config = {
+            'enabled': os.environ.get('LOTTERY_PARTITION_BY_MONTH', '0').lower() in ('1', 'true', 'yes'),
+            'future_months': int(os.environ.get('LOTTERY_PARTITION_FUTURE_MONTHS', 3)),
+        }
+        
+        # 兑奖单位、玩法列表只随导入变化，缓存时间单独设置（其他进程的写入要等过期或点刷新才能看到）
+        self.dimension_cache_ttl = int(os.environ.get('LOTTERY_DIMENSION_CACHE_TTL', 86400))
+        
+        # 回填去重哈希时每批更新的 id 跨度
+        self.hash_backfill_batch_size = 50000
+        
+        # 清理重复数据时每批删除的行数
+        self.dedup_delete_batch_size = 1000
+        
+        # 本地 Parquet 快照目录
+        self.snapshot_dir = os.environ.get(
+            'LOTTERY_SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), 'lottery_snapshots')
+        )
+        
+        # 流式导入时每次清洗、插入的行数
+        self.import_chunk_size = 5000
+        
+        # 导入批次之间互斥的数据库锁，等待超过该秒数时本批导入失败（可断点续传）
+        self.import_lock_timeout = int(os.environ.get('LOTTERY_IMPORT_LOCK_TIMEOUT', 600))
+        
+        # 本地列式副本（需要 duckdb 和 pyarrow，默认关闭），导入后按 id 水位增量刷新
+        self.replica = None
+        if (duckdb is not None and pq is not None
+                and os.environ.get('LOTTERY_REPLICA_ENABLED', '0').lower() in ('1', 'true', 'yes')):
+            replica_dir = os.environ.get('LOTTERY_REPLICA_DIR', os.path.join(tempfile.gettempdir(), 'lottery_replica'))
+            self.replica = get_columnar_replica(replica_dir, self.table_name)
+        self.replica_chunk_size = 100000
+        # 每隔该秒数核对一次副本与 MySQL 的行数（发现外部删除或迟提交的明细时重建副本）
+        self.replica_check_interval = int(os.environ.get('LOTTERY_REPLICA_CHECK_INTERVAL', 300))
+        
+        # 后台任务：有界线程池执行长时间的导入导出，状态和产物保存在任务目录
+        self.job_config = {
+            'job_dir': os.environ.get('LOTTERY_JOB_DIR', os.path.join(tempfile.gettempdir(), 'lottery_jobs')),
+            'max_workers': int(os.environ.get('LOTTERY_JOB_WORKERS', 2)),
+            'max_pending': int(os.environ.get('LOTTERY_JOB_MAX_PENDING', 20)),
+            'query_workers': int(os.environ.get('LOTTERY_QUERY_WORKERS', 4)),
+        }
+        self.jobs = get_job_manager(**self.job_config)
+        
+        # 与 get_conditions 可能产生的筛选组合匹配的二级索引（索引名: 列）
+        self.secondary_indexes = {
+            'idx_redeem_time': ['兑奖时间'],
+            'idx_sale_time': ['售出时间'],
+            'idx_region_redeem_time': ['兑奖单位', '兑奖时间'],
+            'idx_method_amount': ['方案名称', '兑奖金额'],
+            'idx_redeem_site_time': ['兑奖站点', '兑奖时间'],
+        }
+        
         # 初始化 session state
         self.init_session_state()
     
@@ -73,6 +1606,24 @@ class LotteryDataExporterStreamlit:
             st.session_state.prize_conditions = {}
         if 'preview_data' not in st.session_state:
             st.session_state.preview_data = None
+        if 'preview_memory_report' not in st.session_state:
+            st.session_state.preview_memory_report = None
+        
+        # 分页预览相关的 session state
+        if 'paged_preview' not in st.session_state:
+            st.session_state.paged_preview = True
+        if 'preview_conditions' not in st.session_state:
+            st.session_state.preview_conditions = None
+        if 'preview_total' not in st.session_state:
+            st.session_state.preview_total = 0
+        if 'preview_page_data' not in st.session_state:
+            st.session_state.preview_page_data = None
+        if 'preview_page_anchors' not in st.session_state:
+            st.session_state.preview_page_anchors = [0]
+        if 'preview_page_size' not in st.session_state:
+            st.session_state.preview_page_size = 1000
+        if 'preview_job_id' not in st.session_state:
+            st.session_state.preview_job_id = None
         if 'play_methods_list' not in st.session_state:
             st.session_state.play_methods_list = []
         if 'regions_list' not in st.session_state:
@@ -93,10 +1644,20 @@ class LotteryDataExporterStreamlit:
             st.session_state.data_update_date = None
         if 'site_analysis_data' not in st.session_state:
             st.session_state.site_analysis_data = None
+        if 'sql_site_analysis' not in st.session_state:
+            st.session_state.sql_site_analysis = True
+        if 'site_summary' not in st.session_state:
+            st.session_state.site_summary = None
+        if 'site_analysis_conditions' not in st.session_state:
+            st.session_state.site_analysis_conditions = None
         if 'import_data' not in st.session_state:
             st.session_state.import_data = None
         if 'import_preview' not in st.session_state:
             st.session_state.import_preview = None
+        if 'stream_export_file' not in st.session_state:
+            st.session_state.stream_export_file = None
+        if 'use_replica' not in st.session_state:
+            st.session_state.use_replica = True
         
         # 初始化时间相关的 session state
         if 'use_redeem_time' not in st.session_state:
@@ -119,141 +1680,673 @@ class LotteryDataExporterStreamlit:
             st.session_state.method_select = ""
     
     def check_and_create_table(self):
-        """检查并创建完整的数据库表结构，添加唯一键约束"""
+        """检查并创建数据库表结构：新表直接按完整结构创建；已有的表只补缺失列并检查待完成的结构升级"""
         try:
-            connection = pymysql.connect(**self.db_config)
-            cursor = connection.cursor()
-            
-            # 检查表是否存在
-            cursor.execute(f"SHOW TABLES LIKE '{self.table_name}'")
-            table_exists = cursor.fetchone()
-            
-            if not table_exists:
-                # 创建包含所有字段的表，添加唯一键约束
-                create_table_sql = f"""
-                CREATE TABLE {self.table_name} (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    `序号` VARCHAR(50),
-                    `兑奖单位` VARCHAR(100),
-                    `方案名称` VARCHAR(100),
-                    `方案代码` VARCHAR(50),
-                    `生产批次` VARCHAR(50),
-                    `彩票流水号` VARCHAR(100),
-                    `售出站点` VARCHAR(100),
-                    `售出时间` DATETIME,
-                    `兑奖站点` VARCHAR(100),
-                    `兑奖时间` DATETIME,
-                    `等级` VARCHAR(50),
-                    `兑奖金额` DECIMAL(10,2),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE KEY unique_ticket (`彩票流水号`, `方案代码`, `兑奖时间`, `兑奖金额`)
-                )
-                """
-                cursor.execute(create_table_sql)
-                self.log_message("创建了完整的数据库表结构，包含唯一键约束")
-            else:
-                # 检查表结构是否完整
-                cursor.execute(f"DESCRIBE {self.table_name}")
-                existing_columns = [column[0] for column in cursor.fetchall()]
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                # 检查表是否存在
+                cursor.execute(f"SHOW TABLES LIKE '{self.table_name}'")
+                table_exists = cursor.fetchone()
                 
-                # 检查缺失的列
-                missing_columns = []
-                for column in self.db_columns:
-                    if column not in existing_columns:
-                        missing_columns.append(column)
-                
-                # 添加缺失的列
-                for column in missing_columns:
-                    if column in ['序号', '方案代码', '生产批次', '彩票流水号', '等级']:
-                        alter_sql = f"ALTER TABLE {self.table_name} ADD COLUMN `{column}` VARCHAR(100)"
-                    elif column in ['兑奖金额']:
-                        alter_sql = f"ALTER TABLE {self.table_name} ADD COLUMN `{column}` DECIMAL(10,2)"
-                    elif column in ['售出时间', '兑奖时间']:
-                        alter_sql = f"ALTER TABLE {self.table_name} ADD COLUMN `{column}` DATETIME"
+                if not table_exists:
+                    # 创建包含所有字段的表，添加唯一键约束
+                    if self.partition_config['enabled']:
+                        # 分区表的主键和唯一键必须包含分区列
+                        current_month = month_start(datetime.now())
+                        redeem_time_sql = f"DATETIME NOT NULL DEFAULT '{self.rollup_null_date} 00:00:00'"
+                        primary_key_sql = "PRIMARY KEY (id, `兑奖时间`)"
+                        unique_key_sql = "UNIQUE KEY uk_ticket_hash (ticket_hash, `兑奖时间`)"
+                        partition_sql = build_partition_by_sql(
+                            current_month, add_months(current_month, self.partition_config['future_months'])
+                        )
                     else:
-                        alter_sql = f"ALTER TABLE {self.table_name} ADD COLUMN `{column}` VARCHAR(100)"
+                        redeem_time_sql = "DATETIME"
+                        primary_key_sql = "PRIMARY KEY (id)"
+                        unique_key_sql = "UNIQUE KEY uk_ticket_hash (ticket_hash)"
+                        partition_sql = ""
+                    create_table_sql = f"""
+                    CREATE TABLE {self.table_name} (
+                        id INT AUTO_INCREMENT,
+                        `序号` VARCHAR(50),
+                        `兑奖单位` VARCHAR(100),
+                        `方案名称` VARCHAR(100),
+                        `方案代码` VARCHAR(50),
+                        `生产批次` VARCHAR(50),
+                        `彩票流水号` VARCHAR(100),
+                        `售出站点` VARCHAR(100),
+                        `售出时间` DATETIME,
+                        `兑奖站点` VARCHAR(100),
+                        `兑奖时间` {redeem_time_sql},
+                        `等级` VARCHAR(50),
+                        `兑奖金额` DECIMAL(10,2),
+                        ticket_hash BINARY(16),
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        {primary_key_sql},
+                        {unique_key_sql}
+                    )
+                    {partition_sql}
+                    """
+                    cursor.execute(create_table_sql)
+                    self.log_message("创建了完整的数据库表结构，包含唯一键约束")
+                    
+                    # 新表为空，建索引和汇总表都很快
+                    self.ensure_secondary_indexes(cursor)
+                    self.ensure_daily_rollup_table(cursor)
+                else:
+                    # 检查表结构是否完整
+                    cursor.execute(f"DESCRIBE {self.table_name}")
+                    existing_columns = [column[0] for column in cursor.fetchall()]
+                    
+                    # 检查缺失的列
+                    missing_columns = []
+                    for column in self.db_columns:
+                        if column not in existing_columns:
+                            missing_columns.append(column)
+                    
+                    # 添加缺失的列
+                    for column in missing_columns:
+                        if column in ['序号', '方案代码', '生产批次', '彩票流水号', '等级']:
+                            alter_sql = f"ALTER TABLE {self.table_name} ADD COLUMN `{column}` VARCHAR(100)"
+                        elif column in ['兑奖金额']:
+                            alter_sql = f"ALTER TABLE {self.table_name} ADD COLUMN `{column}` DECIMAL(10,2)"
+                        elif column in ['售出时间', '兑奖时间']:
+                            alter_sql = f"ALTER TABLE {self.table_name} ADD COLUMN `{column}` DATETIME"
+                        else:
+                            alter_sql = f"ALTER TABLE {self.table_name} ADD COLUMN `{column}` VARCHAR(100)"
+                        
+                        cursor.execute(alter_sql)
+                        self.log_message(f"添加了缺失的列: {column}")
+                    
+                    if missing_columns:
+                        self.log_message(f"表结构已更新，添加了 {len(missing_columns)} 个缺失列")
                     
-                    cursor.execute(alter_sql)
-                    self.log_message(f"添加了缺失的列: {column}")
+                    # 回填哈希、加唯一键、建索引、生成汇总表都要扫描或改写整表，这里只检查，由后台任务执行
+                    pending = self.pending_schema_upgrades(cursor)
+                    if pending:
+                        self.log_message(
+                            f"明细表结构待升级（{'；'.join(SCHEMA_UPGRADE_STEPS[step] for step in pending)}），"
+                            "请在「数据导入」页执行表结构升级"
+                        )
+                    
+                    # 未分区的旧表需要在「数据导入」页手动迁移（复制整表），这里只提示
+                    if self.partition_config['enabled'] and not self.get_month_partitions(cursor):
+                        self.log_message("已开启按月分区，但明细表尚未分区，可在「数据导入」页执行迁移")
+                
+                # 提前创建当前及未来几个月的分区
+                if self.partition_config['enabled']:
+                    current_month = month_start(datetime.now())
+                    self.ensure_month_partitions(
+                        cursor, current_month, add_months(current_month, self.partition_config['future_months'])
+                    )
                 
-                # 检查唯一键约束是否存在
+                # 导入检查点表
                 cursor.execute(f"""
-                    SELECT COUNT(*) FROM information_schema.table_constraints 
-                    WHERE table_name = '{self.table_name}' 
-                    AND constraint_type = 'UNIQUE'
-                    AND constraint_name = 'unique_ticket'
+                CREATE TABLE IF NOT EXISTS {self.checkpoint_table} (
+                    `文件指纹` CHAR(64) PRIMARY KEY,
+                    `文件名` VARCHAR(255),
+                    `已提交行数` BIGINT NOT NULL DEFAULT 0,
+                    `已导入记录数` BIGINT NOT NULL DEFAULT 0,
+                    `状态` VARCHAR(20) NOT NULL,
+                    `更新时间` TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+                )
                 """)
-                unique_key_exists = cursor.fetchone()[0] > 0
                 
-                if not unique_key_exists:
-                    # 添加唯一键约束
-                    try:
-                        cursor.execute(f"""
-                            ALTER TABLE {self.table_name} 
-                            ADD UNIQUE KEY unique_ticket (`彩票流水号`, `方案代码`, `兑奖时间`, `兑奖金额`)
-                        """)
-                        self.log_message("已添加唯一键约束用于重复数据检查")
-                    except Exception as e:
-                        self.log_message(f"添加唯一键约束失败，可能已有重复数据: {e}")
-                        # 如果添加唯一键失败，可能是表中已有重复数据
-                        # 我们可以先清理重复数据
-                        self.clean_duplicate_data(cursor)
-                        # 然后重新尝试添加唯一键
-                        try:
-                            cursor.execute(f"""
-                                ALTER TABLE {self.table_name} 
-                                ADD UNIQUE KEY unique_ticket (`彩票流水号`, `方案代码`, `兑奖时间`, `兑奖金额`)
-                            """)
-                            self.log_message("清理重复数据后成功添加唯一键约束")
-                        except Exception as e2:
-                            self.log_message(f"再次添加唯一键约束失败: {e2}")
+                connection.commit()
+            return True
+            
+        except Exception as e:
+            self.log_message(f"检查表结构失败: {str(e)}")
+            return False
+
+    def ensure_secondary_indexes(self, cursor):
+        """创建缺失的二级索引，列定义已变化的索引重建"""
+        try:
+            existing_indexes, _ = self.get_table_indexes(cursor)
+            
+            for index_name, columns in self.secondary_indexes.items():
+                if existing_indexes.get(index_name) == columns:
+                    continue
                 
-                if missing_columns:
-                    self.log_message(f"表结构已更新，添加了 {len(missing_columns)} 个缺失列")
+                column_list = ', '.join(f"`{column}`" for column in columns)
+                if index_name in existing_indexes:
+                    cursor.execute(f"ALTER TABLE {self.table_name} DROP INDEX {index_name}, ADD INDEX {index_name} ({column_list})")
+                    self.log_message(f"已重建索引 {index_name}: {column_list}")
+                else:
+                    cursor.execute(f"ALTER TABLE {self.table_name} ADD INDEX {index_name} ({column_list})")
+                    self.log_message(f"已创建索引 {index_name}: {column_list}")
+                    
+        except Exception as e:
+            self.log_message(f"维护二级索引失败: {e}")
+
+    def get_table_indexes(self, cursor):
+        """明细表现有的索引，返回 ({索引名: [列名, ...]}, 唯一索引名集合)"""
+        cursor.execute("""
+            SELECT index_name, column_name, non_unique FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s
+            ORDER BY index_name, seq_in_index
+        """, (self.table_name,))
+        indexes, unique_indexes = {}, set()
+        for index_name, column_name, non_unique in cursor.fetchall():
+            indexes.setdefault(index_name, []).append(column_name)
+            if not non_unique:
+                unique_indexes.add(index_name)
+        return indexes, unique_indexes
+    
+    def pending_schema_upgrades(self, cursor):
+        """明细表尚未完成的结构升级步骤（SCHEMA_UPGRADE_STEPS 的键），只查询元数据，不扫描表"""
+        indexes, unique_indexes = self.get_table_indexes(cursor)
+        pending = []
+        # 唯一键在回填完成后才建立，已存在说明回填也已完成
+        if 'uk_ticket_hash' not in unique_indexes:
+            pending.append('ticket_hash')
+        if 'unique_ticket' in unique_indexes:
+            pending.append('drop_unique_ticket')
+        if any(indexes.get(index_name) != columns for index_name, columns in self.secondary_indexes.items()):
+            pending.append('secondary_indexes')
+        cursor.execute(f"SHOW TABLES LIKE '{self.rollup_table}'")
+        if not cursor.fetchone():
+            pending.append('daily_rollup')
+        return pending
+    
+    def schema_upgrades_blocking_import(self):
+        """导入前必须完成、但尚未完成的结构升级步骤"""
+        with self.get_connection() as connection:
+            pending = self.pending_schema_upgrades(connection.cursor())
+        return [step for step in pending if step in IMPORT_REQUIRED_UPGRADES]
+    
+    def upgrade_schema(self, connection, cursor):
+        """执行待完成的结构升级（在后台任务中调用，耗时与表大小成正比）：
+        回填去重哈希后建立哈希唯一键、删除旧唯一键、维护二级索引、生成按天汇总表"""
+        pending = self.pending_schema_upgrades(cursor)
+        if 'ticket_hash' in pending:
+            cursor.execute(f"DESCRIBE {self.table_name}")
+            if 'ticket_hash' not in [column[0] for column in cursor.fetchall()]:
+                cursor.execute(f"ALTER TABLE {self.table_name} ADD COLUMN ticket_hash BINARY(16) NULL")
+                self.log_message("已添加去重哈希列 ticket_hash")
+            self.backfill_ticket_hash(connection, cursor)
+            try:
+                cursor.execute(f"ALTER TABLE {self.table_name} ADD UNIQUE KEY uk_ticket_hash (ticket_hash)")
+            except pymysql.err.IntegrityError as e:
+                # 已有重复数据时不自动删除，由用户核对后清理；回填已提交，清理后重新升级很快
+                raise RuntimeError(
+                    "表中已有重复数据，无法建立去重哈希唯一键，请先在「数据导入」页统计并清理重复数据后重新执行升级"
+                ) from e
+            self.log_message("已添加去重哈希唯一键用于重复数据检查")
+        
+        # 哈希唯一键生效后，旧的四列唯一键不再需要
+        if 'drop_unique_ticket' in pending:
+            cursor.execute(f"ALTER TABLE {self.table_name} DROP INDEX unique_ticket")
+            self.log_message("已删除旧的四列唯一键 unique_ticket")
+        
+        if 'secondary_indexes' in pending:
+            self.ensure_secondary_indexes(cursor)
+        
+        if 'daily_rollup' in pending:
+            self.ensure_daily_rollup_table(cursor)
+        
+        remaining = self.pending_schema_upgrades(cursor)
+        if remaining:
+            raise RuntimeError("以下升级步骤未完成：" + "；".join(SCHEMA_UPGRADE_STEPS[step] for step in remaining))
+    
+    def ensure_daily_rollup_table(self, cursor):
+        """检查并创建按天汇总表：先在临时表中从明细表全量生成再改名，生成期间查询不会读到不完整的汇总表。
+        之后导入时增量累加、清理重复数据时按删除的明细扣减"""
+        try:
+            cursor.execute(f"SHOW TABLES LIKE '{self.rollup_table}'")
+            if not cursor.fetchone():
+                build_table = f"{self.rollup_table}_build"
+                cursor.execute(f"DROP TABLE IF EXISTS {build_table}")
+                cursor.execute(f"""
+                CREATE TABLE {build_table} (
+                    `兑奖日期` DATE NOT NULL,
+                    `兑奖单位` VARCHAR(100) NOT NULL DEFAULT '',
+                    `方案名称` VARCHAR(100) NOT NULL DEFAULT '',
+                    `等级` VARCHAR(100) NOT NULL DEFAULT '',
+                    `站点一致` TINYINT NOT NULL,
+                    `记录数` BIGINT NOT NULL,
+                    `总金额` DECIMAL(18,2) NOT NULL,
+                    PRIMARY KEY (`兑奖日期`, `兑奖单位`, `方案名称`, `等级`, `站点一致`),
+                    KEY idx_rollup_region (`兑奖单位`, `兑奖日期`),
+                    KEY idx_rollup_method (`方案名称`, `兑奖日期`)
+                )
+                """)
+                # 与导入批次互斥，生成期间提交的批次不会被漏算
+                with self.import_lock(cursor):
+                    self.update_daily_rollup(cursor, 0, build_table)
+                    cursor.connection.commit()
+                    cursor.execute(f"RENAME TABLE {build_table} TO {self.rollup_table}")
+                self.result_cache.invalidate()
+                self.log_message("已从明细表生成按天汇总统计表")
+                
+        except Exception as e:
+            self.log_message(f"维护按天汇总表失败: {e}")
+    
+    @contextmanager
+    def import_lock(self, cursor, timeout=None):
+        """导入互斥锁（GET_LOCK）：从读取插入前的最大 id 到提交期间持有，
+        保证 id 大于该值的明细只属于本批，其他会话或后台任务的并发导入不会被重复累加到汇总表"""
+        lock_name = f"{self.table_name}_import"
+        if timeout is None:
+            timeout = self.import_lock_timeout
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (lock_name, timeout))
+        if cursor.fetchone()[0] != 1:
+            raise TimeoutError(f"等待其他导入完成超时（{timeout}秒）")
+        try:
+            yield
+        except Exception:
+            # 先回滚本批，再让其他导入继续
+            cursor.connection.rollback()
+            raise
+        finally:
+            try:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (lock_name,))
+            except Exception as e:
+                # 连接已断开时锁随会话一起释放
+                self.log_message(f"释放导入锁失败: {e}")
+    
+    def rollup_group_sql(self, where_sql):
+        """按汇总表的键对满足 where_sql 的明细分组，列与按天汇总表一致（主键列不能为 NULL，空值存为 ''，读取时由 merge_blank_labels 还原）"""
+        mapping = self.column_mapping
+        return f"""
+            SELECT
+                COALESCE(DATE(`{mapping['redeem_time']}`), '{self.rollup_null_date}') AS `兑奖日期`,
+                COALESCE(`{mapping['region']}`, '') AS `兑奖单位`,
+                COALESCE(`{mapping['play_method']}`, '') AS `方案名称`,
+                COALESCE(`{mapping['prize_level']}`, '') AS `等级`,
+                `{mapping['sale_site']}` <=> `{mapping['redeem_site']}` AS `站点一致`,
+                COUNT(*) AS `记录数`,
+                COALESCE(SUM(`{mapping['prize_amount']}`), 0) AS `总金额`
+            FROM {self.table_name}
+            WHERE {where_sql}
+            GROUP BY 1, 2, 3, 4, 5
+        """
+    
+    def update_daily_rollup(self, cursor, after_id, rollup_table=None):
+        """把 id 大于 after_id 的明细增量累加到按天汇总表（在导入事务内、持有 import_lock 时调用）"""
+        cursor.execute(f"""
+            INSERT INTO {rollup_table or self.rollup_table}
+                (`兑奖日期`, `兑奖单位`, `方案名称`, `等级`, `站点一致`, `记录数`, `总金额`)
+            {self.rollup_group_sql("id > %s")}
+            ON DUPLICATE KEY UPDATE
+                `记录数` = `记录数` + VALUES(`记录数`),
+                `总金额` = `总金额` + VALUES(`总金额`)
+        """, (after_id,))
+    
+    def subtract_from_daily_rollup(self, cursor, ids):
+        """从按天汇总表中减去将要删除的明细（在删除的同一事务中、删除之前调用），记录数减到 0 的汇总行删除"""
+        placeholders = ', '.join(['%s'] * len(ids))
+        deleted_rows = self.rollup_group_sql(f"id IN ({placeholders})")
+        join_sql = (
+            f"{self.rollup_table} r JOIN ({deleted_rows}) d "
+            "ON r.`兑奖日期` = d.`兑奖日期` AND r.`兑奖单位` = d.`兑奖单位` AND r.`方案名称` = d.`方案名称` "
+            "AND r.`等级` = d.`等级` AND r.`站点一致` = d.`站点一致`"
+        )
+        cursor.execute(
+            f"UPDATE {join_sql} SET r.`记录数` = r.`记录数` - d.`记录数`, r.`总金额` = r.`总金额` - d.`总金额`",
+            list(ids)
+        )
+        cursor.execute(f"DELETE r FROM {join_sql} WHERE r.`记录数` <= 0", list(ids))
+    
+    def can_use_rollup(self, conditions):
+        """筛选条件只涉及兑奖单位、玩法和兑奖日期、且按天汇总表已生成时可以直接读汇总表"""
+        rollup_keys = {'region', 'play_methods', 'redeem_start_time', 'redeem_end_time'}
+        return set(conditions) <= rollup_keys and self.rollup_available()
+    
+    def rollup_available(self):
+        """按天汇总表是否已生成（表升级完成前不存在；生成后不会再删除，检查到一次即可）"""
+        if not self._rollup_available:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(f"SHOW TABLES LIKE '{self.rollup_table}'")
+                self._rollup_available = cursor.fetchone() is not None
+        return self._rollup_available
+    
+    def read_rollup_frame(self, query, params):
+        """执行按天汇总表查询（汇总表只在 MySQL 中，不走列式副本）"""
+        with self.get_connection() as connection:
+            return pd.read_sql(with_max_execution_time(query, self.query_timeout_ms), connection, params=params)
+    
+    def build_rollup_query(self, conditions, select_columns):
+        """构建汇总表查询语句（条件含义与 build_query 相同）"""
+        query = f"SELECT {select_columns} FROM {self.rollup_table} WHERE 1=1"
+        query_params = []
+        
+        if conditions.get('region'):
+            query += " AND `兑奖单位` = %s"
+            query_params.append(conditions['region'])
+        
+        if conditions.get('play_methods'):
+            placeholders = ', '.join(['%s'] * len(conditions['play_methods']))
+            query += f" AND `方案名称` IN ({placeholders})"
+            query_params.extend(conditions['play_methods'])
+        
+        if conditions.get('redeem_start_time') and conditions.get('redeem_end_time'):
+            query += " AND `兑奖日期` >= %s AND `兑奖日期` < %s"
+            query_params.extend(self.date_range_bounds(conditions['redeem_start_time'], conditions['redeem_end_time']))
+        
+        return query, query_params
+    
+    def get_month_partitions(self, cursor):
+        """读取明细表现有的按月分区（每月第一天，升序），未分区时返回空列表"""
+        cursor.execute("""
+            SELECT partition_name FROM information_schema.partitions
+            WHERE table_schema = DATABASE() AND table_name = %s AND partition_name IS NOT NULL
+            ORDER BY partition_ordinal_position
+        """, (self.table_name,))
+        months = []
+        for (partition_name,) in cursor.fetchall():
+            if partition_name.startswith('p') and partition_name[1:].isdigit():
+                months.append(datetime.strptime(partition_name[1:], '%Y%m'))
+        return months
+    
+    def migrate_to_month_partitions(self, connection, cursor):
+        """把未分区的明细表迁移为按兑奖时间按月分区（需要复制整表，由用户手动执行）。
+        迁移期间持有导入锁；任一步失败时撤销已做的修改，兑奖时间恢复为空后抛出异常"""
+        sentinel = f"{self.rollup_null_date} 00:00:00"
+        moved = 0
+        keys_changed = False
+        try:
+            with self.import_lock(cursor):
+                try:
+                    self.log_message("开始把明细表迁移为按月分区，数据量大时需要较长时间")
+                    
+                    # 分区列要进入主键，空的兑奖时间改为哨兵日期并重算去重哈希
+                    cursor.execute(
+                        f"UPDATE {self.table_name} SET `兑奖时间` = %s, ticket_hash = {ticket_hash_sql()} "
+                        f"WHERE `兑奖时间` IS NULL",
+                        (sentinel,)
+                    )
+                    moved = cursor.rowcount
+                    connection.commit()
+                    if moved:
+                        self.log_message(f"已把 {moved} 条兑奖时间为空的记录改为哨兵日期 {self.rollup_null_date}")
+                    
+                    # 主键和唯一键必须包含分区列
+                    cursor.execute(f"""
+                        ALTER TABLE {self.table_name}
+                        MODIFY `兑奖时间` DATETIME NOT NULL DEFAULT '{sentinel}',
+                        DROP PRIMARY KEY, ADD PRIMARY KEY (id, `兑奖时间`),
+                        DROP INDEX uk_ticket_hash, ADD UNIQUE KEY uk_ticket_hash (ticket_hash, `兑奖时间`)
+                    """)
+                    keys_changed = True
+                    
+                    cursor.execute(
+                        f"SELECT MIN(`兑奖时间`), MAX(`兑奖时间`) FROM {self.table_name} WHERE `兑奖时间` > %s",
+                        (f"{self.rollup_null_date} 23:59:59",)
+                    )
+                    min_time, max_time = cursor.fetchone()
+                    current_month = month_start(datetime.now())
+                    first_month = month_start(min_time) if min_time else current_month
+                    last_month = max(month_start(max_time) if max_time else current_month, current_month)
+                    last_month = add_months(last_month, self.partition_config['future_months'])
+                    
+                    cursor.execute(f"ALTER TABLE {self.table_name} {build_partition_by_sql(first_month, last_month)}")
+                    self.log_message(f"明细表已按月分区: {first_month:%Y-%m} 至 {last_month:%Y-%m}")
+                except Exception as e:
+                    self.log_message(f"迁移为按月分区失败，撤销已做的修改: {e}")
+                    connection.rollback()
+                    self.restore_unpartitioned_table(connection, cursor, keys_changed, moved)
+                    raise
+        finally:
+            if moved:
+                self.result_cache.invalidate()
+                if self.replica is not None:
+                    self.replica.reset()
+    
+    def restore_unpartitioned_table(self, connection, cursor, keys_changed, moved):
+        """迁移失败时恢复原主键、唯一键和可为空的兑奖时间，哨兵日期改回空值并重算去重哈希"""
+        try:
+            if keys_changed:
+                cursor.execute(f"""
+                    ALTER TABLE {self.table_name}
+                    DROP PRIMARY KEY, ADD PRIMARY KEY (id),
+                    DROP INDEX uk_ticket_hash, ADD UNIQUE KEY uk_ticket_hash (ticket_hash),
+                    MODIFY `兑奖时间` DATETIME NULL DEFAULT NULL
+                """)
+            if moved:
+                cursor.execute(
+                    f"UPDATE {self.table_name} SET `兑奖时间` = NULL, ticket_hash = {ticket_hash_sql()} "
+                    f"WHERE `兑奖时间` = %s",
+                    (f"{self.rollup_null_date} 00:00:00",)
+                )
+                connection.commit()
+                self.log_message(f"已把 {cursor.rowcount} 条记录的兑奖时间恢复为空")
+        except Exception as e:
+            self.log_message(f"撤销分区迁移的修改失败，需要人工检查表结构和兑奖时间为 {self.rollup_null_date} 的记录: {e}")
+    
+    def submit_schema_upgrade_job(self):
+        """把表结构升级提交为后台任务（与导入、分区迁移排在同一队列，不会同时运行）"""
+        token = CancelToken(self.kill_query)
+        worker = BackgroundWorkerApp(cancel_token=token)
+        
+        def run(job_id, report):
+            worker.bind_report(report)
+            with worker.get_connection() as connection:
+                worker.upgrade_schema(connection, connection.cursor())
+            return {'message': "明细表结构升级完成"}
+        
+        try:
+            job_id = self.jobs.submit('migrate', "明细表结构升级", st.session_state.username, run, cancel_token=token)
+            st.success(f"✅ 已提交表结构升级任务 {job_id}，可在「任务」标签页查看进度")
+            self.log_message(f"提交表结构升级任务 {job_id}")
+        except Exception as e:
+            st.error(f"❌ 提交后台任务失败: {str(e)}")
+            self.log_message(f"提交表结构升级任务失败: {str(e)}")
+    
+    def setup_schema_upgrade_ui(self):
+        """明细表有待完成的结构升级时，提供手动升级入口"""
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(f"SHOW TABLES LIKE '{self.table_name}'")
+                if not cursor.fetchone():
+                    return
+                pending = self.pending_schema_upgrades(cursor)
+        except Exception as e:
+            self.log_message(f"读取表结构失败: {e}")
+            return
+        if not pending:
+            return
+        
+        with st.expander("🛠️ 明细表结构升级", expanded=any(step in IMPORT_REQUIRED_UPGRADES for step in pending)):
+            st.caption(
+                "以下步骤需要扫描或改写整张明细表，在后台任务中执行，表越大耗时越长；"
+                "标记 ⛔ 的步骤完成前不能导入。回填分批提交，取消后重新执行会从未回填的记录继续。"
+            )
+            for step in pending:
+                st.write(f"{'⛔' if step in IMPORT_REQUIRED_UPGRADES else '•'} {SCHEMA_UPGRADE_STEPS[step]}")
+            if st.button("🛠️ 开始升级", use_container_width=True, key="schema_upgrade_btn"):
+                self.submit_schema_upgrade_job()
+    
+    def submit_partition_migration_job(self):
+        """把按月分区迁移提交为后台任务（可在「任务」页查看进度或取消）"""
+        token = CancelToken(self.kill_query)
+        worker = BackgroundWorkerApp(cancel_token=token)
+        
+        def run(job_id, report):
+            worker.bind_report(report)
+            with worker.get_connection() as connection:
+                worker.migrate_to_month_partitions(connection, connection.cursor())
+            return {'message': "明细表已迁移为按月分区"}
+        
+        try:
+            job_id = self.jobs.submit('migrate', "明细表按月分区迁移", st.session_state.username, run, cancel_token=token)
+            st.success(f"✅ 已提交分区迁移任务 {job_id}，可在「任务」标签页查看进度")
+            self.log_message(f"提交分区迁移任务 {job_id}")
+        except Exception as e:
+            st.error(f"❌ 提交后台任务失败: {str(e)}")
+            self.log_message(f"提交分区迁移任务失败: {str(e)}")
+    
+    def setup_partition_migration_ui(self):
+        """已开启按月分区但明细表尚未分区时，提供手动迁移入口"""
+        if not self.partition_config['enabled']:
+            return
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(f"SHOW TABLES LIKE '{self.table_name}'")
+                if not cursor.fetchone() or self.get_month_partitions(cursor):
+                    return
+                # 迁移要改写哈希唯一键，需先完成表结构升级
+                if 'ticket_hash' in self.pending_schema_upgrades(cursor):
+                    return
+        except Exception as e:
+            self.log_message(f"读取分区信息失败: {e}")
+            return
+        
+        with st.expander("🗂️ 迁移为按月分区"):
+            st.caption(
+                "已开启按月分区，但明细表尚未分区。迁移会复制整张表，期间导入会等待；"
+                f"兑奖时间为空的记录在库中改存为哨兵日期 {self.rollup_null_date}，查询和导出结果中仍显示为空。"
+                "任一步失败会撤销已做的修改。"
+            )
+            confirmed = st.checkbox("我已了解迁移需要较长时间", key="confirm_partition_migration")
+            if st.button("🗂️ 开始迁移", use_container_width=True, disabled=not confirmed, key="partition_migration_btn"):
+                self.submit_partition_migration_job()
+    
+    def ensure_month_partitions(self, cursor, first_month, last_month):
+        """确保 first_month 到 last_month 每月都有独立分区，缺失的从 pmax 或 p_history 拆分出来"""
+        try:
+            months = self.get_month_partitions(cursor)
+            if not months:
+                return
             
-            connection.commit()
-            connection.close()
-            return True
+            if last_month > months[-1]:
+                clauses = month_partition_clauses(add_months(months[-1], 1), last_month)
+                clauses.append("PARTITION pmax VALUES LESS THAN (MAXVALUE)")
+                cursor.execute(
+                    f"ALTER TABLE {self.table_name} REORGANIZE PARTITION pmax INTO ({', '.join(clauses)})"
+                )
+                self.log_message(f"已创建分区: {add_months(months[-1], 1):%Y-%m} 至 {last_month:%Y-%m}")
             
+            if first_month < months[0]:
+                clauses = [f"PARTITION p_history VALUES LESS THAN ('{first_month:%Y-%m-%d}')"]
+                clauses.extend(month_partition_clauses(first_month, add_months(months[0], -1)))
+                cursor.execute(
+                    f"ALTER TABLE {self.table_name} REORGANIZE PARTITION p_history INTO ({', '.join(clauses)})"
+                )
+                self.log_message(f"已创建分区: {first_month:%Y-%m} 至 {add_months(months[0], -1):%Y-%m}")
         except Exception as e:
-            self.log_message(f"检查表结构失败: {str(e)}")
-            return False
-
-    def clean_duplicate_data(self, cursor):
-        """清理表中的重复数据"""
+            self.log_message(f"创建按月分区失败: {e}")
+    
+    def ensure_partitions_for_chunk(self, cursor, df):
+        """导入前为本批数据涉及的月份创建分区（DDL 会隐式提交，须在本批事务开始前调用）"""
+        # 哨兵日期超出 pandas 时间范围，转换后为空值，直接被去掉
+        redeem_times = pd.to_datetime(df['兑奖时间'], errors='coerce').dropna()
+        redeem_times = redeem_times[redeem_times.dt.year > 1000]
+        if redeem_times.empty:
+            return
+        self.ensure_month_partitions(cursor, month_start(redeem_times.min()), month_start(redeem_times.max()))
+    
+    def backfill_ticket_hash(self, connection, cursor):
+        """按 id 区间分批回填缺失的去重哈希，每批单独提交避免长事务（键列有空值、哈希本应为 NULL 的行跳过）"""
+        cursor.execute(
+            f"SELECT MIN(id), MAX(id) FROM {self.table_name} "
+            f"WHERE ticket_hash IS NULL AND {ticket_hash_sql()} IS NOT NULL"
+        )
+        min_id, max_id = cursor.fetchone()
+        if min_id is None:
+            return 0
+        
+        batch_size = self.hash_backfill_batch_size
+        filled = 0
+        for start_id in range(min_id, max_id + 1, batch_size):
+            if self.cancel_token is not None:
+                self.cancel_token.check()
+            cursor.execute(
+                f"UPDATE {self.table_name} SET ticket_hash = {ticket_hash_sql()} "
+                f"WHERE id >= %s AND id < %s AND ticket_hash IS NULL",
+                (start_id, start_id + batch_size)
+            )
+            filled += cursor.rowcount
+            connection.commit()
+            self.log_message(f"回填去重哈希: 已处理到 id {min(start_id + batch_size - 1, max_id)}，累计 {filled} 行")
+        
+        self.log_message(f"去重哈希回填完成，共 {filled} 行")
+        return filled
+    
+    def iter_duplicate_id_batches(self, batch_size):
+        """一次分组扫描找出重复的去重哈希，按 (哈希, id) 顺序流式读取这些行，每组保留 id 最大的一条，
+        其余重复行的 id 每 batch_size 个产出一批。读取使用单独借出的连接，调用方可在两批之间用自己的连接删除"""
+        with self.get_connection() as connection:
+            stream = connection.cursor(pymysql.cursors.SSCursor)
+            try:
+                stream.execute(f"""
+                    SELECT t.ticket_hash, t.id FROM {self.table_name} t
+                    JOIN (
+                        SELECT ticket_hash FROM {self.table_name}
+                        WHERE ticket_hash IS NOT NULL
+                        GROUP BY ticket_hash
+                        HAVING COUNT(*) > 1
+                    ) d ON d.ticket_hash = t.ticket_hash
+                    ORDER BY t.ticket_hash, t.id
+                """)
+                batch = []
+                previous_hash = previous_id = None
+                for rows in self.iter_cursor_chunks(stream):
+                    for ticket_hash, row_id in rows:
+                        # 同组的上一行不是 id 最大的一条
+                        if ticket_hash == previous_hash:
+                            batch.append(previous_id)
+                            if len(batch) >= batch_size:
+                                yield batch
+                                batch = []
+                        previous_hash, previous_id = ticket_hash, row_id
+                if batch:
+                    yield batch
+            finally:
+                stream.close()
+    
+    def clean_duplicate_data(self, cursor, dry_run=False):
+        """清理表中的重复数据：流式读取重复行的 id，按主键分批删除，每批连同按天汇总表的扣减在同一事务中提交；
+        dry_run 只统计不删除。中途失败时回滚当前批并抛出 DuplicateCleanupError，其中带有已提交删除的行数"""
+        deleted = 0
+        batch_size = self.dedup_delete_batch_size
         try:
-            # 删除完全重复的行（所有字段都相同）
-            delete_duplicates_sql = f"""
-            DELETE t1 FROM {self.table_name} t1
-            INNER JOIN {self.table_name} t2 
-            WHERE 
-                t1.id < t2.id AND
-                t1.`彩票流水号` = t2.`彩票流水号` AND
-                t1.`方案代码` = t2.`方案代码` AND
-                t1.`兑奖时间` = t2.`兑奖时间` AND
-                t1.`兑奖金额` = t2.`兑奖金额`
-            """
-            cursor.execute(delete_duplicates_sql)
-            self.log_message(f"已清理重复数据，影响行数: {cursor.rowcount}")
+            if dry_run:
+                total = sum(len(batch_ids) for batch_ids in self.iter_duplicate_id_batches(batch_size))
+                self.log_message(f"重复数据统计: 共 {total} 行待清理")
+                return total
+            
+            # 汇总表在结构升级完成前可能还不存在，生成时会按删除后的明细计算
+            cursor.execute(f"SHOW TABLES LIKE '{self.rollup_table}'")
+            has_rollup = cursor.fetchone() is not None
+            
+            # 按主键小批删除，锁持有时间短，不阻塞正在进行的查询
+            for batch_ids in self.iter_duplicate_id_batches(batch_size):
+                if has_rollup:
+                    self.subtract_from_daily_rollup(cursor, batch_ids)
+                placeholders = ', '.join(['%s'] * len(batch_ids))
+                cursor.execute(f"DELETE FROM {self.table_name} WHERE id IN ({placeholders})", batch_ids)
+                deleted_in_batch = cursor.rowcount
+                cursor.connection.commit()
+                deleted += deleted_in_batch
+                self.log_message(f"清理重复数据进度: 已删除 {deleted} 行")
+            
+            self.log_message(f"已清理重复数据，影响行数: {deleted}" if deleted else "未发现重复数据")
+            return deleted
             
         except Exception as e:
-            self.log_message(f"清理重复数据失败: {e}")
+            cursor.connection.rollback()
+            self.log_message(f"清理重复数据失败（此前已删除 {deleted} 行）: {e}")
+            raise DuplicateCleanupError(f"清理重复数据失败（此前已删除 {deleted} 行）: {e}", deleted) from e
+        finally:
+            # 明细有删除（包括失败前已提交的批次）：列式副本只能追加，清空重建；共享查询缓存失效
+            if deleted:
+                if self.replica is not None:
+                    self.replica.reset()
+                self.result_cache.invalidate()
 
     def get_latest_redeem_date(self):
         """从数据库获取最新的兑奖日期"""
         try:
-            if not self.test_db_connection():
-                return None
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
                 
-            connection = pymysql.connect(**self.db_config)
-            cursor = connection.cursor()
-            
-            redeem_time_col = self.column_mapping['redeem_time']
-            query = f"SELECT MAX({redeem_time_col}) FROM {self.table_name}"
-            cursor.execute(query)
-            result = cursor.fetchone()
-            
-            connection.close()
+                redeem_time_col = self.column_mapping['redeem_time']
+                query = f"SELECT MAX({redeem_time_col}) FROM {self.table_name}"
+                cursor.execute(query)
+                result = cursor.fetchone()
             
             if result and result[0]:
                 latest_date = result[0]
@@ -284,32 +2377,47 @@ class LotteryDataExporterStreamlit:
         """对密码进行哈希处理"""
         return hashlib.sha256(password.encode()).hexdigest()
     
+    def create_pool(self):
+        """所有会话共享进程级连接池（相同配置只创建一次）"""
+        return get_connection_pool(self.db_config, **self.pool_config)
+    
+    @contextmanager
+    def get_connection(self):
+        """从共享连接池借出连接（借出和取消标记的登记由父类处理），同时更新连接状态"""
+        acquired = False
+        try:
+            with super().get_connection() as connection:
+                acquired = True
+                self.record_connection_status(True)
+                yield connection
+        except Exception:
+            if not acquired:
+                self.record_connection_status(False)
+            raise
+    
+    def record_connection_status(self, connected):
+        """记录本会话的数据库连接状态"""
+        st.session_state.db_connected = connected
+    
     def test_db_connection(self):
         """测试数据库连接"""
         try:
-            connection = pymysql.connect(**self.db_config)
-            connection.close()
-            st.session_state.db_connected = True
+            with self.get_connection():
+                pass
             return True
         except Exception as e:
-            st.session_state.db_connected = False
             return False
     
     def verify_user(self, username, password):
         """验证用户登录信息"""
-        if not self.test_db_connection():
-            return False
-            
         try:
-            connection = pymysql.connect(**self.db_config)
-            cursor = connection.cursor()
-            
-            hashed_password = self.hash_password(password)
-            query = f"SELECT * FROM {self.user_table} WHERE username = %s AND password = %s"
-            cursor.execute(query, (username, hashed_password))
-            user = cursor.fetchone()
-            
-            connection.close()
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                
+                hashed_password = self.hash_password(password)
+                query = f"SELECT * FROM {self.user_table} WHERE username = %s AND password = %s"
+                cursor.execute(query, (username, hashed_password))
+                user = cursor.fetchone()
             
             if user:
                 # 登录成功后获取最新数据日期
@@ -363,6 +2471,12 @@ class LotteryDataExporterStreamlit:
     
     def setup_main_ui(self):
         """设置主界面（查询页面）"""
+        # 登录后自动加载玩法和单位列表（通常直接命中共享缓存）
+        if not st.session_state.initial_load_attempted:
+            st.session_state.initial_load_attempted = True
+            self.fetch_play_methods_from_db()
+            self.fetch_regions_from_db()
+        
         # 顶部导航栏
         col1, col2, col3 = st.columns([3, 1, 1])
         with col1:
@@ -426,6 +2540,33 @@ class LotteryDataExporterStreamlit:
                 if st.button("🔄 刷新数据", use_container_width=True):
                     self.refresh_data_lists()
             
+            # 连接池状态
+            pool_stats = self.pool.stats()
+            with st.expander("🔌 连接池状态"):
+                st.write(f"使用中: **{pool_stats['in_use']}** / {pool_stats['pool_size']}")
+                st.write(f"空闲连接: {pool_stats['idle']}")
+                st.write(f"累计借出: {pool_stats['checkouts']} 次（复用 {pool_stats['reused']} 次）")
+                st.write(f"已创建连接: {pool_stats['created']}")
+                st.write(f"回收连接: {pool_stats['recycled']}，ping失败: {pool_stats['ping_failures']}，等待超时: {pool_stats['timeouts']}")
+            
+            # 本地列式副本
+            if self.replica is not None:
+                st.checkbox("⚡ 使用本地列式副本查询", key="use_replica", help="筛选查询和站点汇总在本地 DuckDB 上执行，不占用生产MySQL")
+                replica_stats = self.replica.stats()
+                with st.expander("🗃️ 列式副本状态"):
+                    st.write(f"水位 id: {replica_stats['watermark']}")
+                    st.write(f"本地查询: {replica_stats['queries']} 次，回退MySQL: {replica_stats['fallbacks']} 次")
+                    st.write(f"累计追加: {replica_stats['refreshed_rows']} 行，核对后重建: {replica_stats['rebuilds']} 次")
+                    if replica_stats['last_refresh']:
+                        st.write(f"最近刷新: {replica_stats['last_refresh']:%Y-%m-%d %H:%M:%S}")
+                    sync_job = self.jobs.active_job('replica')
+                    if sync_job:
+                        st.caption(f"后台同步中（{sync_job['message']}），同步完成前查询MySQL")
+                    if st.button("🔄 重建副本", use_container_width=True, key="rebuild_replica"):
+                        self.replica.reset()
+                        if self.request_replica_refresh():
+                            st.success("✅ 已提交重建任务，可在「任务」标签页查看进度")
+            
             st.markdown("---")
             st.header("📊 快速操作")
             if st.button("🗑️ 清空所有条件", use_container_width=True):
@@ -436,11 +2577,11 @@ class LotteryDataExporterStreamlit:
             st.header("📈 系统状态")
             st.metric("已选玩法", len(st.session_state.selected_play_methods))
             st.metric("金额条件", len(st.session_state.prize_conditions))
-            if st.session_state.preview_data is not None:
-                st.metric("查询结果", len(st.session_state.preview_data))
+            if st.session_state.preview_conditions is not None:
+                st.metric("查询结果", st.session_state.preview_total)
         
         # 主内容区 - 使用标签页组织
-        tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["🔍 数据筛选", "📋 数据预览", "🏪 站点分析", "💾 数据导出", "📤 数据导入", "📝 操作日志"])
+        tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["🔍 数据筛选", "📋 数据预览", "🏪 站点分析", "💾 数据导出", "📤 数据导入", "🕒 任务", "📝 操作日志"])
         
         with tab1:
             self.setup_filter_ui()
@@ -458,6 +2599,9 @@ class LotteryDataExporterStreamlit:
             self.setup_import_ui()
         
         with tab6:
+            self.setup_jobs_ui()
+        
+        with tab7:
             self.setup_log_ui()
     
     def refresh_data_lists(self):
@@ -468,8 +2612,9 @@ class LotteryDataExporterStreamlit:
                 return
                 
             with st.spinner("正在刷新数据..."):
-                success1 = self.fetch_play_methods_from_db()
-                success2 = self.fetch_regions_from_db()
+                # 用户明确要求刷新：跳过缓存，其他进程写入的单位和玩法也能查到
+                success1 = self.fetch_play_methods_from_db(refresh=True)
+                success2 = self.fetch_regions_from_db(refresh=True)
                 # 同时刷新数据更新日期
                 latest_date = self.get_latest_redeem_date()
                 if latest_date:
@@ -522,7 +2667,7 @@ class LotteryDataExporterStreamlit:
             with region_col2:
                 if st.button("📥 获取单位", key="fetch_regions", use_container_width=True):
                     with st.spinner("正在获取兑奖单位..."):
-                        if self.fetch_regions_from_db():
+                        if self.fetch_regions_from_db(refresh=True):
                             st.success("✅ 兑奖单位列表已更新")
                         else:
                             st.error("❌ 获取兑奖单位失败")
@@ -543,7 +2688,7 @@ class LotteryDataExporterStreamlit:
             with method_col2:
                 if st.button("📥 获取玩法", key="fetch_methods", use_container_width=True):
                     with st.spinner("正在获取玩法列表..."):
-                        if self.fetch_play_methods_from_db():
+                        if self.fetch_play_methods_from_db(refresh=True):
                             st.success("✅ 玩法列表已更新")
                         else:
                             st.error("❌ 获取玩法列表失败")
@@ -667,6 +2812,14 @@ class LotteryDataExporterStreamlit:
         
         # 操作按钮
         st.markdown("---")
+        st.checkbox(
+            "📄 分页预览（只加载当前页，导出时再加载完整数据）",
+            key="paged_preview"
+        )
+        st.checkbox(
+            "🏪 站点分析在数据库中汇总（无需先预览，查看明细时再读取）",
+            key="sql_site_analysis"
+        )
         action_col1, action_col2, action_col3, action_col4, action_col5 = st.columns(5)
         
         with action_col1:
@@ -688,12 +2841,16 @@ class LotteryDataExporterStreamlit:
         with action_col5:
             if st.button("📊 查看统计", use_container_width=True, key="stats_btn"):
                 self.show_statistics()
+        
+        self.setup_preview_job_ui()
     
     def setup_preview_ui(self):
         """设置数据预览界面"""
         st.header("📋 数据预览")
         
-        if st.session_state.preview_data is not None:
+        if st.session_state.preview_data is None and st.session_state.preview_page_data is not None:
+            self.setup_paged_preview_ui()
+        elif st.session_state.preview_data is not None:
             if not st.session_state.preview_data.empty:
                 st.success(f"✅ 查询到 {len(st.session_state.preview_data)} 条记录")
                 
@@ -722,11 +2879,265 @@ class LotteryDataExporterStreamlit:
         else:
             st.info("ℹ️ 请先在「数据筛选」标签页中设置条件并点击「预览数据」")
     
+    def setup_paged_preview_ui(self):
+        """分页预览界面 - 只显示当前页数据"""
+        total = st.session_state.preview_total
+        if total == 0:
+            st.warning("⚠️ 没有找到符合条件的数据")
+            st.info("请调整筛选条件后重新查询")
+            return
+        
+        page_size = st.session_state.preview_page_size
+        page_index = len(st.session_state.preview_page_anchors) - 1
+        total_pages = (total + page_size - 1) // page_size
+        page_data = st.session_state.preview_page_data
+        
+        st.success(f"✅ 查询到 {total} 条记录（分页预览，第 {page_index + 1}/{total_pages} 页）")
+        
+        # 分页控制
+        col1, col2, col3, col4, col5 = st.columns([2, 1, 1, 1, 1])
+        with col1:
+            page_size_options = [100, 500, 1000, 5000]
+            new_page_size = st.selectbox(
+                "每页记录数",
+                page_size_options,
+                index=page_size_options.index(page_size) if page_size in page_size_options else 2,
+                key="preview_page_size_select"
+            )
+        with col2:
+            show_all = st.checkbox("显示所有列")
+        with col3:
+            if st.button("⏮️ 首页", key="first_page", disabled=page_index == 0, use_container_width=True):
+                self.goto_preview_page([0])
+        with col4:
+            if st.button("◀️ 上一页", key="prev_page", disabled=page_index == 0, use_container_width=True):
+                self.goto_preview_page(st.session_state.preview_page_anchors[:-1])
+        with col5:
+            if st.button("下一页 ▶️", key="next_page", disabled=page_index + 1 >= total_pages, use_container_width=True):
+                next_anchor = int(page_data['id'].iloc[-1])
+                self.goto_preview_page(st.session_state.preview_page_anchors + [next_anchor])
+        
+        if new_page_size != page_size:
+            st.session_state.preview_page_size = new_page_size
+            self.goto_preview_page([0])
+        
+        # 显示数据
+        display_data = page_data
+        if not show_all and len(display_data.columns) > 10:
+            cols_to_show = list(display_data.columns[:5]) + list(display_data.columns[-5:])
+            display_data = display_data[cols_to_show]
+            st.info("显示前5列和后5列，勾选'显示所有列'查看完整数据")
+        
+        st.dataframe(display_data, use_container_width=True)
+    
+    def goto_preview_page(self, anchors):
+        """跳转到指定分页（anchors[-1] 为该页起始位置之前的 id）"""
+        try:
+            st.session_state.preview_page_data = self.fetch_preview_page(anchors[-1])
+            st.session_state.preview_page_anchors = anchors
+        except Exception as e:
+            st.error(f"读取分页数据失败：{self.query_error_message(e)}")
+            self.log_message(f"读取分页数据失败: {e}")
+            return
+        st.rerun()
+    
+    def refresh_replica(self):
+        """把 MySQL 中副本水位之后、已提交的新明细追加到本地列式副本，返回追加行数（有导入进行中时不刷新）"""
+        if self.replica is None:
+            return 0
+        
+        def read_rows_between(after_id, upper_id):
+            query = (
+                f"SELECT {self.result_columns_sql()} FROM {self.table_name} "
+                f"WHERE id > %s AND id <= %s ORDER BY id"
+            )
+            with self.get_connection() as connection:
+                cursor = connection.cursor(pymysql.cursors.SSCursor)
+                try:
+                    cursor.execute(query, (after_id, upper_id))
+                    columns = [column[0] for column in cursor.description]
+                    for rows in self.iter_cursor_chunks(cursor, self.replica_chunk_size):
+                        yield columns, rows
+                        self.log_message(f"本地列式副本已同步到 id {rows[-1][0]} / {upper_id}")
+                finally:
+                    cursor.close()
+        
+        # 导入在持有导入锁期间分配 id 并提交：拿到锁时读到的最大 id 是安全水位，不大于它的明细都已提交
+        with self.get_connection() as connection:
+            cursor = connection.cursor()
+            try:
+                with self.import_lock(cursor, timeout=0):
+                    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {self.table_name}")
+                    upper_id = cursor.fetchone()[0]
+            except TimeoutError:
+                self.log_message("有导入正在进行，本次不刷新本地列式副本")
+                return 0
+        
+        appended = self.replica.refresh(read_rows_between, upper_id)
+        if appended:
+            self.log_message(f"本地列式副本已追加 {appended} 行，水位 id {self.replica.watermark()}")
+        
+        # 定期核对行数：外部删除或迟提交的较小 id 都会造成不一致，此时从头重建
+        if self.replica.check_due(self.replica_check_interval):
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(f"SELECT COUNT(*) FROM {self.table_name} WHERE id <= %s", (upper_id,))
+                mysql_count = cursor.fetchone()[0]
+            if not self.replica.verify(upper_id, mysql_count):
+                self.log_message(f"本地列式副本与MySQL行数不一致（MySQL {mysql_count} 行），正在重建")
+                appended = self.replica.refresh(read_rows_between, upper_id)
+                self.log_message(f"本地列式副本已重建，共 {appended} 行")
+        return appended
+    
+    def replica_enabled(self):
+        """本会话是否选择使用本地列式副本"""
+        return st.session_state.use_replica
+    
+    def replica_ready(self):
+        """启用了列式副本且已追上 MySQL 最大 id 时返回 True。
+        副本落后（包括首次全量同步）或到了核对时间时提交后台同步任务，同步完成前返回 False，查询改查 MySQL"""
+        if self.replica is None or not self.replica_enabled():
+            return False
+        try:
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {self.table_name}")
+                max_id = cursor.fetchone()[0]
+            if max_id > self.replica.watermark() or self.replica.check_due(self.replica_check_interval):
+                self.request_replica_refresh()
+            return self.replica.available() and self.replica.watermark() >= max_id
+        except Exception as e:
+            self.log_message(f"检查本地列式副本失败，改为查询MySQL: {e}")
+            return False
+    
+    def request_replica_refresh(self):
+        """提交同步本地列式副本的后台任务（同一时间只有一个），返回任务 id，提交失败时返回 None"""
+        token = CancelToken(self.kill_query)
+        worker = BackgroundWorkerApp(cancel_token=token, use_replica=True)
+        
+        def run(job_id, report):
+            worker.bind_report(report)
+            appended = worker.refresh_replica()
+            return {'message': f"本地列式副本已同步到 id {worker.replica.watermark()}，本次追加 {appended} 行"}
+        
+        try:
+            return self.jobs.submit(
+                'replica', "同步本地列式副本", st.session_state.username, run, cancel_token=token, unique=True
+            )
+        except RuntimeError as e:
+            self.log_message(f"提交列式副本同步任务失败: {e}")
+            return None
+    
+    def read_frame(self, query, params):
+        """执行明细查询：副本可用时在本地 DuckDB 上执行，否则（或副本出错时）查询 MySQL"""
+        if self.replica_ready():
+            try:
+                return self.replica.query_frame(query, params)
+            except Exception as e:
+                self.replica.record_fallback()
+                self.log_message(f"列式副本查询失败，改为查询MySQL: {e}")
+        with self.get_connection() as connection:
+            return pd.read_sql(with_max_execution_time(query, self.query_timeout_ms), connection, params=params)
+    
+    def read_scalar(self, query, params):
+        """执行只返回一个值的明细查询（路由规则同 read_frame）"""
+        if self.replica_ready():
+            try:
+                return self.replica.query_scalar(query, params)
+            except Exception as e:
+                self.replica.record_fallback()
+                self.log_message(f"列式副本查询失败，改为查询MySQL: {e}")
+        with self.get_connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute(with_max_execution_time(query, self.query_timeout_ms), params)
+            return cursor.fetchone()[0]
+    
+    def cached_query(self, kind, conditions, loader, *extra, ttl=None, refresh=False):
+        """先查共享结果缓存，未命中时执行 loader 并写入缓存（是否使用列式副本也是缓存键的一部分）；
+        refresh=True 时不读缓存，直接执行 loader 并用新结果替换缓存条目"""
+        use_replica = self.replica is not None and bool(self.replica_enabled())
+        cache_key = make_cache_key(kind, conditions, use_replica, *extra)
+        result = None if refresh else self.result_cache.get(cache_key)
+        if result is not None:
+            self.log_message(f"命中查询缓存（{kind}）")
+            return result
+        
+        # 先记下数据版本，查询期间如有导入则结果不入缓存
+        data_version = self.result_cache.data_version
+        result = loader()
+        self.result_cache.put(cache_key, result, data_version, ttl)
+        return result
+    
+    def fetch_full_result(self, conditions):
+        """读取完整查询结果（压缩为紧凑类型后与内存报告一起缓存），并记录本会话最近一次的内存报告"""
+        def load():
+            query, params = self.build_query(conditions)
+            # 显式按 id 排序：列式副本按文件读取，行顺序与 MySQL 不同
+            query += " ORDER BY id"
+            return self.compact_result(self.read_frame(query, params))
+        data, report = self.cached_query('full', conditions, load)
+        self.save_memory_report(report)
+        return data
+    
+    def compact_result(self, data):
+        """压缩查询结果内存占用，返回 (压缩后的DataFrame, 内存报告)"""
+        compact, report = compact_preview_frame(data)
+        before_total = report['原字节'].sum()
+        after_total = report['压缩后字节'].sum()
+        self.log_message(
+            f"查询结果 {len(data)} 行内存占用 {before_total / 1024 / 1024:.1f} MB → "
+            f"{after_total / 1024 / 1024:.1f} MB"
+        )
+        return compact, report
+    
+    def save_memory_report(self, report):
+        """记录本会话最近一次查询结果的内存报告"""
+        st.session_state.preview_memory_report = report
+    
+    def fetch_preview_count(self, conditions):
+        """统计查询结果总数"""
+        def load():
+            query, params = self.build_query(conditions, "COUNT(*)")
+            return int(self.read_scalar(query, params))
+        return self.cached_query('count', conditions, load)
+    
+    def fetch_preview_page(self, anchor, conditions=None, page_size=None):
+        """按 id 键集分页读取一页数据，避免 OFFSET 扫描（条件和每页行数默认取本会话的预览设置）"""
+        if conditions is None:
+            conditions = st.session_state.preview_conditions
+        if page_size is None:
+            page_size = st.session_state.preview_page_size
+        
+        def load():
+            query, params = self.build_query(conditions)
+            query += " AND id > %s ORDER BY id LIMIT %s"
+            return self.read_frame(query, params + [anchor, page_size])
+        return self.cached_query('page', conditions, load, anchor, page_size)
+    
+    def load_full_preview_data(self):
+        """分页预览模式下按需加载完整查询结果（导出和站点分析需要）"""
+        if st.session_state.preview_data is not None:
+            return True
+        if st.session_state.preview_conditions is None:
+            return False
+        
+        try:
+            with st.spinner(f"正在加载完整查询结果（{st.session_state.preview_total} 条）..."):
+                st.session_state.preview_data = self.fetch_full_result(st.session_state.preview_conditions)
+            self.log_message(f"已加载完整查询结果 {len(st.session_state.preview_data)} 条记录")
+            return True
+        except Exception as e:
+            st.error(f"加载完整查询结果失败：{self.query_error_message(e)}")
+            self.log_message(f"加载完整查询结果失败: {e}")
+            return False
+    
     def setup_site_analysis_ui(self):
         """设置站点分析界面"""
         st.header("🏪 售出站点与兑奖站点分析")
         
-        if st.session_state.site_analysis_data is not None:
+        if st.session_state.site_summary is not None:
+            self.setup_sql_site_analysis_ui()
+        elif st.session_state.site_analysis_data is not None:
             if not st.session_state.site_analysis_data.empty:
                 st.success(f"✅ 分析数据已生成，共 {len(st.session_state.site_analysis_data)} 条记录")
                 
@@ -759,7 +3170,7 @@ class LotteryDataExporterStreamlit:
                 # 统计信息
                 if not analysis_data.empty:
                     # 按区域统计
-                    region_stats = analysis_data.groupby(['兑奖单位', '站点关系']).agg({
+                    region_stats = analysis_data.groupby(['兑奖单位', '站点关系'], observed=True).agg({
                         '兑奖金额': ['count', 'sum']
                     }).round(2)
                     region_stats.columns = ['记录数', '总金额']
@@ -822,11 +3233,115 @@ class LotteryDataExporterStreamlit:
         else:
             st.info("ℹ️ 请先在「数据筛选」标签页中设置条件并点击「站点分析」")
     
+    def setup_sql_site_analysis_ui(self):
+        """数据库汇总模式的站点分析界面 - 汇总来自 GROUP BY，明细按需读取"""
+        summary = st.session_state.site_summary
+        conditions = st.session_state.site_analysis_conditions
+        
+        if summary.empty:
+            st.warning("⚠️ 没有找到符合条件的数据")
+            st.info("请调整筛选条件后重新分析")
+            return
+        
+        st.success(f"✅ 汇总分析已生成，共 {int(summary['记录数'].sum())} 条记录（数据库汇总）")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            analysis_type = st.radio(
+                "分析类型",
+                ["全部", "站点一致", "站点不一致"],
+                horizontal=True,
+                key="sql_analysis_type"
+            )
+        with col2:
+            if st.button("🔄 刷新分析", key="refresh_analysis"):
+                self.analyze_site_data()
+        
+        if analysis_type == "站点一致":
+            region_stats = summary[summary['站点关系'] == '一致']
+        elif analysis_type == "站点不一致":
+            region_stats = summary[summary['站点关系'] == '不一致']
+        else:
+            region_stats = summary
+        region_stats = region_stats.reset_index(drop=True)
+        
+        st.subheader(f"📊 {analysis_type}情况统计")
+        
+        if region_stats.empty:
+            st.warning(f"⚠️ 没有找到{analysis_type}的数据")
+            return
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.write("**📈 按区域统计**")
+            st.dataframe(region_stats, use_container_width=True)
+        
+        with col2:
+            st.write("**🎯 关键指标**")
+            
+            total_records = int(region_stats['记录数'].sum())
+            total_amount = region_stats['总金额'].sum()
+            avg_amount = total_amount / total_records if total_records else 0
+            
+            st.metric("总记录数", f"{total_records:,}")
+            st.metric("总兑奖金额", f"¥{total_amount:,.2f}")
+            st.metric("平均兑奖金额", f"¥{avg_amount:,.2f}")
+            
+            # 站点关系分布
+            if analysis_type == "全部":
+                st.write("🔗 站点关系分布")
+                for relation, count in region_stats.groupby('站点关系')['记录数'].sum().items():
+                    st.write(f"- {relation}: {count} 条 ({count/total_records*100:.1f}%)")
+        
+        # 明细数据按需从数据库读取
+        st.subheader("📋 详细数据")
+        if st.checkbox("查看明细数据", key="show_site_detail"):
+            show_count = st.slider("显示记录数量", 10, 1000, 100, 10, key="sql_analysis_show_count")
+            try:
+                detail_data = self.fetch_site_detail(conditions, analysis_type, show_count)
+                st.dataframe(detail_data, use_container_width=True)
+            except Exception as e:
+                st.error(f"读取明细数据失败：{self.query_error_message(e)}")
+                self.log_message(f"读取站点分析明细失败: {e}")
+        
+        # 导出分析结果
+        st.subheader("💾 导出分析结果")
+        export_filename = st.text_input(
+            "导出文件名",
+            value=f"site_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            key="analysis_export_filename"
+        )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("📊 导出分析数据", use_container_width=True, key="export_analysis"):
+                try:
+                    with st.spinner("正在读取分析明细..."):
+                        detail_data = self.fetch_site_detail(conditions, analysis_type)
+                    self.export_analysis_data(detail_data, export_filename)
+                except Exception as e:
+                    st.error(f"读取分析明细失败：{self.query_error_message(e)}")
+                    self.log_message(f"导出站点分析明细时读取失败: {e}")
+        with col2:
+            if st.button("📈 导出统计报表", use_container_width=True, key="export_stats"):
+                self.export_statistics_report(region_stats, export_filename)
+    
     def setup_export_ui(self):
         """设置数据导出界面"""
         st.header("💾 数据导出")
         
-        if st.session_state.preview_data is not None and not st.session_state.preview_data.empty:
+        # 流式导出不依赖内存中的预览数据，只要有查询条件即可
+        if st.session_state.preview_conditions is not None and st.session_state.preview_total:
+            self.setup_stream_export_ui()
+            st.markdown("---")
+        
+        if st.session_state.preview_data is None and st.session_state.preview_total:
+            st.info(f"ℹ️ 当前为分页预览，共 {st.session_state.preview_total} 条记录，导出前需要加载完整查询结果")
+            if st.button("📥 加载完整数据用于导出", type="primary", key="load_full_for_export"):
+                if self.load_full_preview_data():
+                    st.rerun()
+        
+        elif st.session_state.preview_data is not None and not st.session_state.preview_data.empty:
             st.success(f"✅ 当前有 {len(st.session_state.preview_data)} 条数据可导出")
             
             # 导出设置
@@ -871,6 +3386,105 @@ class LotteryDataExporterStreamlit:
         else:
             st.warning("⚠️ 没有可导出的数据")
             st.info("请先查询数据后再进行导出操作")
+        
+        if pq is not None:
+            st.markdown("---")
+            self.setup_snapshot_ui()
+    
+    def list_parquet_snapshots(self):
+        """列出本地 Parquet 快照文件（新的在前）"""
+        if not os.path.isdir(self.snapshot_dir):
+            return []
+        files = [name for name in os.listdir(self.snapshot_dir) if name.endswith('.parquet')]
+        return sorted(files, key=lambda name: os.path.getmtime(os.path.join(self.snapshot_dir, name)), reverse=True)
+    
+    def setup_snapshot_ui(self):
+        """本地 Parquet 快照：保存当前查询结果，之后直接读回而不查询数据库"""
+        st.subheader("🗂️ 本地 Parquet 快照")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            snapshot_name = st.text_input(
+                "快照名称",
+                value=f"snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+                key="snapshot_name"
+            )
+            has_data = st.session_state.preview_data is not None and not st.session_state.preview_data.empty
+            if st.button("💾 保存当前查询结果为快照", use_container_width=True, disabled=not has_data, key="save_snapshot"):
+                try:
+                    os.makedirs(self.snapshot_dir, exist_ok=True)
+                    path = os.path.join(self.snapshot_dir, f"{os.path.basename(snapshot_name)}.parquet")
+                    write_parquet_snapshot(st.session_state.preview_data, path)
+                    st.success(f"✅ 已保存快照 {snapshot_name}.parquet（{len(st.session_state.preview_data)} 条记录）")
+                    self.log_message(f"已保存 Parquet 快照: {path}")
+                except Exception as e:
+                    st.error(f"❌ 保存快照失败: {str(e)}")
+                    self.log_message(f"保存 Parquet 快照失败: {str(e)}")
+        
+        with col2:
+            snapshots = self.list_parquet_snapshots()
+            selected_snapshot = st.selectbox("已有快照", snapshots, key="snapshot_select")
+            if st.button("📂 载入快照", use_container_width=True, disabled=not snapshots, key="load_snapshot"):
+                try:
+                    data = read_parquet_snapshot(os.path.join(self.snapshot_dir, selected_snapshot))
+                    # 快照不对应数据库查询条件，流式导出和分页预览不可用
+                    st.session_state.preview_data = data
+                    st.session_state.preview_total = len(data)
+                    st.session_state.preview_conditions = None
+                    st.session_state.preview_page_data = None
+                    self.log_message(f"已载入 Parquet 快照 {selected_snapshot}，{len(data)} 条记录")
+                except Exception as e:
+                    st.error(f"❌ 载入快照失败: {str(e)}")
+                    self.log_message(f"载入 Parquet 快照失败: {str(e)}")
+                else:
+                    st.rerun()
+    
+    def setup_stream_export_ui(self):
+        """设置流式导出界面 - 直接从数据库游标分块写入临时文件"""
+        st.subheader("🚰 流式导出（直接读取数据库，内存占用与记录数无关）")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            stream_formats = ["CSV", "Excel"]
+            if pq is not None:
+                stream_formats.append("Parquet")
+            stream_format = st.radio(
+                "导出格式",
+                stream_formats,
+                horizontal=True,
+                key="stream_export_format"
+            )
+            stream_filename = st.text_input(
+                "文件名",
+                value=f"lottery_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+                key="stream_export_filename"
+            )
+            if stream_format == "CSV":
+                stream_encoding = st.selectbox("编码格式", ["utf-8", "gbk", "utf-8-sig"], key="stream_export_encoding")
+            elif stream_format == "Parquet":
+                stream_encoding = None
+                st.caption("列式格式，金额为 DECIMAL(10,2)、时间为时间戳类型，可直接被分析工具读取")
+            else:
+                stream_encoding = None
+                st.caption(f"超过 {EXCEL_MAX_ROWS - 1:,} 行时自动拆分为多个工作表")
+        
+        with col2:
+            st.metric("待导出记录数", st.session_state.preview_total)
+            if st.button("⚙️ 生成导出文件", use_container_width=True, type="primary", key="stream_export_btn"):
+                self.stream_export_file(stream_filename, stream_format, stream_encoding)
+            if st.button("🕒 后台导出（可继续其他操作）", use_container_width=True, key="stream_export_job_btn"):
+                self.submit_export_job(stream_filename, stream_format, stream_encoding)
+            
+            export_file = st.session_state.stream_export_file
+            if export_file and os.path.exists(export_file['path']):
+                st.download_button(
+                    label=f"📥 下载 {export_file['file_name']}（{export_file['rows']} 条）",
+                    data=deferred_file_data(export_file['path']),
+                    file_name=export_file['file_name'],
+                    mime=export_file['mime'],
+                    use_container_width=True,
+                    key="stream_export_download"
+                )
     
     def setup_import_ui(self):
         """设置数据导入界面"""
@@ -895,12 +3509,12 @@ class LotteryDataExporterStreamlit:
         
         if uploaded_file is not None:
             try:
-                # 读取Excel文件，跳过前4行标题行
-                with st.spinner("正在读取Excel文件（跳过前4行标题）..."):
-                    df = pd.read_excel(uploaded_file, skiprows=4)
-                    st.session_state.import_data = df
+                # xlsx 以只读模式流式读取，这里只读表头和前10行；xls 只能整体读取，预览中只保留前10行
+                is_xlsx = uploaded_file.name.lower().endswith('.xlsx')
+                preview = self.load_import_preview(uploaded_file, is_xlsx)
+                df, data_rows, fingerprint = preview['df'], preview['data_rows'], preview['fingerprint']
                 
-                st.success(f"✅ 成功读取Excel文件，共 {len(df)} 行 {len(df.columns)} 列")
+                st.success(f"✅ 成功读取Excel文件，共 {data_rows} 行 {len(df.columns)} 列")
                 
                 # 显示数据预览
                 st.subheader("👀 数据预览（从第5行开始的数据）")
@@ -959,6 +3573,44 @@ class LotteryDataExporterStreamlit:
                     help="根据关键字段自动跳过重复记录"
                 )
                 
+                import_chunk_size = st.number_input(
+                    "每批提交行数",
+                    min_value=500,
+                    max_value=100000,
+                    value=self.import_chunk_size,
+                    step=500,
+                    key="import_chunk_size",
+                    help="每批数据单独提交事务，批越小锁持有时间越短，失败时只回滚当前批"
+                )
+                
+                import_engine = st.radio(
+                    "导入方式",
+                    ["批量插入", "LOAD DATA 批量加载"],
+                    horizontal=True,
+                    key="import_engine",
+                    help="LOAD DATA 使用 MySQL 原生批量加载（需服务器开启 local_infile），总是跳过重复记录；服务器不允许时自动改用批量插入"
+                )
+                
+                # 检查该文件是否有未完成的导入（数据有变化前沿用上次读取的检查点）
+                if preview.get('checkpoint_version') != self.result_cache.data_version:
+                    try:
+                        preview['checkpoint'] = self.get_import_checkpoint(fingerprint)
+                    except Exception as e:
+                        preview['checkpoint'] = None
+                        self.log_message(f"读取导入检查点失败: {e}")
+                    preview['checkpoint_version'] = self.result_cache.data_version
+                checkpoint = preview['checkpoint']
+                
+                restart_import = False
+                resume_from = 0
+                if checkpoint and checkpoint['状态'] == 'running':
+                    st.info(f"ℹ️ 该文件上次导入中断（{checkpoint['更新时间']}），已提交 {checkpoint['已提交行数']} 行，将从第 {checkpoint['已提交行数'] + 1} 行继续")
+                    restart_import = st.checkbox("忽略断点，从头重新导入", key="restart_import")
+                    if not restart_import:
+                        resume_from = checkpoint['已提交行数']
+                elif checkpoint and checkpoint['状态'] == 'completed':
+                    st.warning(f"⚠️ 该文件已于 {checkpoint['更新时间']} 完整导入过（导入 {checkpoint['已导入记录数']} 条），再次导入将从头处理")
+                
                 # 执行导入
                 st.subheader("🚀 执行导入")
                 
@@ -966,10 +3618,29 @@ class LotteryDataExporterStreamlit:
                     if len(missing_columns) > 0:
                         st.error("❌ 存在未匹配的列，无法导入数据")
                     else:
+                        progress_bar = st.progress(0)
+                        status_text = st.empty()
+                        start_time = time.time()
+                        
+                        def update_progress(rows_done):
+                            rate = (rows_done - resume_from) / max(time.time() - start_time, 1e-6)
+                            progress_bar.progress(min(rows_done / data_rows, 1.0) if data_rows else 1.0)
+                            status_text.text(f"已处理 {rows_done}/{data_rows} 行，{rate:,.0f} 行/秒")
+                        
+                        import_source = self.read_import_source(uploaded_file, is_xlsx, import_chunk_size)
+                        
                         with st.spinner("正在导入数据到数据库..."):
                             success, message = self.import_to_database(
-                                df, skip_duplicates, matched_columns
+                                import_source, skip_duplicates, matched_columns, update_progress,
+                                engine='load_data' if import_engine == "LOAD DATA 批量加载" else 'executemany',
+                                chunk_size=import_chunk_size,
+                                fingerprint=fingerprint,
+                                file_name=uploaded_file.name,
+                                resume=not restart_import
                             )
+                        progress_bar.empty()
+                        # 检查点已更新，下次运行重新读取
+                        preview.pop('checkpoint_version', None)
                         
                         if success:
                             st.success(f"✅ {message}")
@@ -984,6 +3655,19 @@ class LotteryDataExporterStreamlit:
                             st.error(f"❌ {message}")
                             self.log_message(f"数据导入失败: {message}")
                 
+                if st.button("🕒 后台导入（可继续其他操作）", use_container_width=True, key="import_job_btn"):
+                    if len(missing_columns) > 0:
+                        st.error("❌ 存在未匹配的列，无法导入数据")
+                    else:
+                        self.submit_import_job(
+                            uploaded_file, is_xlsx, data_rows, skip_duplicates, matched_columns,
+                            engine='load_data' if import_engine == "LOAD DATA 批量加载" else 'executemany',
+                            chunk_size=import_chunk_size,
+                            fingerprint=fingerprint,
+                            resume=not restart_import
+                        )
+                        preview.pop('checkpoint_version', None)
+                
             except Exception as e:
                 st.error(f"❌ 读取Excel文件时发生错误: {str(e)}")
                 self.log_message(f"Excel文件读取失败: {str(e)}")
@@ -1028,6 +3712,191 @@ class LotteryDataExporterStreamlit:
                 file_name="兑奖明细导入模板.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
+        
+        self.setup_schema_upgrade_ui()
+        self.setup_duplicate_cleanup_ui()
+        self.setup_partition_migration_ui()
+    
+    def setup_duplicate_cleanup_ui(self):
+        """库内重复数据统计与清理"""
+        with st.expander("🧹 库内重复数据清理"):
+            st.caption(
+                "按去重哈希分组，保留每组 id 最大的一条；在后台任务中分小批删除，按天汇总表随每批同步扣减，可在使用中执行"
+            )
+            col1, col2 = st.columns(2)
+            with col1:
+                if st.button("🔎 统计重复数据", use_container_width=True, key="dedup_dry_run"):
+                    self.submit_duplicate_cleanup_job(dry_run=True)
+            with col2:
+                if st.button("🧹 清理重复数据", use_container_width=True, key="dedup_run"):
+                    self.submit_duplicate_cleanup_job()
+    
+    def submit_duplicate_cleanup_job(self, dry_run=False):
+        """把重复数据的统计或清理提交为后台任务（与导入排在同一队列，不会同时运行）"""
+        token = CancelToken(self.kill_query)
+        worker = BackgroundWorkerApp(cancel_token=token)
+        title = "统计库内重复数据" if dry_run else "清理库内重复数据"
+        
+        def run(job_id, report):
+            worker.bind_report(report)
+            with worker.get_connection() as connection:
+                count = worker.clean_duplicate_data(connection.cursor(), dry_run=dry_run)
+            return {'message': f"共有 {count} 行重复数据待清理" if dry_run else f"已清理 {count} 行重复数据"}
+        
+        try:
+            job_id = self.jobs.submit('dedup', title, st.session_state.username, run, cancel_token=token)
+            st.success(f"✅ 已提交{title}任务 {job_id}，可在「任务」标签页查看进度和结果")
+            self.log_message(f"提交{title}任务 {job_id}")
+        except Exception as e:
+            st.error(f"❌ 提交后台任务失败: {str(e)}")
+            self.log_message(f"提交{title}任务失败: {str(e)}")
+    
+    def submit_export_job(self, filename, export_format="CSV", encoding="utf-8"):
+        """把当前查询条件的流式导出提交为后台任务"""
+        conditions = dict(st.session_state.preview_conditions)
+        total = st.session_state.preview_total
+        extension, mime = EXPORT_FILE_TYPES[export_format]
+        token = CancelToken(self.kill_query)
+        worker = BackgroundWorkerApp(cancel_token=token)
+        
+        def run(job_id, report):
+            worker.bind_report(report)
+            path = self.jobs.artifact_path(job_id, f".{extension}")
+            
+            def update_progress(row_count):
+                report(row_count / total if total else None, f"已写入 {row_count}/{total} 条记录")
+            
+            try:
+                row_count = worker.write_query_file(conditions, path, export_format, encoding, update_progress)
+            except Exception as e:
+                # 失败或取消时删除写了一半的文件
+                if os.path.exists(path):
+                    os.remove(path)
+                raise RuntimeError(self.query_error_message(e, str(e))) from e
+            return {
+                'message': f"已导出 {row_count} 条记录",
+                'artifact': {'path': path, 'file_name': f"{filename}.{extension}", 'mime': mime, 'rows': row_count},
+            }
+        
+        try:
+            job_id = self.jobs.submit(
+                'export', f"导出{export_format}: {filename}", st.session_state.username, run, cancel_token=token
+            )
+            st.success(f"✅ 已提交后台导出任务 {job_id}，可在「任务」标签页查看进度和下载")
+            self.log_message(f"提交后台导出任务 {job_id}: {filename}.{extension}")
+        except Exception as e:
+            st.error(f"❌ 提交后台任务失败: {str(e)}")
+            self.log_message(f"提交后台导出任务失败: {str(e)}")
+    
+    def submit_import_job(self, uploaded_file, is_xlsx, data_rows, skip_duplicates, column_mapping, engine='executemany',
+                          chunk_size=None, fingerprint=None, resume=True):
+        """把上传文件的导入提交为后台任务：上传内容先写入任务目录的临时文件，任务中从文件读取，结束后删除"""
+        file_name = uploaded_file.name
+        token = CancelToken(self.kill_query)
+        worker = BackgroundWorkerApp(cancel_token=token)
+        try:
+            spool_path = self.spool_upload(uploaded_file)
+        except OSError as e:
+            st.error(f"❌ 保存上传文件失败: {str(e)}")
+            self.log_message(f"保存上传文件失败: {str(e)}")
+            return
+        
+        def run(job_id, report):
+            worker.bind_report(report)
+            
+            def update_progress(rows_done):
+                report(rows_done / data_rows if data_rows else None, f"已处理 {rows_done}/{data_rows} 行")
+                # 每批提交后检查取消，已提交的批次记在检查点中，重新导入同一文件时断点续传
+                token.check()
+            
+            with open(spool_path, 'rb') as f:
+                success, message = worker.import_to_database(
+                    worker.read_import_source(f, is_xlsx, chunk_size), skip_duplicates, column_mapping, update_progress,
+                    engine=engine, chunk_size=chunk_size, fingerprint=fingerprint, file_name=file_name, resume=resume
+                )
+            if not success:
+                raise RuntimeError(message)
+            return {'message': message}
+        
+        def remove_spool():
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
+        
+        try:
+            job_id = self.jobs.submit(
+                'import', f"导入: {file_name}", st.session_state.username, run, cancel_token=token, cleanup=remove_spool
+            )
+            st.success(f"✅ 已提交后台导入任务 {job_id}，可在「任务」标签页查看进度")
+            self.log_message(f"提交后台导入任务 {job_id}: {file_name}")
+        except Exception as e:
+            remove_spool()
+            st.error(f"❌ 提交后台任务失败: {str(e)}")
+            self.log_message(f"提交后台导入任务失败: {str(e)}")
+    
+    def spool_upload(self, uploaded_file):
+        """把上传文件分块复制到任务目录的临时文件（不在内存中再保留一份副本），返回文件路径"""
+        fd, path = self.jobs.create_temp_file(os.path.splitext(uploaded_file.name)[1])
+        try:
+            uploaded_file.seek(0)
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(uploaded_file, f, 1024 * 1024)
+        except Exception:
+            os.remove(path)
+            raise
+        return path
+    
+    def setup_jobs_ui(self):
+        """设置后台任务界面"""
+        st.header("🕒 后台任务")
+        
+        job_stats = self.jobs.stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("运行中", f"{job_stats['running']} / {job_stats['workers']}")
+        col2.metric("排队中", job_stats['queued'])
+        col3.metric("已结束", job_stats['finished'])
+        with col4:
+            if st.button("🔄 刷新", use_container_width=True, key="refresh_jobs"):
+                st.rerun()
+        
+        # 预览查询在筛选页等待和取消，这里只列出导入导出任务
+        jobs = [job for job in self.jobs.list_jobs(owner=st.session_state.username) if not job.get('interactive')]
+        if not jobs:
+            st.info("ℹ️ 暂无后台任务，可在「数据导出」「数据导入」中提交")
+            return
+        
+        for job in jobs:
+            st.markdown("---")
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.write(f"**{job['title']}**  `{job['id']}`")
+                st.caption(
+                    f"提交 {job['created_at']}"
+                    + (f"，开始 {job['started_at']}" if job['started_at'] else "")
+                    + (f"，结束 {job['finished_at']}" if job['finished_at'] else "")
+                )
+                if job['status'] in ('queued', 'running'):
+                    st.progress(job['progress'], text=job['message'])
+                elif job['status'] == 'failed':
+                    st.error(job['message'])
+                else:
+                    st.write(job['message'])
+            with col2:
+                st.write(JOB_STATUS_LABELS.get(job['status'], job['status']))
+                if job['status'] in ('queued', 'running'):
+                    if st.button("⏹️ 取消", use_container_width=True, key=f"job_cancel_{job['id']}"):
+                        if self.jobs.cancel(job['id']):
+                            self.log_message(f"已取消后台任务 {job['id']}")
+                        st.rerun()
+                artifact = job.get('artifact')
+                if artifact and os.path.exists(artifact['path']):
+                    st.download_button(
+                        label="📥 下载",
+                        data=deferred_file_data(artifact['path']),
+                        file_name=artifact['file_name'],
+                        mime=artifact['mime'],
+                        use_container_width=True,
+                        key=f"job_download_{job['id']}"
+                    )
     
     def setup_log_ui(self):
         """设置操作日志界面"""
@@ -1042,6 +3911,32 @@ class LotteryDataExporterStreamlit:
                 st.session_state.log_messages.clear()
                 st.rerun()
         
+        # 查询缓存统计
+        cache_stats = self.result_cache.stats()
+        lookups = cache_stats['hits'] + cache_stats['misses']
+        hit_rate = cache_stats['hits'] / lookups * 100 if lookups else 0
+        st.write("**🗄️ 查询缓存:**")
+        cache_col1, cache_col2, cache_col3, cache_col4 = st.columns(4)
+        cache_col1.metric("命中", cache_stats['hits'])
+        cache_col2.metric("未命中", cache_stats['misses'])
+        cache_col3.metric("命中率", f"{hit_rate:.1f}%")
+        cache_col4.metric("缓存条目", cache_stats['entries'])
+        st.caption(
+            f"占用 {cache_stats['bytes'] / 1024 / 1024:.1f} / {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB，"
+            f"淘汰 {cache_stats['evictions']} 次，导入失效 {cache_stats['invalidations']} 次，数据版本 {cache_stats['data_version']}。"
+            f"只有本程序的导入会使缓存失效，其他进程写入的数据在缓存过期（{self.cache_config['ttl']} 秒）后才能查到"
+        )
+        
+        # 最近一次完整查询结果的内存占用
+        memory_report = st.session_state.preview_memory_report
+        if memory_report is not None:
+            before_total = memory_report['原字节'].sum()
+            after_total = memory_report['压缩后字节'].sum()
+            with st.expander(
+                f"💾 查询结果内存占用: {before_total / 1024 / 1024:.1f} MB → {after_total / 1024 / 1024:.1f} MB"
+            ):
+                st.dataframe(memory_report, use_container_width=True, hide_index=True)
+        
         # 显示日志
         log_container = st.container()
         with log_container:
@@ -1051,53 +3946,322 @@ class LotteryDataExporterStreamlit:
             else:
                 st.info("暂无日志记录")
     
-    def import_to_database(self, df, skip_duplicates, column_mapping):
-        """将数据导入到数据库 - 使用批量插入优化性能"""
+    def iter_excel_chunks(self, uploaded_file, chunk_size=None):
+        """以只读模式逐行读取xlsx（跳过前4行标题，第5行为表头），按块返回DataFrame"""
+        chunk_size = chunk_size or self.import_chunk_size
+        uploaded_file.seek(0)
+        workbook = load_workbook(uploaded_file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(min_row=5, values_only=True)
+            header = next(rows, None) or ()
+            columns = [str(value) if value is not None else f"Unnamed: {i}" for i, value in enumerate(header)]
+            width = len(columns)
+            
+            chunk = []
+            has_rows = False
+            for row in rows:
+                # 与 read_excel 一致跳过空行
+                if all(value is None for value in row):
+                    continue
+                chunk.append(tuple(row[:width]) + (None,) * (width - len(row)))
+                if len(chunk) >= chunk_size:
+                    has_rows = True
+                    yield pd.DataFrame(chunk, columns=columns)
+                    chunk = []
+            
+            if chunk or not has_rows:
+                yield pd.DataFrame(chunk, columns=columns)
+        finally:
+            workbook.close()
+    
+    def read_import_source(self, uploaded_file, is_xlsx, chunk_size=None):
+        """导入的数据来源：xlsx 按块流式读取；xls 没有流式读取方式，整体读取为一个DataFrame"""
+        if is_xlsx:
+            return self.iter_excel_chunks(uploaded_file, chunk_size)
+        uploaded_file.seek(0)
+        return pd.read_excel(uploaded_file, skiprows=4)
+    
+    def count_excel_data_rows(self, uploaded_file):
+        """根据工作表维度估算数据行数（不读取数据）"""
+        uploaded_file.seek(0)
+        workbook = load_workbook(uploaded_file, read_only=True)
+        try:
+            max_row = workbook.active.max_row or 0
+        finally:
+            workbook.close()
+        return max(max_row - 5, 0)
+    
+    def prepare_import_chunk(self, df, column_mapping, partitioned=False):
+        """把一块上传数据整理为数据库列顺序并清洗"""
+        # 重命名列以匹配数据库
+        df_renamed = df.rename(columns=column_mapping)
+        
+        # 确保包含所有需要的列
+        for column in self.db_columns:
+            if column not in df_renamed.columns:
+                df_renamed[column] = None  # 添加缺失的列为空值
+        
+        # 只保留需要的列（按数据库列顺序）
+        df_filtered = df_renamed[self.db_columns].copy()
+        
+        # 数据清洗
+        df_cleaned = self.clean_import_data(df_filtered)
+        
+        # 分区表的兑奖时间不能为空，与迁移时一致归入哨兵日期（超出 pandas 时间范围，按 object 列保存）
+        if partitioned:
+            redeem_times = df_cleaned['兑奖时间']
+            sentinel = datetime.strptime(self.rollup_null_date, '%Y-%m-%d')
+            df_cleaned['兑奖时间'] = redeem_times.astype(object).where(redeem_times.notna(), sentinel)
+        
+        # 计算去重哈希（与库中 ticket_hash 列规则一致）
+        df_cleaned['ticket_hash'] = compute_ticket_hashes(df_cleaned)
+        return df_cleaned
+    
+    def split_import_chunks(self, chunks, chunk_size, skip_rows=0, on_skipped=None):
+        """把DataFrame块再按提交批大小切分，跳过前 skip_rows 行（断点续传），跳过的部分交给 on_skipped"""
+        for chunk in chunks:
+            if skip_rows >= len(chunk):
+                skip_rows -= len(chunk)
+                if on_skipped:
+                    on_skipped(chunk)
+                continue
+            if skip_rows:
+                if on_skipped:
+                    on_skipped(chunk.iloc[:skip_rows])
+                chunk = chunk.iloc[skip_rows:]
+                skip_rows = 0
+            for start in range(0, len(chunk), chunk_size):
+                yield chunk.iloc[start:start + chunk_size]
+    
+    def load_import_preview(self, uploaded_file, is_xlsx):
+        """读取上传文件的前10行、数据行数和指纹；按上传文件缓存在本会话，页面重新运行时不再重复读取整个文件"""
+        upload_key = (uploaded_file.file_id, uploaded_file.size)
+        preview = st.session_state.import_preview
+        if preview is not None and preview['key'] == upload_key:
+            return preview
+        
+        with st.spinner("正在读取Excel文件（跳过前4行标题）..."):
+            if is_xlsx:
+                df = next(self.iter_excel_chunks(uploaded_file, 10))
+                data_rows = self.count_excel_data_rows(uploaded_file)
+            else:
+                # xls 只能整体读取，统计行数后只保留前10行，导入时再从文件读取
+                df = pd.read_excel(uploaded_file, skiprows=4)
+                data_rows = len(df)
+                df = df.head(10)
+            st.session_state.import_data = None
+        preview = {
+            'key': upload_key,
+            'df': df,
+            'data_rows': data_rows,
+            'fingerprint': self.file_fingerprint(uploaded_file),
+        }
+        st.session_state.import_preview = preview
+        return preview
+    
+    def file_fingerprint(self, uploaded_file):
+        """上传文件内容的SHA-256指纹（分块读取计算，不在内存中再复制一份整个文件）"""
+        digest = hashlib.sha256()
+        uploaded_file.seek(0)
+        for block in iter(lambda: uploaded_file.read(1024 * 1024), b''):
+            digest.update(block)
+        uploaded_file.seek(0)
+        return digest.hexdigest()
+    
+    def get_import_checkpoint(self, fingerprint):
+        """读取文件的导入检查点，没有记录时返回 None"""
+        with self.get_connection() as connection:
+            cursor = connection.cursor(pymysql.cursors.DictCursor)
+            cursor.execute(f"SHOW TABLES LIKE '{self.checkpoint_table}'")
+            if not cursor.fetchone():
+                return None
+            cursor.execute(
+                f"SELECT `已提交行数`, `已导入记录数`, `状态`, `更新时间` FROM {self.checkpoint_table} WHERE `文件指纹` = %s",
+                (fingerprint,)
+            )
+            return cursor.fetchone()
+    
+    def save_import_checkpoint(self, cursor, fingerprint, file_name, committed_rows, imported_rows, status):
+        """写入检查点（与该批数据在同一事务中提交）"""
+        cursor.execute(f"""
+            INSERT INTO {self.checkpoint_table} (`文件指纹`, `文件名`, `已提交行数`, `已导入记录数`, `状态`)
+            VALUES (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                `文件名` = VALUES(`文件名`),
+                `已提交行数` = VALUES(`已提交行数`),
+                `已导入记录数` = VALUES(`已导入记录数`),
+                `状态` = VALUES(`状态`)
+        """, (fingerprint, file_name, committed_rows, imported_rows, status))
+    
+    def insert_import_chunk(self, cursor, df, skip_duplicates, use_load_data):
+        """插入一批数据，返回 (插入行数, 是否继续使用 LOAD DATA)"""
+        if use_load_data:
+            try:
+                return self.load_data_insert(cursor, df), True
+            except pymysql.err.MySQLError as e:
+                if not e.args or e.args[0] not in LOCAL_INFILE_DISABLED_ERRORS:
+                    raise
+                # 服务器不允许 LOCAL INFILE，本次导入剩余部分改用批量插入
+                self.log_message(f"服务器不允许 LOAD DATA LOCAL INFILE，改用批量插入: {e}")
+        
+        if skip_duplicates:
+            # 使用 INSERT IGNORE 跳过重复记录
+            return self.batch_insert_with_duplicate_check(cursor, df), False
+        # 直接批量插入
+        return self.batch_insert(cursor, df), False
+    
+    def import_to_database(self, data, skip_duplicates, column_mapping, progress_callback=None, engine='executemany',
+                           chunk_size=None, fingerprint=None, file_name=None, resume=True):
+        """将数据导入到数据库 - 按批清洗、插入并提交；传入 fingerprint 时每批记录检查点，重试同一文件时断点续传"""
+        chunk_size = chunk_size or self.import_chunk_size
+        start_time = time.time()
+        total_rows = 0
+        imported_count = 0
+        in_file_duplicates = 0
+        seen_hashes = set()
+        chunk_latencies = []
+        resume_from = 0
+        previous_imported = 0
+        
         try:
-            if not self.test_db_connection():
-                return False, "数据库连接失败"
-            
             # 首先确保表结构完整（包含唯一键约束）
             if not self.check_and_create_table():
+                if not self.test_db_connection():
+                    return False, "数据库连接失败"
                 return False, "数据库表结构检查失败"
+            blocking = self.schema_upgrades_blocking_import()
+            if blocking:
+                return False, (
+                    f"明细表结构需要先升级（{'；'.join(SCHEMA_UPGRADE_STEPS[step] for step in blocking)}），"
+                    "请在「数据导入」页执行表结构升级后再导入"
+                )
             
-            # 重命名列以匹配数据库
-            df_renamed = df.rename(columns=column_mapping)
-            
-            # 确保包含所有需要的列
-            for column in self.db_columns:
-                if column not in df_renamed.columns:
-                    df_renamed[column] = None  # 添加缺失的列为空值
-            
-            # 只保留需要的列（按数据库列顺序）
-            df_filtered = df_renamed[self.db_columns].copy()
-            
-            # 数据清洗
-            df_filtered = self.clean_import_data(df_filtered)
-            
-            # 创建数据库连接
-            connection = pymysql.connect(**self.db_config)
-            cursor = connection.cursor()
-            
-            # 批量插入数据
-            imported_count = 0
-            
-            if skip_duplicates:
-                # 使用 INSERT IGNORE 跳过重复记录
-                imported_count = self.batch_insert_with_duplicate_check(cursor, df_filtered)
-            else:
-                # 直接批量插入
-                imported_count = self.batch_insert(cursor, df_filtered)
-            
-            connection.commit()
-            connection.close()
+            chunks = [data] if isinstance(data, pd.DataFrame) else data
+            use_load_data = engine == 'load_data'
             
-            message = f"导入完成！成功导入 {imported_count} 条记录，跳过 {len(df_filtered) - imported_count} 条重复记录"
+            # 同一文件上次导入中断时从检查点继续
+            if fingerprint and resume:
+                checkpoint = self.get_import_checkpoint(fingerprint)
+                if checkpoint and checkpoint['状态'] == 'running':
+                    resume_from = checkpoint['已提交行数']
+                    previous_imported = checkpoint['已导入记录数']
+                    self.log_message(f"检测到导入检查点，跳过已提交的 {resume_from} 行继续导入")
             
-            return True, message
+            # 从连接池借出连接
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                
+                # 只有已经分区的表才把空的兑奖时间存为哨兵日期（开启分区但尚未迁移时仍按原表结构导入）
+                partitioned = self.partition_config['enabled'] and bool(self.get_month_partitions(cursor))
+                
+                # 断点续传时用已提交部分的哈希重建文件内去重集合，续传部分与之重复的记录仍算文件内重复
+                def remember_skipped(skipped):
+                    prepared = self.prepare_import_chunk(skipped, column_mapping, partitioned)
+                    seen_hashes.update(prepared['ticket_hash'].dropna())
+                on_skipped = remember_skipped if skip_duplicates and resume_from else None
+                
+                for chunk in self.split_import_chunks(chunks, chunk_size, resume_from, on_skipped):
+                    df_filtered = self.prepare_import_chunk(chunk, column_mapping, partitioned)
+                    if df_filtered.empty:
+                        continue
+                    chunk_rows = len(df_filtered)
+                    
+                    # 文件内重复在发送到数据库之前去掉
+                    if skip_duplicates:
+                        df_filtered, duplicates = self.drop_in_file_duplicates(df_filtered, seen_hashes)
+                        in_file_duplicates += duplicates
+                        if df_filtered.empty:
+                            total_rows += chunk_rows
+                            if progress_callback:
+                                progress_callback(resume_from + total_rows)
+                            continue
+                    
+                    chunk_start = time.time()
+                    
+                    # 持有导入锁直到提交：其他导入的批次不会落在本批的 id 区间内
+                    with self.import_lock(cursor):
+                        if partitioned:
+                            self.ensure_partitions_for_chunk(cursor, df_filtered)
+                        
+                        # 记下本批插入前的最大 id，用于增量更新汇总表
+                        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {self.table_name}")
+                        before_id = cursor.fetchone()[0]
+                        
+                        inserted, use_load_data = self.insert_import_chunk(
+                            cursor, df_filtered, skip_duplicates, use_load_data
+                        )
+                        
+                        # 同一事务内累加到按天汇总表、记录检查点，然后提交本批
+                        self.update_daily_rollup(cursor, before_id)
+                        if fingerprint:
+                            self.save_import_checkpoint(
+                                cursor, fingerprint, file_name,
+                                resume_from + total_rows + chunk_rows,
+                                previous_imported + imported_count + inserted,
+                                'running'
+                            )
+                        connection.commit()
+                    
+                    latency = time.time() - chunk_start
+                    chunk_latencies.append(latency)
+                    imported_count += inserted
+                    total_rows += chunk_rows
+                    self.log_message(
+                        f"第 {len(chunk_latencies)} 批已提交: {chunk_rows} 行，"
+                        f"文件内重复 {chunk_rows - len(df_filtered)} 行，插入 {inserted} 行，"
+                        f"耗时 {latency:.2f} 秒（{len(df_filtered) / max(latency, 1e-6):,.0f} 行/秒）"
+                    )
+                    if progress_callback:
+                        progress_callback(resume_from + total_rows)
+                
+                if fingerprint:
+                    self.save_import_checkpoint(
+                        cursor, fingerprint, file_name,
+                        resume_from + total_rows, previous_imported + imported_count, 'completed'
+                    )
+                    connection.commit()
             
         except Exception as e:
-            return False, f"导入过程中发生错误: {str(e)}"
+            if imported_count:
+                self.result_cache.invalidate()
+            message = f"导入过程中发生错误: {str(e)}（此前已提交 {len(chunk_latencies)} 批 {total_rows} 行，成功导入 {imported_count} 条）"
+            if fingerprint and (resume_from or total_rows):
+                message += "，重新导入同一文件将从断点继续"
+            return False, message
+        
+        # 数据已变化，使共享查询缓存失效
+        self.result_cache.invalidate()
+        
+        # 新数据由后台任务追加到本地列式副本
+        if imported_count and self.replica is not None:
+            self.request_replica_refresh()
+        
+        elapsed = time.time() - start_time
+        if chunk_latencies:
+            self.log_message(
+                f"导入处理 {total_rows} 行，共 {len(chunk_latencies)} 批，用时 {elapsed:.1f} 秒"
+                f"（{total_rows / max(elapsed, 1e-6):,.0f} 行/秒），"
+                f"每批耗时 平均 {sum(chunk_latencies) / len(chunk_latencies):.2f} 秒 / 最长 {max(chunk_latencies):.2f} 秒"
+            )
+        existing_duplicates = total_rows - in_file_duplicates - imported_count
+        message = (
+            f"导入完成！成功导入 {imported_count} 条记录，跳过 {total_rows - imported_count} 条重复记录"
+            f"（文件内重复 {in_file_duplicates} 条，库中已存在 {existing_duplicates} 条）"
+        )
+        if resume_from:
+            message += f"（从第 {resume_from + 1} 行断点继续，此前已导入 {previous_imported} 条）"
+        
+        return True, message
+    
+    def drop_in_file_duplicates(self, df, seen_hashes):
+        """按去重哈希去掉本批内及之前批次已出现过的记录，返回 (去重后数据, 重复行数)；哈希为空的记录不参与去重"""
+        hashes = df['ticket_hash']
+        seen_before = np.fromiter((value in seen_hashes for value in hashes), dtype=bool, count=len(hashes))
+        duplicated = ((hashes.duplicated() | seen_before) & hashes.notna()).to_numpy()
+        
+        unique_df = df[~duplicated]
+        seen_hashes.update(unique_df['ticket_hash'].dropna())
+        return unique_df, int(duplicated.sum())
     
     def clean_import_data(self, df):
         """清洗导入数据"""
@@ -1112,19 +4276,33 @@ class LotteryDataExporterStreamlit:
         date_columns = ['兑奖时间', '售出时间']
         for col in date_columns:
             if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
+                # 先统一舍入到秒：LOAD DATA 写文件时按秒格式化、executemany 由 MySQL 舍入，两种方式存入的值和哈希一致
+                df[col] = round_to_seconds(pd.to_datetime(df[col], errors='coerce'))
         
         return df
     
+    def load_data_insert(self, cursor, df):
+        """写临时TSV文件后用 LOAD DATA LOCAL INFILE IGNORE 批量加载，返回插入行数"""
+        fd, path = tempfile.mkstemp(prefix="lottery_import_", suffix=".tsv")
+        os.close(fd)
+        try:
+            # 二进制哈希不写入文本文件，由服务端按相同规则计算
+            write_load_data_file(df[self.db_columns], path)
+            return cursor.execute(build_load_data_sql(
+                self.table_name, self.db_columns, path, set_clause=f"ticket_hash = {ticket_hash_sql()}"
+            ))
+        finally:
+            os.remove(path)
+    
     def batch_insert(self, cursor, df):
         """批量插入数据"""
         try:
             # 准备插入语句
-            placeholders = ', '.join(['%s'] * len(self.db_columns))
-            insert_sql = f"INSERT INTO {self.table_name} ({', '.join(self.db_columns)}) VALUES ({placeholders})"
+            placeholders = ', '.join(['%s'] * len(self.insert_columns))
+            insert_sql = f"INSERT INTO {self.table_name} ({', '.join(self.insert_columns)}) VALUES ({placeholders})"
             
             # 转换为元组列表
-            data_tuples = [tuple(row) for row in df.itertuples(index=False)]
+            data_tuples = [tuple(row) for row in df[self.insert_columns].itertuples(index=False)]
             
             # 批量插入
             cursor.executemany(insert_sql, data_tuples)
@@ -1138,11 +4316,11 @@ class LotteryDataExporterStreamlit:
         """批量插入并检查重复数据 - 改进版本"""
         try:
             # 方法1: 使用 INSERT IGNORE（需要唯一键约束）
-            placeholders = ', '.join(['%s'] * len(self.db_columns))
-            insert_sql = f"INSERT IGNORE INTO {self.table_name} ({', '.join(self.db_columns)}) VALUES ({placeholders})"
+            placeholders = ', '.join(['%s'] * len(self.insert_columns))
+            insert_sql = f"INSERT IGNORE INTO {self.table_name} ({', '.join(self.insert_columns)}) VALUES ({placeholders})"
             
             # 转换为元组列表
-            data_tuples = [tuple(row) for row in df.itertuples(index=False)]
+            data_tuples = [tuple(row) for row in df[self.insert_columns].itertuples(index=False)]
             
             # 批量插入
             cursor.executemany(insert_sql, data_tuples)
@@ -1153,60 +4331,170 @@ class LotteryDataExporterStreamlit:
             return inserted_count
             
         except Exception as e:
-            # 如果 INSERT IGNORE 失败，回退到逐条插入并检查
-            self.log_message(f"批量插入失败，回退到逐条插入: {str(e)}")
-            return self.insert_one_by_one_with_check(cursor, df)
+            # 如果 INSERT IGNORE 失败，先回滚本批已写入的部分，再回退到基于暂存表的集合去重
+            self.log_message(f"批量插入失败，回退到暂存表集合去重: {str(e)}")
+            cursor.connection.rollback()
+            return self.insert_via_staging_table(cursor, df)
+    
+    @contextmanager
+    def strict_sql_mode(self, cursor):
+        """在当前会话临时开启严格模式（STRICT_ALL_TABLES），退出时恢复原来的 sql_mode"""
+        cursor.execute("SELECT @@SESSION.sql_mode")
+        original_mode = cursor.fetchone()[0]
+        cursor.execute("SET SESSION sql_mode = CONCAT_WS(',', NULLIF(@@SESSION.sql_mode, ''), 'STRICT_ALL_TABLES')")
+        try:
+            yield
+        finally:
+            cursor.execute("SET SESSION sql_mode = %s", (original_mode,))
     
-    def insert_one_by_one_with_check(self, cursor, df):
-        """逐条插入数据并检查重复"""
-        inserted_count = 0
+    def insert_via_staging_table(self, cursor, df):
+        """整批写入临时暂存表，再用一条 INSERT ... SELECT ... LEFT JOIN 按去重哈希只插入库中不存在的记录；
+        整批写入暂存表失败时逐条写入，跳过并报告写不进去的行"""
+        staging_table = "tmp_import_staging"
+        column_list = ', '.join(f"`{column}`" for column in self.db_columns)
+        staging_hash = ticket_hash_sql('s')
         
-        for _, row in df.iterrows():
-            try:
-                # 构建检查重复的查询
-                check_duplicate_sql = f"""
-                SELECT COUNT(*) FROM {self.table_name} 
-                WHERE `彩票流水号` = %s 
-                AND `方案代码` = %s 
-                AND `兑奖时间` = %s 
-                AND `兑奖金额` = %s
-                """
-                
-                # 获取关键字段值
-                ticket_serial = row.get('彩票流水号', '')
-                play_code = row.get('方案代码', '')
-                redeem_time = row.get('兑奖时间')
-                prize_amount = row.get('兑奖金额', 0)
-                
-                # 检查是否存在重复记录
-                cursor.execute(check_duplicate_sql, (ticket_serial, play_code, redeem_time, prize_amount))
-                duplicate_count = cursor.fetchone()[0]
-                
-                if duplicate_count == 0:
-                    # 没有重复，插入数据
-                    placeholders = ', '.join(['%s'] * len(self.db_columns))
-                    insert_sql = f"INSERT INTO {self.table_name} ({', '.join(self.db_columns)}) VALUES ({placeholders})"
-                    
-                    data_tuple = tuple(row[col] for col in self.db_columns)
-                    cursor.execute(insert_sql, data_tuple)
-                    inserted_count += 1
-                else:
-                    self.log_message(f"跳过重复记录: 流水号={ticket_serial}, 方案代码={play_code}")
-                    
-            except Exception as e:
-                self.log_message(f"插入单条记录失败: {e}")
-                continue
+        # 批内重复直接在内存中去掉（临时表在同一语句中不能引用两次）
+        unique_df = df[~(df['ticket_hash'].duplicated() & df['ticket_hash'].notna())]
+        in_batch_duplicates = len(df) - len(unique_df)
+        
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging_table}")
+        cursor.execute(f"CREATE TEMPORARY TABLE {staging_table} AS SELECT {column_list} FROM {self.table_name} WHERE 1=0")
+        try:
+            # 暂存表没有唯一键，写入不用 IGNORE，并临时开启严格模式：超长文本、非法日期、超范围金额直接报错，
+            # 不会被截断或改成零值后进入明细表（会话原来的 sql_mode 随后恢复，不影响池中连接）
+            placeholders = ', '.join(['%s'] * len(self.db_columns))
+            staging_sql = f"INSERT INTO {staging_table} ({column_list}) VALUES ({placeholders})"
+            data_tuples = [tuple(row) for row in unique_df[self.db_columns].itertuples(index=False)]
+            with self.strict_sql_mode(cursor):
+                try:
+                    cursor.executemany(staging_sql, data_tuples)
+                    staged_count = cursor.rowcount
+                except pymysql.err.MySQLError as e:
+                    self.log_message(f"整批写入暂存表失败，改为逐条写入: {e}")
+                    cursor.execute(f"DELETE FROM {staging_table}")
+                    staged_count = 0
+                    for data_tuple in data_tuples:
+                        try:
+                            staged_count += cursor.execute(staging_sql, data_tuple)
+                        except pymysql.err.MySQLError as row_error:
+                            self.log_message(
+                                f"跳过无法写入的记录: 流水号={data_tuple[self.db_columns.index('彩票流水号')]}，{row_error}"
+                            )
+            failed_rows = len(data_tuples) - staged_count
+            
+            # 暂存表中的值已通过严格校验，这里的 IGNORE 只用于跳过与库中唯一键重复的记录
+            select_list = ', '.join(f"s.`{column}`" for column in self.db_columns)
+            cursor.execute(f"""
+                INSERT IGNORE INTO {self.table_name} ({column_list}, ticket_hash)
+                SELECT {select_list}, {staging_hash} FROM {staging_table} s
+                LEFT JOIN {self.table_name} d ON d.ticket_hash = {staging_hash}
+                WHERE d.id IS NULL
+            """)
+            inserted_count = cursor.rowcount
+        finally:
+            cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging_table}")
         
-        self.log_message(f"逐条插入完成: 成功插入 {inserted_count} 条，跳过 {len(df) - inserted_count} 条重复记录")
+        existing_duplicates = staged_count - inserted_count
+        self.log_message(
+            f"暂存表集合去重完成: 共 {len(df)} 条，成功插入 {inserted_count} 条，"
+            f"跳过库中已存在 {existing_duplicates} 条、批内重复 {in_batch_duplicates} 条、无法写入 {failed_rows} 条"
+        )
         return inserted_count
 
+    def site_relation_sql(self):
+        """站点关系表达式（<=> 使两边都为空时也算一致）"""
+        sale_site_col = self.column_mapping['sale_site']
+        redeem_site_col = self.column_mapping['redeem_site']
+        return f"CASE WHEN `{sale_site_col}` <=> `{redeem_site_col}` THEN '一致' ELSE '不一致' END"
+    
+    def fetch_site_summary(self, conditions):
+        """在数据库中按兑奖单位和站点关系汇总记录数与金额"""
+        region_col = self.column_mapping['region']
+        prize_amount_col = self.column_mapping['prize_amount']
+        select_columns = (
+            f"`{region_col}` AS `兑奖单位`, {self.site_relation_sql()} AS `站点关系`, "
+            f"COUNT(*) AS `记录数`, SUM(`{prize_amount_col}`) AS `总金额`"
+        )
+        
+        def load():
+            if not self.replica_ready() and self.can_use_rollup(conditions):
+                # 直接读按天汇总表
+                query, params = self.build_rollup_query(
+                    conditions,
+                    "`兑奖单位`, CASE WHEN `站点一致` THEN '一致' ELSE '不一致' END AS `站点关系`, "
+                    "SUM(`记录数`) AS `记录数`, SUM(`总金额`) AS `总金额`"
+                )
+                query += " GROUP BY `兑奖单位`, `站点关系` ORDER BY `兑奖单位`, `站点关系`"
+                summary = self.read_rollup_frame(query, params)
+            else:
+                # 明细汇总，副本可用时在本地执行
+                query, params = self.build_query(conditions, select_columns)
+                query += " GROUP BY `兑奖单位`, `站点关系` ORDER BY `兑奖单位`, `站点关系`"
+                summary = self.read_frame(query, params)
+            summary['记录数'] = summary['记录数'].astype('int64')
+            summary['总金额'] = summary['总金额'].astype(float).round(2)
+            return merge_blank_labels(summary, ['兑奖单位', '站点关系'])
+        return self.cached_query('site_summary', conditions, load)
+    
+    def fetch_site_detail(self, conditions, analysis_type="全部", limit=None):
+        """读取站点分析明细（列与 build_site_analysis_frame 一致）"""
+        mapping = self.column_mapping
+        select_columns = ", ".join([
+            f"`{mapping['region']}`",
+            f"`{mapping['sale_site']}`",
+            f"`{mapping['redeem_site']}`",
+            f"{self.site_relation_sql()} AS `站点关系`",
+            f"`{mapping['prize_amount']}`",
+            f"`{mapping['play_method']}`",
+            self.redeem_time_sql(),
+            f"`{mapping['sale_time']}`",
+        ])
+        
+        def load():
+            query, params = self.build_query(conditions, select_columns)
+            if analysis_type == "站点一致":
+                query += f" AND `{mapping['sale_site']}` <=> `{mapping['redeem_site']}`"
+            elif analysis_type == "站点不一致":
+                query += f" AND NOT (`{mapping['sale_site']}` <=> `{mapping['redeem_site']}`)"
+            # 按 id 排序，限制行数时 MySQL 和列式副本取到同一批明细
+            query += " ORDER BY id"
+            if limit:
+                query += " LIMIT %s"
+                params = params + [limit]
+            return self.read_frame(query, params)
+        return self.cached_query('site_detail', conditions, load, analysis_type, limit)
+    
+    def analyze_site_summary_in_db(self):
+        """数据库汇总模式的站点分析 - 只传输汇总结果"""
+        conditions = self.get_conditions()
+        self.log_message("开始在数据库中汇总站点数据...")
+        
+        with st.spinner("正在汇总站点数据..."):
+            summary = self.fetch_site_summary(conditions)
+        
+        st.session_state.site_summary = summary
+        st.session_state.site_analysis_conditions = conditions
+        st.session_state.site_analysis_data = None
+        
+        self.log_message(f"站点汇总分析完成，共 {int(summary['记录数'].sum())} 条记录，{len(summary)} 个分组")
+        st.success("✅ 站点分析完成！")
+    
     def analyze_site_data(self):
         """分析售出站点与兑奖站点数据"""
         try:
-            if st.session_state.preview_data is None or st.session_state.preview_data.empty:
+            if st.session_state.sql_site_analysis:
+                self.analyze_site_summary_in_db()
+                return
+            
+            if not st.session_state.preview_total:
                 st.warning("⚠️ 请先预览数据再进行站点分析")
                 return
             
+            # 分页预览模式下先加载完整结果
+            if not self.load_full_preview_data():
+                return
+            
             self.log_message("开始分析站点数据...")
             
             # 显示进度
@@ -1216,45 +4504,17 @@ class LotteryDataExporterStreamlit:
             status_text.text("正在处理数据...")
             progress_bar.progress(30)
             
-            # 获取列名映射
-            sale_site_col = self.column_mapping['sale_site']
-            redeem_site_col = self.column_mapping['redeem_site']
-            region_col = self.column_mapping['region']
-            prize_level_col = self.column_mapping['prize_amount']  # 注意这里改为 prize_amount
-            
-            # 创建分析数据副本
-            analysis_data = st.session_state.preview_data.copy()
-            
             status_text.text("分析站点关系...")
             progress_bar.progress(60)
             
-            # 分析站点关系
-            analysis_data['站点关系'] = analysis_data.apply(
-                lambda row: '一致' if str(row[sale_site_col]) == str(row[redeem_site_col]) else '不一致', 
-                axis=1
-            )
-            
-            # 重命名列以便显示
-            analysis_data = analysis_data.rename(columns={
-                region_col: '兑奖单位',
-                sale_site_col: '售出站点',
-                redeem_site_col: '兑奖站点',
-                prize_level_col: '兑奖金额'
-            })
-            
-            # 选择需要显示的列
-            display_columns = ['兑奖单位', '售出站点', '兑奖站点', '站点关系', '兑奖金额']
-            # 添加其他可能需要的列
-            for col in ['方案名称', '兑奖时间', '售出时间']:
-                if col in analysis_data.columns:
-                    display_columns.append(col)
-            
-            analysis_data = analysis_data[display_columns]
+            # 向量化比较售出站点与兑奖站点
+            analysis_data = build_site_analysis_frame(st.session_state.preview_data)
             
             status_text.text("完成分析...")
             progress_bar.progress(90)
             
             st.session_state.site_analysis_data = analysis_data
+            st.session_state.site_summary = None
             
             progress_bar.progress(100)
             status_text.text("分析完成！")
@@ -1267,15 +4527,14 @@ class LotteryDataExporterStreamlit:
             
         except Exception as e:
             error_msg = f"站点分析过程中发生错误: {e}"
-            st.error("站点分析过程中发生错误，请重试")
+            st.error(f"站点分析过程中发生错误：{self.query_error_message(e)}")
             self.log_message(f"站点分析失败: {e}")
     
     def export_analysis_data(self, data, filename):
         """导出分析数据"""
         try:
             buffer = io.BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                data.to_excel(writer, index=False, sheet_name='站点分析数据')
+            write_rows_to_excel(buffer, list(data.columns), dataframe_row_chunks(data), '站点分析数据')
             
             st.download_button(
                 label="📥 点击下载分析数据",
@@ -1295,8 +4554,7 @@ class LotteryDataExporterStreamlit:
         """导出统计报表"""
         try:
             buffer = io.BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                stats_data.to_excel(writer, index=False, sheet_name='统计报表')
+            write_rows_to_excel(buffer, list(stats_data.columns), dataframe_row_chunks(stats_data), '统计报表')
             
             st.download_button(
                 label="📥 点击下载统计报表",
@@ -1315,13 +4573,13 @@ class LotteryDataExporterStreamlit:
     def download_excel(self, filename, include_index=False):
         """下载Excel文件"""
         try:
+            data = st.session_state.preview_data
+            columns = list(data.columns)
+            if include_index:
+                columns = [data.index.name or ''] + columns
+            
             buffer = io.BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                st.session_state.preview_data.to_excel(
-                    writer, 
-                    index=include_index, 
-                    sheet_name='彩票数据'
-                )
+            write_rows_to_excel(buffer, columns, dataframe_row_chunks(data, include_index), '彩票数据')
             
             st.download_button(
                 label="📥 点击下载 Excel 文件",
@@ -1340,7 +4598,8 @@ class LotteryDataExporterStreamlit:
     def download_csv(self, filename, encoding="utf-8"):
         """下载CSV文件"""
         try:
-            csv_data = st.session_state.preview_data.to_csv(index=False, encoding=encoding)
+            # 金额在内存中是 float64，按两位小数写出，与数据库的 DECIMAL(10,2) 一致
+            csv_data = st.session_state.preview_data.to_csv(index=False, encoding=encoding, float_format='%.2f')
             
             st.download_button(
                 label="📥 点击下载 CSV 文件",
@@ -1356,54 +4615,99 @@ class LotteryDataExporterStreamlit:
             st.error(f"导出CSV失败: {e}")
             self.log_message(f"导出CSV失败: {e}")
     
-    def fetch_regions_from_db(self):
-        """从数据库获取兑奖单位列表"""
+    def new_export_temp_file(self, suffix):
+        """创建新的导出临时文件，同时删除本会话上一次生成的文件"""
+        old_file = st.session_state.stream_export_file
+        if old_file and os.path.exists(old_file['path']):
+            try:
+                os.remove(old_file['path'])
+            except OSError:
+                pass
+        st.session_state.stream_export_file = None
+        
+        fd, path = tempfile.mkstemp(prefix="lottery_export_", suffix=suffix)
+        os.close(fd)
+        return path
+    
+    def stream_export_file(self, filename, export_format="CSV", encoding="utf-8"):
+        """流式导出CSV、Excel或Parquet文件"""
+        extension, mime = EXPORT_FILE_TYPES[export_format]
+        
+        path = self.new_export_temp_file(f".{extension}")
+        total = st.session_state.preview_total
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+        
+        def update_progress(row_count):
+            progress_bar.progress(min(row_count / total, 1.0) if total else 1.0)
+            status_text.text(f"已写入 {row_count}/{total} 条记录...")
+        
         try:
-            if not self.test_db_connection():
-                st.error("❌ 数据库未连接")
-                return False
-                
-            connection = pymysql.connect(**self.db_config)
+            start_time = time.time()
+            conditions = st.session_state.preview_conditions
+            row_count = self.write_query_file(conditions, path, export_format, encoding, update_progress)
+            elapsed = time.time() - start_time
             
-            cursor = connection.cursor()
-            region_col = self.column_mapping['region']
-            cursor.execute(f"SELECT DISTINCT {region_col} FROM {self.table_name} WHERE {region_col} IS NOT NULL AND {region_col} != '' ORDER BY {region_col}")
-            results = cursor.fetchall()
+            st.session_state.stream_export_file = {
+                'path': path,
+                'file_name': f"{filename}.{extension}",
+                'mime': mime,
+                'rows': row_count,
+            }
+            status_text.empty()
+            progress_bar.empty()
+            st.success(f"✅ {export_format}文件已生成，共 {row_count} 条记录，用时 {elapsed:.1f} 秒")
+            self.log_message(f"流式导出{export_format}完成: {filename}.{extension}，{row_count} 条记录，用时 {elapsed:.1f} 秒")
             
-            st.session_state.regions_list = [result[0] for result in results]
-            connection.close()
+        except Exception as e:
+            if os.path.exists(path):
+                os.remove(path)
+            status_text.empty()
+            progress_bar.empty()
+            st.error(f"流式导出{export_format}失败: {e}")
+            self.log_message(f"流式导出{export_format}失败: {e}")
+    
+    def fetch_regions_from_db(self, refresh=False):
+        """从数据库获取兑奖单位列表（refresh=True 时跳过缓存重新查询）"""
+        try:
+            # 所有会话共享，导入数据、用户点刷新或缓存过期后才会重新查询
+            st.session_state.regions_list = list(self.cached_query(
+                'regions', {}, self.query_regions, ttl=self.dimension_cache_ttl, refresh=refresh
+            ))
             
             st.session_state.regions_loaded = True
             self.log_message(f"从数据库获取到 {len(st.session_state.regions_list)} 个兑奖单位")
             return True
             
         except Exception as e:
+            if not st.session_state.db_connected:
+                st.error("❌ 数据库未连接")
             st.session_state.regions_loaded = False
             self.log_message("获取兑奖单位列表失败")
             return False
     
-    def fetch_play_methods_from_db(self):
-        """从数据库获取玩法列表"""
+    def fetch_play_methods_from_db(self, refresh=False):
+        """从数据库获取玩法列表（refresh=True 时跳过缓存重新查询）"""
+        def load():
+            with self.get_connection() as connection:
+                cursor = connection.cursor()
+                play_method_col = self.column_mapping['play_method']
+                cursor.execute(f"SELECT DISTINCT {play_method_col} FROM {self.table_name} WHERE {play_method_col} IS NOT NULL AND {play_method_col} != ''")
+                return [result[0] for result in cursor.fetchall()]
+        
         try:
-            if not self.test_db_connection():
-                st.error("❌ 数据库未连接")
-                return False
-                
-            connection = pymysql.connect(**self.db_config)
-            
-            cursor = connection.cursor()
-            play_method_col = self.column_mapping['play_method']
-            cursor.execute(f"SELECT DISTINCT {play_method_col} FROM {self.table_name} WHERE {play_method_col} IS NOT NULL AND {play_method_col} != ''")
-            results = cursor.fetchall()
-            
-            st.session_state.play_methods_list = [result[0] for result in results]
-            connection.close()
+            # 所有会话共享，导入数据、用户点刷新或缓存过期后才会重新查询
+            st.session_state.play_methods_list = list(self.cached_query(
+                'play_methods', {}, load, ttl=self.dimension_cache_ttl, refresh=refresh
+            ))
             
             st.session_state.methods_loaded = True
             self.log_message(f"从数据库获取到 {len(st.session_state.play_methods_list)} 种玩法")
             return True
             
         except Exception as e:
+            if not st.session_state.db_connected:
+                st.error("❌ 数据库未连接")
             st.session_state.methods_loaded = False
             self.log_message("获取玩法列表失败")
             return False
@@ -1445,120 +4749,118 @@ class LotteryDataExporterStreamlit:
         
         return conditions
     
-    def build_query(self, conditions):
-        """构建SQL查询语句"""
-        base_query = f"SELECT * FROM {self.table_name} WHERE 1=1"
-        query_params = []
-        
-        # 使用正确的列名映射
-        region_col = self.column_mapping['region']
-        sale_site_col = self.column_mapping['sale_site']
-        redeem_site_col = self.column_mapping['redeem_site']
-        play_method_col = self.column_mapping['play_method']
-        prize_level_col = self.column_mapping['prize_amount']  # 注意这里改为 prize_amount
-        redeem_time_col = self.column_mapping['redeem_time']
-        sale_time_col = self.column_mapping['sale_time']
-        
-        # 兑奖单位条件
-        if conditions.get('region'):
-            base_query += f" AND {region_col} = %s"
-            query_params.append(conditions['region'])
-        
-        # 兑奖站点条件
-        if conditions.get('redeem_site'):
-            base_query += f" AND {redeem_site_col} = %s"
-            query_params.append(conditions['redeem_site'])
-        
-        # 玩法条件（多选）
-        if conditions.get('play_methods'):
-            placeholders = ', '.join(['%s'] * len(conditions['play_methods']))
-            base_query += f" AND {play_method_col} IN ({placeholders})"
-            query_params.extend(conditions['play_methods'])
-        
-        # 兑奖金额条件（按票种设置）
-        if conditions.get('prize_conditions'):
-            prize_conditions = conditions['prize_conditions']
-            if prize_conditions:
-                prize_conditions_parts = []
-                for method, amount in prize_conditions.items():
-                    prize_conditions_parts.append(f"({play_method_col} = %s AND {prize_level_col} = %s)")
-                    query_params.extend([method, amount])
-                
-                base_query += " AND (" + " OR ".join(prize_conditions_parts) + ")"
-        
-        # 兑奖时间条件
-        if conditions.get('redeem_start_time') and conditions.get('redeem_end_time'):
-            base_query += f" AND DATE({redeem_time_col}) BETWEEN %s AND %s"
-            query_params.extend([conditions['redeem_start_time'], conditions['redeem_end_time']])
-        
-        # 销售时间条件
-        if conditions.get('sale_start_time') and conditions.get('sale_end_time'):
-            base_query += f" AND DATE({sale_time_col}) BETWEEN %s AND %s"
-            query_params.extend([conditions['sale_start_time'], conditions['sale_end_time']])
-        
-        return base_query, query_params
-    
     def preview_data_func(self):
-        """预览数据"""
+        """预览数据 - 查询提交到后台线程执行，等待结果期间可以取消"""
         try:
-            # 检查数据库连接
-            if not self.test_db_connection():
-                st.error("❌ 数据库未连接，请检查数据库服务")
-                return
-                
             conditions = self.get_conditions()
             
             self.log_message("开始查询数据...")
             self.log_message(f"筛选条件: {conditions}")
             
-            # 显示进度
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            status_text.text("正在连接数据库...")
-            progress_bar.progress(20)
-            
-            connection = pymysql.connect(**self.db_config)
-            
-            status_text.text("构建查询语句...")
-            progress_bar.progress(40)
-            
             query, params = self.build_query(conditions)
             self.log_message(f"执行查询: {query}")
             self.log_message(f"查询参数: {params}")
             
-            status_text.text("执行查询...")
-            progress_bar.progress(60)
-            
-            # 执行查询
-            st.session_state.preview_data = pd.read_sql(query, connection, params=params)
-            connection.close()
+            # 清空上次结果（上次预览还没结束时一并取消）
+            self.clear_preview_result()
+            st.session_state.preview_conditions = conditions
+            st.session_state.preview_job_id = self.submit_preview_job(conditions)
             
-            status_text.text("处理查询结果...")
-            progress_bar.progress(80)
+        except Exception as e:
+            error_msg = f"查询过程中发生错误: {e}"
+            if not st.session_state.db_connected:
+                st.error("❌ 数据库未连接，请检查数据库服务")
+            else:
+                st.error("查询过程中发生错误，请重试")
+            self.log_message("查询过程中发生错误")
+            st.session_state.last_query_success = False
+    
+    def submit_preview_job(self, conditions):
+        """把预览查询提交到交互查询线程池，返回任务 id"""
+        paged = st.session_state.paged_preview
+        page_size = st.session_state.preview_page_size
+        use_replica = self.replica_enabled()
+        if use_replica:
+            # 副本落后时在这里（会话线程）提交同步任务，查询任务中只判断能否使用副本
+            self.replica_ready()
+        token = CancelToken(self.kill_query)
+        worker = BackgroundWorkerApp(cancel_token=token, use_replica=use_replica)
+        
+        def run(job_id, report):
+            worker.bind_report(report)
+            try:
+                if paged:
+                    # 分页模式：只统计总数并读取第一页
+                    report(0.2, "统计记录数...")
+                    total = worker.fetch_preview_count(conditions)
+                    report(0.6, f"共 {total} 条记录，读取第一页...")
+                    value = {'total': total, 'page_data': worker.fetch_preview_page(0, conditions, page_size)}
+                else:
+                    report(0.2, "读取查询结果...")
+                    data = worker.fetch_full_result(conditions)
+                    value = {'total': len(data), 'data': data, 'memory_report': worker.memory_report}
+            except (pymysql.err.MySQLError, QueryCancelled) as e:
+                raise RuntimeError(self.query_error_message(e, str(e))) from e
+            return {'message': f"查询到 {value['total']} 条记录", 'value': value}
+        
+        return self.jobs.submit('query', "预览查询", st.session_state.username, run, cancel_token=token, interactive=True)
+    
+    def setup_preview_job_ui(self):
+        """预览查询进行中时显示进度和取消按钮，完成后把结果写入本会话"""
+        job_id = st.session_state.preview_job_id
+        if job_id is None:
+            return
+        
+        job = self.jobs.get_job(job_id)
+        if job is not None and job['status'] not in JOB_FINISHED_STATUSES:
+            self.preview_job_progress(job_id)
+            return
+        
+        st.session_state.preview_job_id = None
+        result = self.jobs.pop_result(job_id)
+        if job is not None and job['status'] == 'succeeded' and result is not None:
+            if 'data' in result:
+                st.session_state.preview_data = result['data']
+                if result['memory_report'] is not None:
+                    st.session_state.preview_memory_report = result['memory_report']
+            else:
+                st.session_state.preview_page_data = result['page_data']
+            st.session_state.preview_total = result['total']
             
-            if st.session_state.preview_data.empty:
+            if st.session_state.preview_total == 0:
                 st.session_state.last_query_success = False
                 self.log_message("没有找到符合条件的数据")
             else:
                 st.session_state.last_query_success = True
-                self.log_message(f"查询到 {len(st.session_state.preview_data)} 条记录")
-            
-            progress_bar.progress(100)
-            status_text.text("查询完成！")
-            time.sleep(0.5)
-            status_text.empty()
-            progress_bar.empty()
-            
-        except Exception as e:
-            error_msg = f"查询过程中发生错误: {e}"
-            st.error("查询过程中发生错误，请重试")
-            self.log_message("查询过程中发生错误")
-            st.session_state.last_query_success = False
+                self.log_message(f"查询到 {st.session_state.preview_total} 条记录")
+            return
+        
+        st.session_state.preview_conditions = None
+        st.session_state.last_query_success = False
+        if job is not None and job['status'] == 'cancelled':
+            st.warning("⚠️ 查询已取消")
+        else:
+            message = job['message'] if job is not None else "查询任务已丢失，请重新查询"
+            st.error(f"❌ {message}")
+            self.log_message(f"查询失败: {message}")
+    
+    @st.fragment(run_every=PREVIEW_POLL_SECONDS)
+    def preview_job_progress(self, job_id):
+        """预览查询的进度和取消按钮：只有这一部分定时重新运行，其他标签页不会跟着重新查询；
+        查询结束后整页重新运行一次，由 setup_preview_job_ui 取回结果"""
+        job = self.jobs.get_job(job_id)
+        if job is None or job['status'] in JOB_FINISHED_STATUSES:
+            st.rerun()
+        
+        if st.button("⏹️ 取消查询", key="cancel_preview_btn"):
+            if self.jobs.cancel(job_id):
+                self.log_message("已取消预览查询")
+        elapsed = (datetime.now() - datetime.strptime(job['created_at'], '%Y-%m-%d %H:%M:%S')).total_seconds()
+        st.progress(job['progress'], text=f"{job['message']}（已用时 {elapsed:.0f} 秒）")
     
     def export_data(self):
         """导出数据"""
-        if st.session_state.preview_data is None or st.session_state.preview_data.empty:
+        if not st.session_state.preview_total:
             st.warning("⚠️ 请先预览数据再进行导出")
             return
         
@@ -1578,7 +4880,7 @@ class LotteryDataExporterStreamlit:
         if 'redeem_site' in st.session_state:
             st.session_state.redeem_site = ""
         
-        st.session_state.preview_data = None
+        self.clear_preview_result()
         st.session_state.last_query_success = False
         
         st.success("✅ 筛选条件已清空")
@@ -1588,7 +4890,7 @@ class LotteryDataExporterStreamlit:
         """清空所有条件"""
         st.session_state.selected_play_methods.clear()
         st.session_state.prize_conditions.clear()
-        st.session_state.preview_data = None
+        self.clear_preview_result()
         st.session_state.last_query_success = False
         
         # 重置UI状态
@@ -1603,21 +4905,93 @@ class LotteryDataExporterStreamlit:
         self.log_message("所有条件已清空")
         st.rerun()
     
+    def clear_preview_result(self):
+        """清空预览结果（包括分页状态），取消还没结束的预览查询"""
+        if st.session_state.preview_job_id is not None:
+            self.jobs.cancel(st.session_state.preview_job_id)
+            self.jobs.pop_result(st.session_state.preview_job_id)
+            st.session_state.preview_job_id = None
+        st.session_state.preview_data = None
+        st.session_state.preview_conditions = None
+        st.session_state.preview_total = 0
+        st.session_state.preview_page_data = None
+        st.session_state.preview_page_anchors = [0]
+    
     def show_statistics(self):
         """显示统计信息"""
-        if st.session_state.preview_data is not None and not st.session_state.preview_data.empty:
+        if st.session_state.preview_total:
             st.subheader("📊 数据统计")
             
+            # 分页模式下用当前页判断列结构
+            data = st.session_state.preview_data
+            if data is None:
+                data = st.session_state.preview_page_data
+            
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("总记录数", len(st.session_state.preview_data))
+                st.metric("总记录数", st.session_state.preview_total)
             with col2:
-                st.metric("数据列数", len(st.session_state.preview_data.columns))
+                st.metric("数据列数", len(data.columns))
             with col3:
-                st.metric("数据类型", f"{len(st.session_state.preview_data.select_dtypes(include=['number']).columns)} 数值列")
-            
-        else:
+                st.metric("数据类型", f"{len(data.select_dtypes(include=['number']).columns)} 数值列")
+        
+        # 按当前筛选条件汇总（条件允许时读按天汇总表）
+        conditions = self.get_conditions()
+        try:
+            region_totals = self.fetch_summary_totals(conditions, 'region')
+            method_totals = self.fetch_summary_totals(conditions, 'play_method')
+        except Exception as e:
+            st.error("汇总统计失败，请重试")
+            self.log_message(f"汇总统计失败: {e}")
+            return
+        
+        if region_totals.empty:
             st.warning("暂无数据可统计")
+            return
+        
+        st.subheader("📈 汇总统计")
+        source = "按天汇总表" if self.can_use_rollup(conditions) else "明细表"
+        st.caption(f"数据来源: {source}")
+        
+        total_records = int(region_totals['记录数'].sum())
+        total_amount = region_totals['总金额'].sum()
+        col1, col2 = st.columns(2)
+        col1.metric("总记录数", f"{total_records:,}")
+        col2.metric("总兑奖金额", f"¥{total_amount:,.2f}")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.write("**🏢 按兑奖单位**")
+            st.dataframe(region_totals, use_container_width=True)
+        with col2:
+            st.write("**🎮 按玩法**")
+            st.dataframe(method_totals, use_container_width=True)
+    
+    def fetch_summary_totals(self, conditions, group_key):
+        """按兑奖单位或玩法汇总记录数和金额"""
+        group_col = self.column_mapping[group_key]
+        
+        def load():
+            if self.can_use_rollup(conditions):
+                query, params = self.build_rollup_query(
+                    conditions,
+                    f"`{group_col}`, SUM(`记录数`) AS `记录数`, SUM(`总金额`) AS `总金额`"
+                )
+                query += f" GROUP BY `{group_col}` ORDER BY `总金额` DESC"
+                totals = self.read_rollup_frame(query, params)
+            else:
+                # 明细汇总，列式副本可用时在本地执行
+                query, params = self.build_query(
+                    conditions,
+                    f"`{group_col}`, COUNT(*) AS `记录数`, SUM(`{self.column_mapping['prize_amount']}`) AS `总金额`"
+                )
+                query += f" GROUP BY `{group_col}` ORDER BY `总金额` DESC"
+                totals = self.read_frame(query, params)
+            totals['记录数'] = totals['记录数'].astype('int64')
+            totals['总金额'] = totals['总金额'].astype(float).round(2)
+            totals = merge_blank_labels(totals, [group_col])
+            return totals.sort_values('总金额', ascending=False, kind='stable', ignore_index=True)
+        return self.cached_query('totals', conditions, load, group_key)
     
     def log_message(self, message):
         """记录日志消息"""
@@ -1688,8 +5062,54 @@ class LotteryDataExporterStreamlit:
         self.log_message("时间范围已设置为上个月")
         st.rerun()
 
+class BackgroundWorkerApp(LotteryDataExporterStreamlit):
+    """在后台任务线程中复用应用的导入导出逻辑：连接池、缓存等进程级对象与应用共享，但不访问 st.session_state。
+    在提交任务的脚本线程中创建，任务开始运行时用 bind_report 绑定进度回调"""
+    
+    def __init__(self, cancel_token=None, use_replica=False):
+        super().__init__()
+        self.cancel_token = cancel_token
+        self.use_replica = use_replica
+        self.memory_report = None
+        self.report = None
+    
+    def bind_report(self, report):
+        """绑定任务的进度回调，返回自身"""
+        self.report = report
+        return self
+    
+    def init_session_state(self):
+        """后台任务不使用 session state"""
+    
+    def record_connection_status(self, connected):
+        """后台任务不更新会话的连接状态"""
+    
+    def replica_enabled(self):
+        """使用提交任务时会话的选择"""
+        return self.use_replica
+    
+    def request_replica_refresh(self):
+        """后台任务中不提交副本同步任务（由会话提交），副本落后时查询 MySQL"""
+        return None
+    
+    def save_memory_report(self, report):
+        """内存报告随查询结果一起交回提交的会话"""
+        self.memory_report = report
+    
+    def log_message(self, message):
+        """日志写入 logging，同时作为任务的当前状态"""
+        logger.info(message)
+        self.report(message=message)
+
 # 运行应用
 def main():
+    # 设置页面配置（放在这里而不是模块导入时，命令行工具导入本模块不受影响）
+    st.set_page_config(
+        page_title="即开票数据查询",
+        page_icon="🎫",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
     app = LotteryDataExporterStreamlit()
     app.setup_ui()
 
@@ -0,0 +1,172 @@
+"""即开票数据命令行批量导出 - 不启动 Streamlit，按筛选条件把查询结果从数据库游标流式写入文件
+
+示例:
+    python lottery_cli.py --redeem-start 2025-01-01 --redeem-end 2025-01-31 --all-regions --format parquet --jobs 4
+    python lottery_cli.py --region 某兑奖单位 --play-method 玩法A --prize 玩法A=100 --output-dir exports
+--all-regions 只导出有兑奖单位的记录，兑奖单位为空的记录不在任何文件中（需要时不指定兑奖单位整体导出一次）
+数据库连接: LOTTERY_DB_HOST / LOTTERY_DB_USER / LOTTERY_DB_PASSWORD / LOTTERY_DB_NAME
+单个导出查询的执行时间上限: LOTTERY_EXPORT_TIMEOUT_MS（毫秒，默认不限制）
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from lottery_app import LotteryDatabase, pq
+
+# 命令行格式名: (write_query_file 的格式名, 扩展名)
+EXPORT_FORMATS = {
+    'csv': ('CSV', 'csv'),
+    'excel': ('Excel', 'xlsx'),
+    'parquet': ('Parquet', 'parquet'),
+}
+
+
+def parse_date(value):
+    """YYYY-MM-DD 转为 get_conditions 使用的 YYYY/MM/DD"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').strftime('%Y/%m/%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"日期格式应为 YYYY-MM-DD: {value}")
+
+
+def parse_prize(value):
+    """玩法=金额"""
+    method, sep, amount = value.rpartition('=')
+    if not sep or not method or not amount:
+        raise argparse.ArgumentTypeError(f"金额条件格式应为 玩法=金额: {value}")
+    return method, amount
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="按筛选条件批量导出即开票兑奖明细")
+    parser.add_argument('--region', action='append', default=[], help="兑奖单位，可重复指定，每个单位导出一个文件")
+    parser.add_argument('--all-regions', action='store_true',
+                        help="数据库中每个兑奖单位各导出一个文件（不能与 --region 同时使用；兑奖单位为空的记录不导出）")
+    parser.add_argument('--redeem-site', help="兑奖站点")
+    parser.add_argument('--play-method', action='append', default=[], help="玩法，可重复指定")
+    parser.add_argument('--prize', action='append', default=[], type=parse_prize, help="金额条件 玩法=金额，可重复指定")
+    parser.add_argument('--redeem-start', type=parse_date, help="兑奖开始日期 YYYY-MM-DD")
+    parser.add_argument('--redeem-end', type=parse_date, help="兑奖结束日期 YYYY-MM-DD（含当天）")
+    parser.add_argument('--sale-start', type=parse_date, help="销售开始日期 YYYY-MM-DD")
+    parser.add_argument('--sale-end', type=parse_date, help="销售结束日期 YYYY-MM-DD（含当天）")
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv', help="导出格式")
+    parser.add_argument('--encoding', default='utf-8', help="CSV 编码")
+    parser.add_argument('--output-dir', default='.', help="输出目录")
+    parser.add_argument('--prefix', default=f"lottery_export_{datetime.now():%Y%m%d}", help="文件名前缀")
+    parser.add_argument('--jobs', type=int, default=1, help="同时导出的兑奖单位数")
+    return parser
+
+
+def build_conditions(args):
+    """命令行参数转为与 get_conditions 相同结构的筛选条件（不含兑奖单位）"""
+    conditions = {}
+    if args.redeem_site:
+        conditions['redeem_site'] = args.redeem_site
+    if args.play_method:
+        conditions['play_methods'] = list(args.play_method)
+    if args.prize:
+        conditions['prize_conditions'] = dict(args.prize)
+    if args.redeem_start and args.redeem_end:
+        conditions['redeem_start_time'] = args.redeem_start
+        conditions['redeem_end_time'] = args.redeem_end
+    if args.sale_start and args.sale_end:
+        conditions['sale_start_time'] = args.sale_start
+        conditions['sale_end_time'] = args.sale_end
+    return conditions
+
+
+def safe_file_part(value):
+    """去掉文件名中不允许的字符"""
+    return re.sub(r'[\\/:*?"<>|\s]+', '_', value)
+
+
+def unique_file_names(prefix, regions, extension):
+    """每个兑奖单位的文件名；清理后重名（如“A B”和“A_B”，或只有大小写不同）时依次加 _2、_3 后缀，
+    避免两个线程写同一个 .part 文件"""
+    used = set()
+    names = []
+    for region in regions:
+        base = f"{prefix}_{safe_file_part(region)}"
+        file_name = f"{base}.{extension}"
+        suffix = 1
+        while file_name.lower() in used:
+            suffix += 1
+            file_name = f"{base}_{suffix}.{extension}"
+        used.add(file_name.lower())
+        names.append(file_name)
+    return names
+
+
+def export_one(database, conditions, path, export_format, encoding):
+    """导出一个文件，返回 (路径, 记录数, 耗时)"""
+    start_time = time.time()
+    tmp_path = path + '.part'
+    try:
+        row_count = database.write_query_file(conditions, tmp_path, export_format, encoding)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path, row_count, time.time() - start_time
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if (args.redeem_start is None) != (args.redeem_end is None) or (args.sale_start is None) != (args.sale_end is None):
+        print("开始日期和结束日期需要同时指定", file=sys.stderr)
+        return 2
+    if args.all_regions and args.region:
+        print("--all-regions 与 --region 不能同时使用", file=sys.stderr)
+        return 2
+    export_format, extension = EXPORT_FORMATS[args.format]
+    if export_format == "Parquet" and pq is None:
+        print("导出 Parquet 需要安装 pyarrow", file=sys.stderr)
+        return 2
+
+    database = LotteryDatabase()
+    base_conditions = build_conditions(args)
+    # 重复指定的兑奖单位只导出一次
+    regions = list(dict.fromkeys(args.region))
+    if args.all_regions:
+        regions = database.query_regions()
+
+    # 每个兑奖单位一个文件；未指定兑奖单位时按条件导出一个文件
+    tasks = []
+    if regions:
+        for region, file_name in zip(regions, unique_file_names(args.prefix, regions, extension)):
+            conditions = dict(base_conditions, region=region)
+            tasks.append((region, conditions, os.path.join(args.output_dir, file_name)))
+    else:
+        tasks.append(("全部", base_conditions, os.path.join(args.output_dir, f"{args.prefix}.{extension}")))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    # 并发数不超过连接池大小，避免线程等待连接超时
+    jobs = max(1, min(args.jobs, database.pool_config['pool_size'], len(tasks)))
+    failures = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(export_one, database, conditions, path, export_format, args.encoding): name
+            for name, conditions, path in tasks
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                path, row_count, elapsed = future.result()
+                print(f"[完成] {name}: {row_count} 条记录 -> {path}（{elapsed:.1f} 秒）")
+            except Exception as e:
+                failures += 1
+                print(f"[失败] {name}: {database.query_error_message(e, str(e))}", file=sys.stderr)
+
+    print(f"共导出 {len(tasks) - failures}/{len(tasks)} 个文件")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
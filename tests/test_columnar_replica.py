@@ -0,0 +1,241 @@
+"""ColumnarReplica / mysql_to_duckdb_sql：build_query 生成的各类查询在列式副本上的结果，
+应与 MySQL 默认排序规则 utf8mb4_general_ci（忽略大小写和尾部空格）下的结果一致"""
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip('duckdb')
+pytest.importorskip('pyarrow')
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lottery_app import (  # noqa: E402
+    BackgroundWorkerApp, ColumnarReplica, LotteryDatabase, LotteryDataExporterStreamlit, mysql_to_duckdb_sql,
+)
+
+# id, 兑奖单位, 方案名称, 售出站点, 兑奖站点, 兑奖时间, 售出时间, 兑奖金额
+DETAIL_ROWS = [
+    (1, 'HZ', '玩法A', '站点1', '站点1', '2025-03-01 10:00:00', '2025-02-20 09:00:00', '10.00'),
+    (2, 'hz ', '玩法a', '站点1', '站点2', '2025-03-31 23:59:59', '2025-03-01 08:00:00', '20.00'),
+    (3, 'NB', '玩法B', '站点X', '站点x ', '2025-04-01 00:00:00', '2025-03-31 12:00:00', '50.00'),
+    (4, 'Hz', '玩法B', None, None, None, '2025-01-05 12:00:00', '100.00'),
+    (5, 'NB', '玩法A ', '站点3', '站点4', '2025-02-28 18:30:00', '2025-02-01 00:00:00', '10.00'),
+]
+
+
+def collate(value):
+    return value.lower().rstrip(' ')
+
+
+@pytest.fixture
+def db():
+    return LotteryDatabase()
+
+
+@pytest.fixture
+def replica(tmp_path, db):
+    columns = ['id'] + db.db_columns + ['created_at']
+    rows = []
+    for row_id, region, method, sale_site, redeem_site, redeem_time, sale_time, amount in DETAIL_ROWS:
+        values = dict.fromkeys(columns)
+        values.update({
+            'id': row_id, '兑奖单位': region, '方案名称': method, '售出站点': sale_site, '兑奖站点': redeem_site,
+            '兑奖时间': redeem_time, '售出时间': sale_time, '兑奖金额': Decimal(amount),
+            '彩票流水号': f"T{row_id}", 'created_at': '2026-01-01 00:00:00',
+        })
+        rows.append(tuple(values[column] for column in columns))
+
+    def read_rows_between(after_id, upper_id):
+        yield columns, [row for row in rows if after_id < row[0] <= upper_id]
+
+    replica = ColumnarReplica(str(tmp_path), db.table_name)
+    replica.refresh(read_rows_between, len(rows))
+    return replica
+
+
+def result_ids(db, replica, conditions):
+    query, params = db.build_query(conditions)
+    return replica.query_frame(query + " ORDER BY id", params)['id'].tolist()
+
+
+@pytest.mark.parametrize('conditions, expected', [
+    ({'region': 'hz'}, [1, 2, 4]),
+    ({'region': 'HZ  '}, [1, 2, 4]),
+    ({'redeem_site': '站点X'}, [3]),
+    ({'play_methods': ['玩法a']}, [1, 2, 5]),
+    ({'play_methods': ['玩法b ', '玩法A']}, [1, 2, 3, 4, 5]),
+    ({'prize_conditions': {'玩法a': 10}}, [1, 5]),
+    ({'prize_conditions': {'玩法A': 20, '玩法B': 100}}, [2, 4]),
+    ({'redeem_start_time': '2025/03/01', 'redeem_end_time': '2025/03/31'}, [1, 2]),
+    ({'sale_start_time': '2025/03/01', 'sale_end_time': '2025/03/31'}, [2, 3]),
+    ({'region': 'nb', 'redeem_start_time': '2025/02/01', 'redeem_end_time': '2025/04/01'}, [3, 5]),
+])
+def test_filter_shapes_match_mysql_collation(db, replica, conditions, expected):
+    assert result_ids(db, replica, conditions) == expected
+
+
+def test_count_matches_mysql_collation(db, replica):
+    query, params = db.build_query({'region': 'Hz '}, "COUNT(*)")
+    assert replica.query_scalar(query, params) == 3
+
+
+def test_preview_page_shape(db, replica):
+    query, params = db.build_query({'region': 'hz'})
+    page = replica.query_frame(query + " AND id > %s ORDER BY id LIMIT %s", params + [1, 1])
+    assert page['id'].tolist() == [2]
+
+
+def test_null_redeem_time_stays_null(db, replica):
+    frame = replica.query_frame(*db.build_query({'region': 'hz'}))
+    assert frame.loc[frame['id'] == 4, '兑奖时间'].isna().all()
+
+
+def test_site_summary_groups_by_collated_region_and_site(db, replica):
+    relation = LotteryDataExporterStreamlit.site_relation_sql(db)
+    query, params = db.build_query(
+        {}, f"`兑奖单位` AS `兑奖单位`, {relation} AS `站点关系`, COUNT(*) AS `记录数`, SUM(`兑奖金额`) AS `总金额`"
+    )
+    query += " GROUP BY `兑奖单位`, `站点关系` ORDER BY `兑奖单位`, `站点关系`"
+    summary = replica.query_frame(query, params)
+    result = {
+        (collate(row['兑奖单位']), row['站点关系']): (int(row['记录数']), float(row['总金额']))
+        for _, row in summary.iterrows()
+    }
+    # '站点X' 与 '站点x ' 比较相等，两边都为空也算一致；'HZ'、'hz '、'Hz' 归为一组
+    assert result == {
+        ('hz', '一致'): (2, 110.0),
+        ('hz', '不一致'): (1, 20.0),
+        ('nb', '一致'): (1, 50.0),
+        ('nb', '不一致'): (1, 10.0),
+    }
+
+
+def test_totals_group_by_collated_play_method(db, replica):
+    query, params = db.build_query({}, "`方案名称`, COUNT(*) AS `记录数`, SUM(`兑奖金额`) AS `总金额`")
+    query += " GROUP BY `方案名称` ORDER BY `总金额` DESC"
+    totals = replica.query_frame(query, params)
+    assert [(collate(name), int(count), float(amount)) for name, count, amount in totals.itertuples(index=False)] == [
+        ('玩法b', 2, 150.0),
+        ('玩法a', 3, 40.0),
+    ]
+
+
+def test_numeric_and_time_comparisons_are_not_collated():
+    sql = mysql_to_duckdb_sql(
+        "SELECT COUNT(*) FROM t WHERE 1=1 AND ((方案名称 = %s AND 兑奖金额 = %s)) AND 兑奖时间 >= %s AND id > %s"
+    )
+    assert sql == (
+        "SELECT COUNT(*) FROM t WHERE 1=1 AND ((lower(rtrim(方案名称)) = lower(rtrim(?)) AND 兑奖金额 = ?)) "
+        "AND 兑奖时间 >= ? AND id > ?"
+    )
+
+
+def test_query_count_from_concurrent_sessions(db, replica):
+    query, params = db.build_query({'region': 'hz'}, "COUNT(*)")
+    threads = [
+        threading.Thread(target=lambda: [replica.query_scalar(query, params) for _ in range(5)]) for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    replica.record_fallback()
+    stats = replica.stats()
+    assert stats['queries'] == 40 and stats['fallbacks'] == 1
+
+
+@pytest.fixture
+def worker(monkeypatch, tmp_path, replica):
+    """使用列式副本的后台查询对象：不读写结果缓存，副本查询出错时改查 MySQL 会直接失败"""
+    monkeypatch.setenv('LOTTERY_JOB_DIR', str(tmp_path / 'jobs'))
+    worker = BackgroundWorkerApp(use_replica=True).bind_report(lambda *args, **kwargs: None)
+    worker.replica = replica
+
+    @contextmanager
+    def no_mysql():
+        raise AssertionError("该查询应在列式副本上执行")
+        yield
+
+    monkeypatch.setattr(worker, 'replica_ready', lambda: True)
+    monkeypatch.setattr(worker, 'get_connection', no_mysql)
+    monkeypatch.setattr(worker, 'cached_query', lambda kind, conditions, loader, *extra, **kwargs: loader())
+    return worker
+
+
+# 以下按应用中路由到副本的每个入口（read_frame / read_scalar 的调用方）核对结果
+@pytest.mark.parametrize('conditions, expected', [
+    ({}, [1, 2, 3, 4, 5]),
+    ({'region': 'HZ '}, [1, 2, 4]),
+    ({'region': 'nb', 'play_methods': ['玩法a'], 'redeem_start_time': '2025/02/01', 'redeem_end_time': '2025/02/28'}, [5]),
+    ({'redeem_site': '站点x', 'prize_conditions': {'玩法b': 50}}, [3]),
+])
+def test_full_result_and_count(worker, conditions, expected):
+    data = worker.fetch_full_result(conditions)
+    assert data['id'].tolist() == expected
+    assert worker.memory_report is not None
+    assert worker.fetch_preview_count(conditions) == len(expected)
+    assert worker.replica.stats()['fallbacks'] == 0
+
+
+def test_full_result_restores_null_redeem_time(worker):
+    data = worker.fetch_full_result({'region': 'hz'})
+    assert data.loc[data['id'] == 4, '兑奖时间'].isna().all()
+    assert data.loc[data['id'] == 1, '兑奖时间'].notna().all()
+
+
+def test_preview_pages(worker):
+    pages, anchor = [], 0
+    while True:
+        page = worker.fetch_preview_page(anchor, {'region': 'hz'}, 2)
+        if page.empty:
+            break
+        pages.append(page['id'].tolist())
+        anchor = int(page['id'].iloc[-1])
+    assert pages == [[1, 2], [4]]
+
+
+@pytest.mark.parametrize('conditions', [{}, {'sale_start_time': '2025/01/01', 'sale_end_time': '2025/12/31'}])
+def test_site_summary(worker, conditions):
+    # 不论条件能否使用按天汇总表，副本可用时都在副本上汇总
+    summary = worker.fetch_site_summary(conditions)
+    result = {
+        (collate(row['兑奖单位']), row['站点关系']): (row['记录数'], row['总金额']) for _, row in summary.iterrows()
+    }
+    assert result == {
+        ('hz', '一致'): (2, 110.0),
+        ('hz', '不一致'): (1, 20.0),
+        ('nb', '一致'): (1, 50.0),
+        ('nb', '不一致'): (1, 10.0),
+    }
+
+
+@pytest.mark.parametrize('analysis_type, limit, expected', [
+    ("全部", None, [1, 2, 3, 4, 5]),
+    ("站点一致", None, [1, 3, 4]),
+    ("站点不一致", None, [2, 5]),
+    ("站点一致", 2, [1, 3]),
+])
+def test_site_detail(worker, analysis_type, limit, expected):
+    detail = worker.fetch_site_detail({}, analysis_type, limit)
+    assert len(detail) == len(expected)
+    if analysis_type != "全部":
+        assert set(detail['站点关系']) == {analysis_type.replace("站点", "")}
+    amounts = {row_id: float(amount) for row_id, *_, amount in DETAIL_ROWS}
+    assert detail['兑奖金额'].astype(float).tolist() == [amounts[row_id] for row_id in expected]
+
+
+@pytest.mark.parametrize('group_key, expected', [
+    ('region', [('nb', 2, 60.0), ('hz', 2, 30.0)]),
+    ('play_method', [('玩法b', 1, 50.0), ('玩法a', 3, 40.0)]),
+])
+def test_summary_totals(worker, group_key, expected):
+    # 含售出时间条件时不能读按天汇总表，走明细汇总（副本）
+    conditions = {'sale_start_time': '2025/02/01', 'sale_end_time': '2025/12/31'}
+    totals = worker.fetch_summary_totals(conditions, group_key)
+    column = worker.column_mapping[group_key]
+    rows = totals[[column, '记录数', '总金额']].itertuples(index=False)
+    assert [(collate(name), count, amount) for name, count, amount in rows] == expected
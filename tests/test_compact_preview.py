@@ -0,0 +1,33 @@
+"""compact_preview_frame：按 pandas 默认的字符串推断构建查询结果，低基数字符串列应转为分类类型"""
+import os
+import sys
+from decimal import Decimal
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lottery_app import compact_preview_frame  # noqa: E402
+
+
+def build_frame(rows=1000):
+    return pd.DataFrame({
+        'id': range(1, rows + 1),
+        '兑奖单位': [f"单位{i % 5}" for i in range(rows)],
+        '方案名称': [f"玩法{i % 3}" for i in range(rows)],
+        '售出站点': [f"站点{i % 20}" for i in range(rows)],
+        '兑奖站点': [f"站点{(i + 1) % 20}" for i in range(rows)],
+        '彩票流水号': [f"{i:012d}" for i in range(rows)],
+        '兑奖金额': [Decimal('10.00')] * rows,
+    })
+
+
+def test_low_cardinality_text_columns_become_category():
+    compact, report = compact_preview_frame(build_frame())
+    for column in ['兑奖单位', '方案名称', '售出站点', '兑奖站点']:
+        assert isinstance(compact[column].dtype, pd.CategoricalDtype), column
+    # 售出站点与兑奖站点共用同一组类别，可以直接比较
+    assert compact['售出站点'].dtype == compact['兑奖站点'].dtype
+    # 取值都不重复的列保持字符串
+    assert not isinstance(compact['彩票流水号'].dtype, pd.CategoricalDtype)
+    assert report['压缩后字节'].sum() < report['原字节'].sum()
@@ -0,0 +1,85 @@
+"""按天汇总表与明细查询的结果一致：兑奖单位、玩法为空（NULL 或 ''）的明细在两条路径上都显示为同一个 NULL 分组。
+两条路径的 SQL 都改写为 DuckDB 方言在同一份明细上执行"""
+import os
+import sys
+from datetime import datetime
+
+import duckdb
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lottery_app import BackgroundWorkerApp, mysql_to_duckdb_sql  # noqa: E402
+
+DETAIL_ROWS = [
+    # 兑奖单位, 方案名称, 等级, 售出站点, 兑奖站点, 兑奖金额, 兑奖时间
+    ('hz', '玩法a', '一等奖', '站点1', '站点1', 10.0, datetime(2025, 1, 5, 9)),
+    ('hz', '玩法a', '一等奖', '站点1', '站点2', 20.0, datetime(2025, 1, 5, 15)),
+    (None, '玩法a', '二等奖', '站点1', '站点1', 30.0, datetime(2025, 1, 6, 10)),
+    ('', None, '二等奖', '站点2', '站点2', 40.0, datetime(2025, 1, 6, 11)),
+    ('', '', None, '站点3', None, 50.0, datetime(2025, 2, 1, 8)),
+    (None, '', '三等奖', None, None, 60.5, None),
+]
+
+
+@pytest.fixture
+def worker(monkeypatch, tmp_path):
+    monkeypatch.setenv('LOTTERY_JOB_DIR', str(tmp_path / 'jobs'))
+    worker = BackgroundWorkerApp().bind_report(lambda *args, **kwargs: None)
+    mapping = worker.column_mapping
+    detail = pd.DataFrame({column: [None] * len(DETAIL_ROWS) for column in worker.db_columns})
+    keys = ['region', 'play_method', 'prize_level', 'sale_site', 'redeem_site', 'prize_amount', 'redeem_time']
+    for index, key in enumerate(keys):
+        detail[mapping[key]] = [row[index] for row in DETAIL_ROWS]
+    detail.insert(0, 'id', range(1, len(DETAIL_ROWS) + 1))
+    detail[mapping['prize_amount']] = detail[mapping['prize_amount']].astype(float)
+    detail[mapping['redeem_time']] = pd.to_datetime(detail[mapping['redeem_time']])
+
+    connection = duckdb.connect()
+    connection.register('detail_frame', detail)
+    connection.execute(f'CREATE TABLE "{worker.table_name}" AS SELECT * FROM detail_frame')
+    rollup_sql = mysql_to_duckdb_sql(worker.rollup_group_sql("id > %s"))
+    connection.execute(f'CREATE TABLE "{worker.rollup_table}" AS {rollup_sql}', [0])
+
+    def read_duckdb(query, params):
+        return connection.execute(mysql_to_duckdb_sql(query), list(params)).df()
+
+    worker.use_rollup = False
+    monkeypatch.setattr(worker, 'read_frame', read_duckdb)
+    monkeypatch.setattr(worker, 'read_rollup_frame', read_duckdb)
+    monkeypatch.setattr(worker, 'replica_ready', lambda: False)
+    monkeypatch.setattr(worker, 'can_use_rollup', lambda conditions: worker.use_rollup)
+    monkeypatch.setattr(worker, 'cached_query', lambda kind, conditions, loader, *extra, **kwargs: loader())
+    return worker
+
+
+def both_paths(worker, fetch):
+    worker.use_rollup = False
+    detail = fetch()
+    worker.use_rollup = True
+    return detail, fetch()
+
+
+@pytest.mark.parametrize('conditions', [{}, {'redeem_start_time': '2025/01/01', 'redeem_end_time': '2025/01/31'}])
+def test_site_summary_matches_detail(worker, conditions):
+    detail, rollup = both_paths(worker, lambda: worker.fetch_site_summary(conditions))
+    pd.testing.assert_frame_equal(rollup, detail)
+    assert '' not in detail['兑奖单位'].tolist()
+
+
+def test_site_summary_blank_regions_form_one_null_group(worker):
+    detail, rollup = both_paths(worker, lambda: worker.fetch_site_summary({}))
+    for summary in (detail, rollup):
+        blank = summary[summary['兑奖单位'].isna()]
+        assert blank[['站点关系', '记录数', '总金额']].values.tolist() == [['一致', 3, 130.5], ['不一致', 1, 50.0]]
+
+
+@pytest.mark.parametrize('group_key, expected', [
+    ('region', [(None, 4, 180.5), ('hz', 2, 30.0)]),
+    ('play_method', [(None, 3, 150.5), ('玩法a', 3, 60.0)]),
+])
+def test_totals_match_detail(worker, group_key, expected):
+    detail, rollup = both_paths(worker, lambda: worker.fetch_summary_totals({}, group_key))
+    pd.testing.assert_frame_equal(rollup, detail)
+    assert list(detail.itertuples(index=False, name=None)) == expected
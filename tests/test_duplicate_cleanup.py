@@ -0,0 +1,117 @@
+"""库内重复数据清理：重复行的 id 流式分批读取（每组保留 id 最大的一条），
+每批删除与按天汇总表的扣减在同一事务中提交，失败时回滚当前批"""
+import os
+import sys
+from contextlib import contextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lottery_app import BackgroundWorkerApp, DuplicateCleanupError  # noqa: E402
+
+
+@pytest.fixture
+def worker(monkeypatch, tmp_path):
+    monkeypatch.setenv('LOTTERY_JOB_DIR', str(tmp_path / 'jobs'))
+    return BackgroundWorkerApp().bind_report(lambda *args, **kwargs: None)
+
+
+class StreamCursor:
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.closed = False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchmany(self, size):
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+    def close(self):
+        self.closed = True
+
+
+class StreamConnection:
+    def __init__(self, rows):
+        self.stream = StreamCursor(rows)
+
+    def cursor(self, *args):
+        return self.stream
+
+
+def test_duplicate_ids_streamed_in_batches(worker, monkeypatch):
+    # (哈希, id) 按哈希、id 排序，只含重复的哈希；每组保留 id 最大的一条
+    connection = StreamConnection([(b'a', 1), (b'a', 5), (b'b', 2), (b'b', 3), (b'b', 9), (b'c', 4), (b'c', 6)])
+
+    @contextmanager
+    def get_connection():
+        yield connection
+
+    monkeypatch.setattr(worker, 'get_connection', get_connection)
+    monkeypatch.setattr(worker, 'export_chunk_size', 2)
+    assert list(worker.iter_duplicate_id_batches(2)) == [[1, 2], [3, 4]]
+    assert connection.stream.closed
+
+
+class RecordingCursor:
+    def __init__(self, fail_on_delete=None):
+        self.connection = self
+        self.log = []
+        self.fail_on_delete = fail_on_delete
+        self.deletes = 0
+        self.rowcount = 0
+        self.result = None
+
+    def execute(self, sql, params=None):
+        sql = ' '.join(sql.split())
+        if sql.startswith('SHOW TABLES'):
+            self.result = ('rollup',)
+        elif sql.startswith('UPDATE'):
+            self.log.append(('subtract', list(params)))
+        elif sql.startswith('DELETE r'):
+            self.log.append(('drop_empty', list(params)))
+        elif sql.startswith('DELETE FROM'):
+            self.deletes += 1
+            if self.deletes == self.fail_on_delete:
+                raise RuntimeError("锁等待超时")
+            self.log.append(('delete', list(params)))
+            self.rowcount = len(params)
+
+    def fetchone(self):
+        return self.result
+
+    def commit(self):
+        self.log.append(('commit',))
+
+    def rollback(self):
+        self.log.append(('rollback',))
+
+
+@pytest.fixture
+def batches(worker, monkeypatch):
+    monkeypatch.setattr(worker, 'iter_duplicate_id_batches', lambda batch_size: iter([[1, 2], [3]]))
+
+
+def test_each_batch_subtracts_rollup_and_deletes_in_one_transaction(worker, batches):
+    cursor = RecordingCursor()
+    assert worker.clean_duplicate_data(cursor) == 3
+    assert cursor.log == [
+        ('subtract', [1, 2]), ('drop_empty', [1, 2]), ('delete', [1, 2]), ('commit',),
+        ('subtract', [3]), ('drop_empty', [3]), ('delete', [3]), ('commit',),
+    ]
+
+
+def test_failed_batch_is_rolled_back(worker, batches):
+    cursor = RecordingCursor(fail_on_delete=2)
+    with pytest.raises(DuplicateCleanupError) as error:
+        worker.clean_duplicate_data(cursor)
+    assert error.value.deleted == 2
+    assert cursor.log[-3:] == [('subtract', [3]), ('drop_empty', [3]), ('rollback',)]
+
+
+def test_dry_run_only_counts(worker, batches):
+    cursor = RecordingCursor()
+    assert worker.clean_duplicate_data(cursor, dry_run=True) == 3
+    assert cursor.log == []
@@ -0,0 +1,59 @@
+"""write_rows_to_excel：超过单表行数上限（含表头）时拆分为 彩票数据_1…彩票数据_N，每个表都有表头"""
+import io
+import os
+import sys
+
+from openpyxl import load_workbook
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lottery_app import write_rows_to_excel  # noqa: E402
+
+COLUMNS = ['id', '兑奖单位', '兑奖金额']
+
+
+def row_chunks(rows, chunk_size):
+    data = [(i, f"单位{i % 3}", i * 10) for i in range(1, rows + 1)]
+    for start in range(0, rows, chunk_size):
+        yield data[start:start + chunk_size]
+
+
+def read_sheets(buffer):
+    workbook = load_workbook(buffer, read_only=True)
+    try:
+        return {sheet.title: [list(row) for row in sheet.iter_rows(values_only=True)] for sheet in workbook.worksheets}
+    finally:
+        workbook.close()
+
+
+def test_rows_split_across_sheets_with_headers():
+    buffer = io.BytesIO()
+    progress = []
+    # 每表 4 行：表头加 3 行数据；数据块大小与表的边界错开
+    written = write_rows_to_excel(
+        buffer, COLUMNS, row_chunks(10, 4), '彩票数据', max_rows_per_sheet=4, progress_callback=progress.append
+    )
+    assert written == 10
+    assert progress == [4, 8, 10]
+
+    sheets = read_sheets(buffer)
+    assert list(sheets) == ['彩票数据_1', '彩票数据_2', '彩票数据_3', '彩票数据_4']
+    for rows in sheets.values():
+        assert rows[0] == COLUMNS
+        assert len(rows) <= 4
+    data_rows = [row for rows in sheets.values() for row in rows[1:]]
+    assert [row[0] for row in data_rows] == list(range(1, 11))
+
+
+def test_rows_exactly_filling_a_sheet_stay_in_one_sheet():
+    buffer = io.BytesIO()
+    assert write_rows_to_excel(buffer, COLUMNS, row_chunks(3, 2), '彩票数据', max_rows_per_sheet=4) == 3
+    sheets = read_sheets(buffer)
+    assert list(sheets) == ['彩票数据']
+    assert len(sheets['彩票数据']) == 4
+
+
+def test_empty_result_writes_header_only():
+    buffer = io.BytesIO()
+    assert write_rows_to_excel(buffer, COLUMNS, iter([]), '彩票数据', max_rows_per_sheet=4) == 0
+    assert read_sheets(buffer) == {'彩票数据': [COLUMNS]}
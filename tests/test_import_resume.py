@@ -0,0 +1,208 @@
+"""导入分批、文件内去重与断点续传：split_import_chunks、drop_in_file_duplicates、file_fingerprint，
+以及 import_to_database 中断后按检查点续传时发送到数据库的记录与一次导入完成时相同"""
+import hashlib
+import io
+import os
+import sys
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lottery_app import BackgroundWorkerApp, compute_ticket_hashes  # noqa: E402
+
+
+@pytest.fixture
+def worker(monkeypatch, tmp_path):
+    monkeypatch.setenv('LOTTERY_JOB_DIR', str(tmp_path / 'jobs'))
+    return BackgroundWorkerApp().bind_report(lambda *args, **kwargs: None)
+
+
+def numbered_chunks(*sizes):
+    chunks, start = [], 0
+    for size in sizes:
+        chunks.append(pd.DataFrame({'n': range(start, start + size)}, index=range(start, start + size)))
+        start += size
+    return chunks
+
+
+def test_split_re_chunks_without_skipping(worker):
+    batches = list(worker.split_import_chunks(numbered_chunks(5, 3), 2))
+    assert [batch['n'].tolist() for batch in batches] == [[0, 1], [2, 3], [4], [5, 6], [7]]
+
+
+def test_split_skips_committed_prefix_across_chunks(worker):
+    skipped = []
+    batches = list(worker.split_import_chunks(numbered_chunks(5, 5, 5), 2, skip_rows=7, on_skipped=skipped.append))
+    assert [batch['n'].tolist() for batch in batches] == [[7, 8], [9], [10, 11], [12, 13], [14]]
+    assert [part['n'].tolist() for part in skipped] == [[0, 1, 2, 3, 4], [5, 6]]
+
+
+def test_split_skip_on_chunk_boundary(worker):
+    skipped = []
+    batches = list(worker.split_import_chunks(numbered_chunks(4, 4), 3, skip_rows=4, on_skipped=skipped.append))
+    assert [batch['n'].tolist() for batch in batches] == [[4, 5, 6], [7]]
+    assert [part['n'].tolist() for part in skipped] == [[0, 1, 2, 3]]
+
+
+def test_split_skip_everything(worker):
+    assert list(worker.split_import_chunks(numbered_chunks(2, 2), 3, skip_rows=4)) == []
+
+
+def hashed(*keys):
+    return pd.DataFrame({'key': list(keys), 'ticket_hash': [None if key is None else key.encode() for key in keys]})
+
+
+def test_drop_duplicates_within_and_across_batches(worker):
+    seen = set()
+    first, duplicates = worker.drop_in_file_duplicates(hashed('a', 'b', 'a'), seen)
+    assert first['key'].tolist() == ['a', 'b'] and duplicates == 1
+    second, duplicates = worker.drop_in_file_duplicates(hashed('b', 'c', 'c'), seen)
+    assert second['key'].tolist() == ['c'] and duplicates == 2
+    assert seen == {b'a', b'b', b'c'}
+
+
+def test_drop_duplicates_keeps_rows_without_hash(worker):
+    # 哈希为空（关键字段缺失）的记录不参与去重，也不进入已出现集合
+    seen = {None}
+    unique, duplicates = worker.drop_in_file_duplicates(hashed(None, 'a', None), seen)
+    assert unique['ticket_hash'].tolist() == [None, b'a', None] and duplicates == 0
+    unique, duplicates = worker.drop_in_file_duplicates(hashed(None), seen)
+    assert len(unique) == 1 and duplicates == 0
+
+
+def detail_frame(worker, keys):
+    """每个 key 是 (彩票流水号, 兑奖时间)；兑奖时间为空的记录没有去重哈希"""
+    df = pd.DataFrame({column: [None] * len(keys) for column in worker.db_columns})
+    df['彩票流水号'] = [serial for serial, _ in keys]
+    df['方案代码'] = 'F1'
+    df['兑奖时间'] = [redeem_time for _, redeem_time in keys]
+    df['兑奖金额'] = 10
+    return df
+
+
+# 文件按读取块（每块 4 行）给出：第 5、8 行与前面重复，空时间的 N1 出现两次，都应导入
+FILE_KEYS = [
+    ('A', '2025-03-01 10:00:00'), ('B', '2025-03-01 10:00:00'), ('N1', None), ('C', '2025-03-02 10:00:00'),
+    ('a ', '2025-03-01 10:00:00'), ('N1', None), ('D', '2025-03-03 10:00:00'), ('B', '2025-03-01 10:00:00'),
+    ('E', '2025-03-04 10:00:00'), ('N2', None),
+]
+
+
+class FakeCursor:
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchone(self):
+        return (0,)
+
+
+class FakeConnection:
+    def cursor(self, *args):
+        return FakeCursor()
+
+    def commit(self):
+        pass
+
+
+@pytest.fixture
+def fake_db(worker, monkeypatch):
+    """替换数据库访问：记录每批发送的流水号和写入的检查点，可指定第几批插入时失败"""
+    state = {'sent': [], 'checkpoints': [], 'checkpoint': None, 'fail_on_batch': None}
+
+    @contextmanager
+    def get_connection():
+        yield FakeConnection()
+
+    def insert_import_chunk(cursor, df, skip_duplicates, use_load_data):
+        if state['fail_on_batch'] == len(state['sent']) + 1:
+            raise RuntimeError("连接中断")
+        state['sent'].append(df['彩票流水号'].tolist())
+        return len(df), use_load_data
+
+    def save_import_checkpoint(cursor, fingerprint, file_name, committed_rows, imported_rows, status):
+        state['checkpoints'].append((committed_rows, imported_rows, status))
+        state['checkpoint'] = {'已提交行数': committed_rows, '已导入记录数': imported_rows, '状态': status}
+
+    monkeypatch.setattr(worker, 'check_and_create_table', lambda: True)
+    monkeypatch.setattr(worker, 'schema_upgrades_blocking_import', lambda: [])
+    monkeypatch.setattr(worker, 'get_connection', get_connection)
+    monkeypatch.setattr(worker, 'get_month_partitions', lambda cursor: [])
+    monkeypatch.setattr(worker, 'import_lock', lambda cursor: nullcontext())
+    monkeypatch.setattr(worker, 'update_daily_rollup', lambda cursor, before_id: None)
+    monkeypatch.setattr(worker, 'insert_import_chunk', insert_import_chunk)
+    monkeypatch.setattr(worker, 'save_import_checkpoint', save_import_checkpoint)
+    monkeypatch.setattr(worker, 'get_import_checkpoint', lambda fingerprint: state['checkpoint'])
+    return state
+
+
+def run_import(worker, resume=True):
+    df = detail_frame(worker, FILE_KEYS)
+    chunks = [df.iloc[start:start + 4] for start in range(0, len(df), 4)]
+    return worker.import_to_database(
+        chunks, True, {}, chunk_size=3, fingerprint='f' * 64, file_name='test.xlsx', resume=resume
+    )
+
+
+def test_sample_file_hashes(worker):
+    hashes = compute_ticket_hashes(worker.clean_import_data(detail_frame(worker, FILE_KEYS)))
+    assert hashes[0] == hashes[4] and hashes[1] == hashes[7]
+    assert hashes[2] is None and hashes[5] is None and hashes[9] is None
+
+
+def test_full_import_drops_in_file_duplicates(worker, fake_db):
+    success, message = run_import(worker)
+    assert success, message
+    assert sum(fake_db['sent'], []) == ['A', 'B', 'N1', 'C', 'N1', 'D', 'E', 'N2']
+    assert "文件内重复 2 条" in message
+    assert fake_db['checkpoints'][-1] == (10, 8, 'completed')
+
+
+def test_resume_mid_file_sends_the_same_rows(worker, fake_db):
+    # 第二批插入时中断：只有第一批（前 3 行）已提交
+    fake_db['fail_on_batch'] = 2
+    success, message = run_import(worker)
+    assert not success
+    assert fake_db['checkpoint'] == {'已提交行数': 3, '已导入记录数': 3, '状态': 'running'}
+    first_run = sum(fake_db['sent'], [])
+
+    fake_db['fail_on_batch'] = None
+    fake_db['sent'] = []
+    success, message = run_import(worker)
+    assert success, message
+    # 已提交部分里出现过的 A、B 仍算文件内重复；空哈希的 N1 再次出现时照常导入
+    assert first_run + sum(fake_db['sent'], []) == ['A', 'B', 'N1', 'C', 'N1', 'D', 'E', 'N2']
+    assert "从第 4 行断点继续" in message
+    assert fake_db['checkpoints'][-1] == (10, 8, 'completed')
+
+
+def test_resume_disabled_starts_over(worker, fake_db):
+    fake_db['checkpoint'] = {'已提交行数': 3, '已导入记录数': 3, '状态': 'running'}
+    success, message = run_import(worker, resume=False)
+    assert success, message
+    assert sum(fake_db['sent'], []) == ['A', 'B', 'N1', 'C', 'N1', 'D', 'E', 'N2']
+
+
+def test_pending_schema_upgrade_blocks_import(worker, fake_db, monkeypatch):
+    monkeypatch.setattr(worker, 'schema_upgrades_blocking_import', lambda: ['ticket_hash'])
+    success, message = run_import(worker)
+    assert not success and "表结构升级" in message
+    assert fake_db['sent'] == [] and fake_db['checkpoints'] == []
+
+
+class StreamOnlyUpload(io.BytesIO):
+    """上传文件只能按流读取，整体取出内容时失败"""
+
+    def getvalue(self):
+        raise AssertionError("计算指纹时不应复制整个文件")
+
+
+def test_fingerprint_reads_upload_in_blocks(worker):
+    content = os.urandom(3 * 1024 * 1024 + 17)
+    upload = StreamOnlyUpload(content)
+    upload.seek(100)
+    assert worker.file_fingerprint(upload) == hashlib.sha256(content).hexdigest()
+    # 读完回到开头，之后读取预览或分块复制时从头开始
+    assert upload.tell() == 0
@@ -0,0 +1,200 @@
+"""JobManager：任务状态变化（排队→运行→完成/失败/取消）、持久化的状态文件，以及重启后重新读取"""
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lottery_app import CancelToken, JobManager  # noqa: E402
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError("等待超时")
+
+
+def wait_for(manager, job_id, *statuses):
+    wait_until(lambda: (manager.get_job(job_id) or {}).get('status') in statuses)
+    return manager.get_job(job_id)
+
+
+def saved_jobs(job_dir):
+    with open(os.path.join(job_dir, 'jobs.json'), encoding='utf-8') as f:
+        return {job['id']: job for job in json.load(f)}
+
+
+@pytest.fixture
+def release():
+    """让阻塞的任务结束，测试失败时也不会留下卡住的线程"""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def blocking_job(release, result=None):
+    def run(job_id, report):
+        report(0.5, "处理中")
+        release.wait(5)
+        return result or {'message': "完成"}
+    return run
+
+
+def test_queued_running_succeeded(tmp_path, release):
+    manager = JobManager(str(tmp_path), max_workers=1)
+    first = manager.submit('export', "导出1", 'alice', blocking_job(release, {
+        'message': "已导出 3 条记录", 'artifact': {'path': manager.artifact_path('x', '.csv'), 'rows': 3},
+    }))
+    running = wait_for(manager, first, 'running')
+    assert running['started_at'] is not None
+
+    # 唯一的工作线程被占用，第二个任务排队
+    second = manager.submit('export', "导出2", 'bob', blocking_job(release))
+    assert manager.get_job(second)['status'] == 'queued'
+    wait_until(lambda: manager.get_job(first)['progress'] == 0.5)
+    assert manager.get_job(first)['message'] == "处理中"
+    saved = saved_jobs(str(tmp_path))
+    assert saved[first]['status'] == 'running' and saved[second]['status'] == 'queued'
+    assert manager.stats()['running'] == 1 and manager.stats()['queued'] == 1
+
+    release.set()
+    done = wait_for(manager, first, 'succeeded')
+    assert done['progress'] == 1.0 and done['message'] == "已导出 3 条记录" and done['artifact']['rows'] == 3
+    wait_for(manager, second, 'succeeded')
+    assert saved_jobs(str(tmp_path))[first]['status'] == 'succeeded'
+    assert [job['id'] for job in manager.list_jobs(owner='bob')] == [second]
+
+
+def test_failed_job_keeps_error_message(tmp_path):
+    manager = JobManager(str(tmp_path))
+
+    def run(job_id, report):
+        raise ValueError("第 3 行格式错误")
+
+    job_id = manager.submit('import', "导入", 'alice', run)
+    job = wait_for(manager, job_id, 'failed')
+    assert job['message'] == "第 3 行格式错误" and job['finished_at'] is not None
+    assert saved_jobs(str(tmp_path))[job_id]['status'] == 'failed'
+
+
+def test_cancel_running_job(tmp_path):
+    manager = JobManager(str(tmp_path))
+    token = CancelToken()
+
+    def run(job_id, report):
+        while True:
+            token.check()
+            time.sleep(0.01)
+
+    job_id = manager.submit('export', "导出", 'alice', run, cancel_token=token)
+    wait_for(manager, job_id, 'running')
+    assert manager.cancel(job_id)
+    assert wait_for(manager, job_id, 'cancelled')['message'] == "已取消"
+    # 已结束的任务不能再取消
+    assert not manager.cancel(job_id)
+
+
+def test_cancel_queued_job_never_runs(tmp_path, release):
+    manager = JobManager(str(tmp_path), max_workers=1)
+    started = []
+    first = manager.submit('export', "导出1", 'alice', blocking_job(release))
+    wait_for(manager, first, 'running')
+    second = manager.submit('export', "导出2", 'alice', lambda job_id, report: started.append(job_id))
+
+    assert manager.cancel(second)
+    assert manager.get_job(second)['status'] == 'cancelled'
+    assert saved_jobs(str(tmp_path))[second]['status'] == 'cancelled'
+    release.set()
+    wait_for(manager, first, 'succeeded')
+    manager._executor.shutdown(wait=True)
+    assert started == []
+    assert manager.get_job(second)['status'] == 'cancelled'
+
+
+def test_max_pending_rejects_new_jobs(tmp_path, release):
+    manager = JobManager(str(tmp_path), max_workers=1, max_pending=1)
+    manager.submit('export', "导出1", 'alice', blocking_job(release))
+    with pytest.raises(RuntimeError):
+        manager.submit('export', "导出2", 'alice', blocking_job(release))
+
+
+def test_restart_reloads_finished_jobs_and_marks_unfinished_interrupted(tmp_path, release):
+    manager = JobManager(str(tmp_path), max_workers=1)
+    finished = manager.submit('export', "导出", 'alice', lambda job_id, report: {
+        'message': "已导出", 'artifact': {'path': manager.artifact_path(job_id, '.csv'), 'rows': 1},
+    })
+    wait_for(manager, finished, 'succeeded')
+    running = manager.submit('import', "导入", 'alice', blocking_job(release))
+    wait_for(manager, running, 'running')
+    queued = manager.submit('export', "导出2", 'bob', blocking_job(release))
+    blocker = manager.submit('export', "导出3", 'bob', blocking_job(release))
+    wait_for(manager, queued, 'running')
+
+    # 同一任务目录上新建管理器，相当于进程重启后读取状态文件
+    restarted = JobManager(str(tmp_path), max_workers=1)
+    assert restarted.get_job(finished)['status'] == 'succeeded'
+    assert restarted.get_job(finished)['artifact']['rows'] == 1
+    for job_id in (running, queued, blocker):
+        job = restarted.get_job(job_id)
+        assert job['status'] == 'failed' and job['message'] == "服务重启，任务已中断"
+        assert job['finished_at'] is not None
+    assert [job['id'] for job in restarted.list_jobs()] == [blocker, queued, running, finished]
+
+
+def test_corrupt_status_file_starts_empty(tmp_path):
+    with open(os.path.join(str(tmp_path), 'jobs.json'), 'w', encoding='utf-8') as f:
+        f.write('{not json')
+    assert JobManager(str(tmp_path)).list_jobs() == []
+
+
+def test_interactive_results_stay_in_memory(tmp_path):
+    manager = JobManager(str(tmp_path))
+    job_id = manager.submit(
+        'query', "预览查询", 'alice', lambda job_id, report: {'message': "查询到 2 条记录", 'value': [1, 2]},
+        interactive=True
+    )
+    wait_for(manager, job_id, 'succeeded')
+    assert manager.pop_result(job_id) == [1, 2]
+    assert manager.pop_result(job_id) is None
+    path = os.path.join(str(tmp_path), 'jobs.json')
+    assert not os.path.exists(path) or job_id not in saved_jobs(str(tmp_path))
+
+
+def test_cleanup_runs_after_finished_and_queued_cancelled_jobs(tmp_path, release):
+    manager = JobManager(str(tmp_path), max_workers=1)
+    cleaned = []
+    first = manager.submit('import', "导入1", 'alice', blocking_job(release), cleanup=lambda: cleaned.append('first'))
+    wait_for(manager, first, 'running')
+    second = manager.submit('import', "导入2", 'alice', blocking_job(release), cleanup=lambda: cleaned.append('second'))
+    assert manager.cancel(second)
+    release.set()
+    wait_for(manager, first, 'succeeded')
+    manager._executor.shutdown(wait=True)
+    assert sorted(cleaned) == ['first', 'second']
+
+
+def test_restart_clears_temp_files(tmp_path):
+    fd, path = JobManager(str(tmp_path)).create_temp_file('.xlsx')
+    os.close(fd)
+    assert os.path.exists(path) and path.endswith('.xlsx')
+    JobManager(str(tmp_path))
+    assert not os.path.exists(path)
+
+
+def test_unique_job_is_not_submitted_twice(tmp_path, release):
+    manager = JobManager(str(tmp_path))
+    first = manager.submit('replica', "同步", 'alice', blocking_job(release), unique=True)
+    assert manager.submit('replica', "同步", 'bob', blocking_job(release), unique=True) == first
+    assert manager.active_job('replica')['id'] == first
+    assert manager.active_job('export') is None
+    release.set()
+    wait_for(manager, first, 'succeeded')
+    assert manager.active_job('replica') is None
+    assert manager.submit('replica', "同步", 'bob', blocking_job(release), unique=True) != first
@@ -0,0 +1,102 @@
+"""表结构升级：登录时只按元数据检查待完成的步骤，整表回填、加唯一键、建索引、生成汇总表由 upgrade_schema 执行"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lottery_app import BackgroundWorkerApp  # noqa: E402
+
+
+class SchemaCursor:
+    """按语句返回模拟的表结构；记录执行过的 ALTER，并让它们改变模拟的索引"""
+
+    def __init__(self, worker, indexes, unique_indexes, has_hash_column=True, has_rollup=True):
+        self.worker = worker
+        self.indexes = dict(indexes)
+        self.unique_indexes = set(unique_indexes)
+        self.has_hash_column = has_hash_column
+        self.has_rollup = has_rollup
+        self.executed = []
+        self.result = []
+
+    def execute(self, sql, params=None):
+        sql = ' '.join(sql.split())
+        self.executed.append(sql)
+        if 'information_schema.statistics' in sql:
+            self.result = [
+                (name, column, 0 if name in self.unique_indexes else 1)
+                for name, columns in self.indexes.items() for column in columns
+            ]
+        elif sql.startswith('SHOW TABLES'):
+            self.result = [(self.worker.rollup_table,)] if self.has_rollup else []
+        elif sql.startswith('DESCRIBE'):
+            self.result = [(column,) for column in ['id'] + self.worker.db_columns]
+            if self.has_hash_column:
+                self.result.append(('ticket_hash',))
+        elif 'ADD UNIQUE KEY uk_ticket_hash' in sql:
+            self.indexes['uk_ticket_hash'] = ['ticket_hash']
+            self.unique_indexes.add('uk_ticket_hash')
+        elif 'DROP INDEX unique_ticket' in sql:
+            del self.indexes['unique_ticket']
+            self.unique_indexes.discard('unique_ticket')
+        elif 'ADD INDEX' in sql:
+            name = sql.split('ADD INDEX ')[1].split(' ')[0]
+            self.indexes[name] = self.worker.secondary_indexes[name]
+
+    def fetchall(self):
+        return self.result
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+
+@pytest.fixture
+def worker(monkeypatch, tmp_path):
+    monkeypatch.setenv('LOTTERY_JOB_DIR', str(tmp_path / 'jobs'))
+    return BackgroundWorkerApp().bind_report(lambda *args, **kwargs: None)
+
+
+def upgraded_indexes(worker):
+    indexes = {'PRIMARY': ['id'], 'uk_ticket_hash': ['ticket_hash']}
+    indexes.update(worker.secondary_indexes)
+    return indexes
+
+
+def test_upgraded_table_has_nothing_pending(worker):
+    cursor = SchemaCursor(worker, upgraded_indexes(worker), {'PRIMARY', 'uk_ticket_hash'})
+    assert worker.pending_schema_upgrades(cursor) == []
+    # 只查询元数据
+    assert all(sql.startswith(('SELECT index_name', 'SHOW TABLES')) for sql in cursor.executed)
+
+
+def test_old_table_lists_every_step(worker):
+    cursor = SchemaCursor(
+        worker, {'PRIMARY': ['id'], 'unique_ticket': ['彩票流水号', '方案代码', '兑奖时间', '兑奖金额']},
+        {'PRIMARY', 'unique_ticket'}, has_hash_column=False, has_rollup=False
+    )
+    assert worker.pending_schema_upgrades(cursor) == ['ticket_hash', 'drop_unique_ticket', 'secondary_indexes', 'daily_rollup']
+
+
+def test_upgrade_runs_steps_in_order(worker, monkeypatch):
+    cursor = SchemaCursor(
+        worker, {'PRIMARY': ['id'], 'unique_ticket': ['彩票流水号']}, {'PRIMARY', 'unique_ticket'}, has_hash_column=False
+    )
+    backfilled = []
+    monkeypatch.setattr(worker, 'backfill_ticket_hash', lambda connection, cursor: backfilled.append(len(cursor.executed)))
+    worker.upgrade_schema(None, cursor)
+
+    alters = [sql for sql in cursor.executed if sql.startswith('ALTER')]
+    assert 'ADD COLUMN ticket_hash' in alters[0]
+    # 回填在加列之后、加唯一键之前；旧唯一键在哈希唯一键建立后才删除
+    assert cursor.executed.index(alters[0]) < backfilled[0] <= cursor.executed.index(alters[1])
+    assert 'ADD UNIQUE KEY uk_ticket_hash' in alters[1] and 'DROP INDEX unique_ticket' in alters[2]
+    assert worker.pending_schema_upgrades(cursor) == []
+
+
+def test_upgrade_reports_steps_left_undone(worker, monkeypatch):
+    cursor = SchemaCursor(worker, upgraded_indexes(worker), {'PRIMARY', 'uk_ticket_hash'}, has_rollup=False)
+    monkeypatch.setattr(worker, 'ensure_daily_rollup_table', lambda cursor: None)
+    with pytest.raises(RuntimeError, match="按天汇总表"):
+        worker.upgrade_schema(None, cursor)
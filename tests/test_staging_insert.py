@@ -0,0 +1,96 @@
+"""暂存表集合去重：写入暂存表不用 IGNORE 且在严格模式下执行，写不进去的行被跳过并报告，
+不会被截断或改成零值后进入明细表；IGNORE 只用于最终 INSERT ... SELECT 跳过唯一键重复"""
+import os
+import sys
+
+import pandas as pd
+import pymysql
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lottery_app import BackgroundWorkerApp  # noqa: E402
+
+
+@pytest.fixture
+def worker(monkeypatch, tmp_path):
+    monkeypatch.setenv('LOTTERY_JOB_DIR', str(tmp_path / 'jobs'))
+    worker = BackgroundWorkerApp()
+    messages = []
+    worker.bind_report(lambda progress=None, message=None: messages.append(message))
+    worker.messages = messages
+    return worker
+
+
+class StagingCursor:
+    """模拟严格模式：流水号为 BAD 的行写入暂存表时报错"""
+
+    def __init__(self, worker):
+        self.serial_index = worker.db_columns.index('彩票流水号')
+        self.statements = []
+        self.sql_mode = 'ONLY_FULL_GROUP_BY'
+        self.staged = []
+        self.rowcount = 0
+        self.result = None
+
+    def _check(self, row):
+        if 'STRICT_ALL_TABLES' in self.sql_mode and row[self.serial_index] == 'BAD':
+            raise pymysql.err.DataError(1406, "Data too long for column '彩票流水号'")
+
+    def execute(self, sql, params=None):
+        sql = ' '.join(sql.split())
+        self.statements.append(sql)
+        if sql == "SELECT @@SESSION.sql_mode":
+            self.result = (self.sql_mode,)
+        elif sql.startswith("SET SESSION sql_mode = CONCAT_WS"):
+            self.sql_mode += ',STRICT_ALL_TABLES'
+        elif sql.startswith("SET SESSION sql_mode"):
+            self.sql_mode = params[0]
+        elif sql.startswith("INSERT INTO tmp_import_staging"):
+            self._check(params)
+            self.staged.append(params)
+            self.rowcount = 1
+        elif sql.startswith("DELETE FROM tmp_import_staging"):
+            self.staged = []
+        elif sql.startswith("INSERT IGNORE"):
+            self.rowcount = len(self.staged)
+        return self.rowcount
+
+    def executemany(self, sql, rows):
+        self.statements.append(' '.join(sql.split()))
+        for row in rows:
+            self._check(row)
+        self.staged.extend(rows)
+        self.rowcount = len(rows)
+
+    def fetchone(self):
+        return self.result
+
+
+def batch(worker, serials):
+    df = pd.DataFrame({column: [None] * len(serials) for column in worker.db_columns})
+    df['彩票流水号'] = serials
+    df['ticket_hash'] = [serial.encode() for serial in serials]
+    return df
+
+
+def test_rejected_rows_are_skipped_and_reported(worker):
+    cursor = StagingCursor(worker)
+    assert worker.insert_via_staging_table(cursor, batch(worker, ['T1', 'BAD', 'T2'])) == 2
+    assert [row[cursor.serial_index] for row in cursor.staged] == ['T1', 'T2']
+    assert any("跳过无法写入的记录: 流水号=BAD" in message for message in worker.messages)
+    assert any("无法写入 1 条" in message for message in worker.messages)
+    # 会话原来的 sql_mode 已恢复
+    assert cursor.sql_mode == 'ONLY_FULL_GROUP_BY'
+
+
+def test_ignore_only_on_final_insert(worker):
+    cursor = StagingCursor(worker)
+    assert worker.insert_via_staging_table(cursor, batch(worker, ['T1', 'T2'])) == 2
+    staging_inserts = [sql for sql in cursor.statements if 'INTO tmp_import_staging' in sql]
+    assert staging_inserts and all(sql.startswith("INSERT INTO") for sql in staging_inserts)
+    final_inserts = [sql for sql in cursor.statements if sql.startswith("INSERT IGNORE")]
+    assert len(final_inserts) == 1 and f"INTO {worker.table_name}" in final_inserts[0]
+    # 严格模式只在写入暂存表时开启
+    final_index = cursor.statements.index(final_inserts[0])
+    assert cursor.statements[final_index - 1].startswith("SET SESSION sql_mode = %s")
@@ -0,0 +1,113 @@
+"""compute_ticket_hashes 与 ticket_hash_sql：客户端哈希必须等于 MySQL 对入库后的值计算的哈希。
+MySQL 一侧按 ticket_hash_sql 的规则（LOWER(RTRIM()) 文本、DATETIME / DECIMAL(10,2) 转字符、
+哨兵兑奖时间视为空、任一列为空时整体为 NULL）在测试中复算"""
+import hashlib
+import os
+import sys
+from datetime import datetime
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from lottery_app import (  # noqa: E402
+    REDEEM_TIME_SENTINEL, TICKET_HASH_SEPARATOR, TICKET_KEY_COLUMNS, compute_ticket_hashes, ticket_hash_sql,
+)
+
+
+def stored_hash(serial, scheme_code, redeem_time, amount):
+    """按 ticket_hash_sql 对入库后的值（时间已是整秒文本，金额已是两位小数文本）计算哈希"""
+    if redeem_time == REDEEM_TIME_SENTINEL:
+        redeem_time = None
+    values = [serial, scheme_code, redeem_time, amount]
+    if None in values:
+        return None
+    values[0] = values[0].rstrip(' ').lower()
+    values[1] = values[1].rstrip(' ').lower()
+    return hashlib.md5(TICKET_HASH_SEPARATOR.join(values).encode('utf-8')).digest()
+
+
+def frame(rows):
+    return pd.DataFrame(rows, columns=TICKET_KEY_COLUMNS)
+
+
+def test_sql_expression_follows_the_documented_rules():
+    sql = ticket_hash_sql("t")
+    assert "LOWER(RTRIM(t.`彩票流水号`))" in sql
+    assert "LOWER(RTRIM(t.`方案代码`))" in sql
+    assert f"CAST(NULLIF(t.`兑奖时间`, '{REDEEM_TIME_SENTINEL}') AS CHAR)" in sql
+    assert "CAST(t.`兑奖金额` AS CHAR)" in sql
+    assert sql.count("CHAR(31 USING utf8mb4)") == 3
+    assert ord(TICKET_HASH_SEPARATOR) == 31
+
+
+def test_hash_matches_stored_values():
+    hashes = compute_ticket_hashes(frame([['T001', 'F1', '2025-03-01 10:00:00', 10]]))
+    assert hashes == [stored_hash('T001', 'F1', '2025-03-01 10:00:00', '10.00')]
+    assert len(hashes[0]) == 16
+
+
+def test_case_and_trailing_space_variants_share_a_hash():
+    hashes = compute_ticket_hashes(frame([
+        ['abc1', 'f1', '2025-03-01 10:00:00', 10],
+        ['ABC1  ', 'F1 ', '2025-03-01 10:00:00', 10],
+        ['Abc1', 'F1', '2025-03-01 10:00:00', 10],
+    ]))
+    assert hashes[0] == hashes[1] == hashes[2]
+    # 前导空格在 MySQL 中也参与比较，不能去掉
+    assert compute_ticket_hashes(frame([[' abc1', 'f1', '2025-03-01 10:00:00', 10]]))[0] != hashes[0]
+
+
+@pytest.mark.parametrize('row', [
+    [None, 'F1', '2025-03-01 10:00:00', 10],
+    ['T001', None, '2025-03-01 10:00:00', 10],
+    ['T001', 'F1', None, 10],
+    ['T001', 'F1', '2025-03-01 10:00:00', None],
+    ['T001', 'F1', '', 10],
+    ['T001', 'F1', REDEEM_TIME_SENTINEL, 10],
+    ['T001', 'F1', datetime(1000, 1, 1), 10],
+])
+def test_null_keys_and_sentinel_have_no_hash(row):
+    assert compute_ticket_hashes(frame([row])) == [None]
+
+
+def test_missing_time_in_datetime_column_has_no_hash():
+    df = frame([['T001', 'F1', '2025-03-01 10:00:00', 10], ['T002', 'F1', '2025-03-01 10:00:00', 10]])
+    df['兑奖时间'] = pd.to_datetime(df['兑奖时间'])
+    df.loc[1, '兑奖时间'] = pd.NaT
+    hashes = compute_ticket_hashes(df)
+    assert hashes[0] == stored_hash('T001', 'F1', '2025-03-01 10:00:00', '10.00')
+    assert hashes[1] is None
+
+
+@pytest.mark.parametrize('redeem_time, stored', [
+    ('2025-03-01 10:00:00.499999', '2025-03-01 10:00:00'),
+    ('2025-03-01 10:00:00.5', '2025-03-01 10:00:01'),
+    ('2025-03-01 23:59:59.700', '2025-03-02 00:00:00'),
+    ('2025-03-01 10:00:02.5', '2025-03-01 10:00:03'),
+])
+def test_fractional_seconds_round_half_up_like_datetime(redeem_time, stored):
+    expected = stored_hash('T001', 'F1', stored, '10.00')
+    text_frame = frame([['T001', 'F1', redeem_time, 10]])
+    assert compute_ticket_hashes(text_frame) == [expected]
+    # datetime64 列走向量化路径，结果必须相同
+    text_frame['兑奖时间'] = pd.to_datetime(text_frame['兑奖时间'])
+    assert compute_ticket_hashes(text_frame) == [expected]
+    assert compute_ticket_hashes(frame([['T001', 'F1', pd.Timestamp(redeem_time).to_pydatetime(), 10]])) == [expected]
+
+
+@pytest.mark.parametrize('amount, stored', [
+    (10, '10.00'),
+    (10.0, '10.00'),
+    ('10', '10.00'),
+    (Decimal('10.5'), '10.50'),
+    (0.1 + 0.2, '0.30'),
+    (10.005, '10.01'),
+    (1234567.891, '1234567.89'),
+])
+def test_amount_formatted_like_decimal_10_2(amount, stored):
+    assert compute_ticket_hashes(frame([['T001', 'F1', '2025-03-01 10:00:00', amount]])) == [
+        stored_hash('T001', 'F1', '2025-03-01 10:00:00', stored)
+    ]